@@ -1,15 +1,21 @@
 import json
+import re
 
+# The size of the blocks the streaming reader reads its input in.
+_BLOCK_SIZE = 1 << 16
 
-def _matches_format(path_or_file):
-    if isinstance(path_or_file, str):
-        path_or_file = open(path_or_file)
+# The keys of the list of tests in reports (format version 2, and earlier).
+_TEST_KEYS = ('tests', 'Tests')
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+# Strings and brackets, which is all that matters for skipping over a value.
+# A lone quote is the start of a string which does not end in the buffer.
+_skip_token = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]|"', re.DOTALL)
 
-    try:
-        json.load(path_or_file)
-        return True
-    except Exception:
-        return False
+
+def _matches_format(prefix):
+    return prefix.lstrip()[:1] in ('{', '[')
 
 
 def _load_format(path_or_file):
@@ -19,9 +25,166 @@ def _load_format(path_or_file):
     return json.load(path_or_file)
 
 
+class _Reader(object):
+    """Reads the JSON values of a file one at a time, keeping only the value
+    being read in memory."""
+
+    def __init__(self, fileobj):
+        self.file = fileobj
+        self.buf = ''
+        self.pos = 0
+        # The file offset of buf[0].
+        self.offset = fileobj.tell()
+        self.eof = False
+
+    def _fill(self):
+        # Read at least as much as is buffered already, so that a value
+        # spanning many blocks is only tried to be decoded a few times.
+        if self.eof:
+            return False
+        data = self.file.read(max(_BLOCK_SIZE, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def error(self, message):
+        return ValueError("%s at offset %d" % (message,
+                                               self.offset + self.pos))
+
+    def tell(self):
+        return self.offset + self.pos
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end of
+        the input."""
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error("Expecting %r" % char)
+        self.pos += 1
+
+    def next_item(self, end):
+        """Consume the separator after an item of an array or object, and
+        return whether another item follows before `end`."""
+        char = self.peek()
+        self.pos += 1
+        if char == end:
+            return False
+        if char != ',':
+            raise self.error("Expecting ',' or %r" % end)
+        return True
+
+    def decode(self):
+        """Decode the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may go on in the next block.
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self):
+        """Skip over the next array or object without decoding it, by only
+        matching up its brackets and strings."""
+        depth = 0
+        while True:
+            for match in _skip_token.finditer(self.buf, self.pos):
+                token = match.group()
+                if token == '"':
+                    break
+                self.pos = match.end()
+                if token in '[{':
+                    depth += 1
+                elif token in ']}':
+                    depth -= 1
+                    if depth == 0:
+                        return
+            else:
+                self.pos = len(self.buf)
+            if not self._fill():
+                raise self.error("Unterminated value")
+
+
+class _StreamedTests(object):
+    """The list of tests of a report file, decoded one test at a time every
+    time it is iterated over."""
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.offset = offset
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            reader = _Reader(f)
+            reader.expect('[')
+            if reader.peek() == ']':
+                return
+            while True:
+                yield reader.decode()
+                if not reader.next_item(']'):
+                    return
+
+
+def _stream_format(path_or_file):
+    """Read a report like _load_format, except for its list of tests: that is
+    only skipped over here, and decoded one test at a time when iterated
+    over, so the memory used does not grow with the number of tests.
+
+    Only files given by path are streamed, the tests are read again from the
+    path."""
+    if not isinstance(path_or_file, str):
+        return _load_format(path_or_file)
+
+    data = {}
+    test_offsets = {}
+    with open(path_or_file, 'rb') as f:
+        reader = _Reader(f)
+        reader.expect('{')
+        if reader.peek() == '}':
+            reader.pos += 1
+        else:
+            while True:
+                key = reader.decode()
+                if not isinstance(key, basestring):
+                    raise reader.error("Expecting property name")
+                reader.expect(':')
+                if key in _TEST_KEYS and reader.peek() == '[':
+                    test_offsets[key] = reader.tell()
+                    reader.skip()
+                    data[key] = None
+                else:
+                    test_offsets.pop(key, None)
+                    data[key] = reader.decode()
+                if not reader.next_item('}'):
+                    break
+        if reader.peek() != '':
+            raise reader.error("Extra data")
+
+    for key, offset in test_offsets.items():
+        data[key] = _StreamedTests(path_or_file, offset)
+    return data
+
+
 format = {
     'name': 'json',
-    'predicate': _matches_format,
+    'sniff': _matches_format,
     'read': _load_format,
+    'stream': _stream_format,
     'write': json.dump,
 }
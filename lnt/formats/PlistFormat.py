@@ -1,17 +1,15 @@
 import plistlib
 
 
-def _matches_format(path_or_file):
-    try:
-        plistlib.readPlist(path_or_file)
-        return True
-    except Exception:
-        return False
+def _matches_format(prefix):
+    prefix = prefix.lstrip()
+    return prefix.startswith('<') and \
+        ('<!DOCTYPE plist' in prefix or '<plist' in prefix)
 
 
 format = {
     'name': 'plist',
-    'predicate': _matches_format,
+    'sniff': _matches_format,
     'read': plistlib.readPlist,
     'write': plistlib.writePlist,
 }
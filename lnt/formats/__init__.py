@@ -1,10 +1,14 @@
 """
 Utilities for converting to LNT's test format.
 
-LNT formats are described by dictionaries with 'name', 'read', and 'write'
-fields. Only the 'name' field is required. The 'read' field should be a
-callable taking a path_or_file object, the 'write' function should be a
-callable taking a Python object to write, and the path_or_file to write to.
+LNT formats are described by dictionaries with 'name', 'sniff', 'read',
+'stream' and 'write' fields. Only the 'name' field is required. The 'sniff'
+field should be a callable taking the leading bytes of a file and telling
+whether it looks like this format. The 'read' field should be a callable
+taking a path_or_file object, the 'stream' field a callable like 'read' which
+may read the list of tests of the report lazily, and the 'write' function
+should be a callable taking a Python object to write, and the path_or_file to
+write to.
 """
 
 from PlistFormat import format as plist
@@ -14,6 +18,9 @@ formats = [plist, json]
 formats_by_name = dict((f['name'], f) for f in formats)
 format_names = formats_by_name.keys()
 
+# How much of a file is looked at to guess its format.
+_SNIFF_SIZE = 4096
+
 
 def get_format(name):
     """get_format(name) -> [format]
@@ -28,28 +35,22 @@ def guess_format(path_or_file):
     """guess_format(path_or_file) -> [format]
 
     Guess which format should be used to load the given file and return it, if
-    found.
+    found. Only the leading bytes of the file are looked at.
     """
 
-    # Check that files are seekable.
-    is_file = False
-    if not isinstance(path_or_file, str):
-        is_file = True
+    if isinstance(path_or_file, str):
+        with open(path_or_file, 'rb') as f:
+            prefix = f.read(_SNIFF_SIZE)
+    else:
+        # Check that files are seekable.
+        path_or_file.seek(0)
+        prefix = path_or_file.read(_SNIFF_SIZE)
         path_or_file.seek(0)
 
     matches = None
     for f in formats:
-        # Check if the path matches this format, ignoring exceptions.
-        try:
-            try:
-                if not f['predicate'](path_or_file):
-                    continue
-            except Exception:
-                continue
-        finally:
-            if is_file:
-                # Reset seek.
-                path_or_file.seek(0)
+        if not f['sniff'](prefix):
+            continue
 
         # Reject anything which matches multiple formats.
         if matches:
@@ -60,11 +61,14 @@ def guess_format(path_or_file):
     return matches
 
 
-def read_any(path_or_file, format_name):
-    """read_any(path_or_file, format_name) -> [format]
+def read_any(path_or_file, format_name, stream=False):
+    """read_any(path_or_file, format_name, stream=False) -> [format]
 
     Attempt to read any compatible LNT test format file. The format_name can be
     an actual format name, or "<auto>".
+
+    With stream, formats which support it only read the list of tests of the
+    report when it is iterated over, one test at a time.
     """
     # Figure out the input format.
     if format_name == '<auto>':
@@ -80,6 +84,8 @@ def read_any(path_or_file, format_name):
         if f is None or not f.get('read'):
             raise ValueError("unknown input format: %r" % format_name)
 
+    if stream and f.get('stream'):
+        return f['stream'](path_or_file)
     return f['read'](path_or_file)
 
 
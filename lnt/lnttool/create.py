@@ -36,6 +36,21 @@ secret_key = %(secret_key)r
 # REST API authentication
 # api_auth_token = 'secret'
 
+# Number of background threads performing the field change analysis and
+# reports of submitted runs. With 0, submissions wait for that work.
+# post_submit_workers = 2
+
+# Connection pool of the web app for each (non-SQLite) database. Connections
+# stay open across requests; pool_recycle reopens them after that many
+# seconds.
+# db_pool = {'pool_size': 5, 'max_overflow': 10, 'pool_recycle': 3600,
+#            'pool_timeout': 30}
+
+# Codec compressing the stored profiles: 'zlib' (the default), or the faster
+# 'zstd' or 'lz4', whose Python package every server reading the profiles
+# then needs.
+# profile_codec = 'zstd'
+
 # The list of available databases, and their properties. At a minimum, there
 # should be a 'default' entry for the default database.
 databases = {
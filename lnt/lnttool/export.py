@@ -0,0 +1,63 @@
+import click
+
+
+@click.command("export")
+@click.argument("instance_path", type=click.UNPROCESSED)
+@click.option("--database", default="default", show_default=True,
+              help="database to export from")
+@click.option("--testsuite", default="nts", show_default=True,
+              help="testsuite to export from")
+@click.option("--machine", "machines", multiple=True, type=click.UNPROCESSED,
+              help="only export samples of the machine with this name")
+@click.option("--test", "tests", multiple=True, type=click.UNPROCESSED,
+              help="only export samples of the test with this name")
+@click.option("--field", "fields", multiple=True,
+              help="sample fields to export (default: all)")
+@click.option("--min-order", help="first revision to export")
+@click.option("--max-order", help="last revision to export")
+@click.option("--chunk-size", default=10000, show_default=True,
+              help="number of samples per exported chunk")
+@click.option("--output", "-o", type=click.File('w'), default='-',
+              help="file to write the export to (default: stdout)")
+def action_export(instance_path, database, testsuite, machines, tests, fields,
+                  min_order, max_order, chunk_size, output):
+    """export samples in a columnar format
+
+    The samples are written as a header line followed by one JSON document
+    per chunk of samples, holding the values column by column. The same
+    stream is served by the samples/export REST API endpoint.
+    """
+    import contextlib
+    import lnt.server.db.export
+    import lnt.server.instance
+
+    instance = lnt.server.instance.Instance.frompath(instance_path)
+    with contextlib.closing(instance.get_database(database)) as db:
+        session = db.make_session()
+        ts = db.testsuite.get(testsuite)
+        if ts is None:
+            raise click.BadParameter("no test suite %r" % testsuite,
+                                     param_hint="--testsuite")
+
+        machine_ids = [m.id for m in session.query(ts.Machine)
+                       .filter(ts.Machine.name.in_(machines))] \
+            if machines else None
+        test_ids = [t.id for t in session.query(ts.Test)
+                    .filter(ts.Test.name.in_(tests))] if tests else None
+        if (machines and not machine_ids) or (tests and not test_ids):
+            raise click.UsageError("no matching machines or tests")
+        sample_fields = None
+        if fields:
+            fields_by_name = dict((f.name, f) for f in ts.sample_fields)
+            for name in fields:
+                if name not in fields_by_name:
+                    raise click.BadParameter("unknown field %r" % name,
+                                             param_hint="--field")
+            sample_fields = [fields_by_name[name] for name in fields]
+
+        for line in lnt.server.db.export.export_samples(
+                session, ts, chunk_size=chunk_size, machine_ids=machine_ids,
+                test_ids=test_ids, fields=sample_fields, min_order=min_order,
+                max_order=max_order):
+            output.write(line)
+        session.close()
@@ -3,6 +3,7 @@ from .common import init_logger
 from .common import submit_options
 from .convert import action_convert
 from .create import action_create
+from .export import action_export
 from .import_data import action_import
 from .import_report import action_importreport
 from .updatedb import action_updatedb
@@ -31,9 +32,14 @@ import sys
 @click.option("--threaded", is_flag=True, help="use a threaded server")
 @click.option("--processes", default=1, show_default=True,
               help="number of processes to use")
+@click.option("--workers", type=int,
+              help="number of threads performing the field change analysis "
+                   "and reports of submitted runs in the background "
+                   "(default: post_submit_workers from lnt.cfg, or 0 to "
+                   "perform them while handling the submission)")
 def action_runserver(instance_path, hostname, port, reloader, debugger,
                      profiler, profiler_file, profiler_dir, shell, show_sql,
-                     threaded, processes):
+                     threaded, processes, workers):
     """start a new development server
 
 \b
@@ -53,6 +59,8 @@ view the results.
     init_logger(logging.INFO, show_sql=show_sql)
 
     app = lnt.server.ui.app.App.create_standalone(instance_path,)
+    if workers is not None:
+        app.start_post_submit_workers(workers)
     if debugger:
         app.debug = True
     if profiler:
@@ -398,10 +406,14 @@ def action_profile():
 @action_profile.command("upgrade")
 @click.argument("input", type=click.Path(exists=True))
 @click.argument("output", type=click.Path())
-def command_update(input, output):
+@click.option("--codec", type=click.Choice(['zlib', 'zstd', 'lz4']),
+              help="codec to compress the profile with (default: zlib); "
+                   "zstd and lz4 need their Python package to read it")
+def command_update(input, output, codec):
     """upgrade a profile to the latest version"""
     import lnt.testing.profile.profile as profile
-    profile.Profile.fromFile(input).upgrade().save(filename=output)
+    profile.Profile.fromFile(input).upgrade().save(filename=output,
+                                                   codec=codec)
 
 
 @action_profile.command("getVersion")
@@ -441,6 +453,38 @@ def command_code_for_function(input, fn):
         list(profile.Profile.fromFile(input).getCodeForFunction(fn)))
 
 
+@action_profile.command("gc")
+@click.argument("profile_dir", type=click.Path(exists=True, file_okay=False))
+def command_gc(profile_dir):
+    """delete the text pools no profile refers to
+
+    Looks up the text pools the profiles in PROFILE_DIR refer to, and deletes
+    the other pools, except those added while the profiles were read.
+    """
+    import glob
+    import os
+    import time
+    import lnt.testing.profile.profile as profile
+    import lnt.testing.profile.textpool as textpool
+    since = time.time()
+    refs = []
+    for path in glob.glob(os.path.join(profile_dir, '*.lntprof')):
+        try:
+            if os.path.getsize(path) == 0:
+                # A profile being saved; keep the pools added since it was
+                # created, one of them is the pool it will refer to.
+                since = min(since, os.path.getmtime(path))
+                continue
+        except OSError:
+            continue
+        ref = profile.Profile.fromFile(path).getTextPoolReference()
+        if ref is not None:
+            refs.append(ref)
+    store = textpool.TextPoolStore(profile_dir)
+    for ref in store.collect(refs, since):
+        print "deleted %s" % ref
+
+
 def _version_check():
     """
     Check that the installed version of the LNT is up-to-date with the running
@@ -492,6 +536,7 @@ main.add_command(action_check_no_errors)
 main.add_command(action_checkformat)
 main.add_command(action_convert)
 main.add_command(action_create)
+main.add_command(action_export)
 main.add_command(action_import)
 main.add_command(action_importreport)
 main.add_command(action_profile)
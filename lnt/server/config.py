@@ -7,6 +7,11 @@ import re
 import tempfile
 
 import lnt.server.db.v4db
+from lnt.testing.profile.profilev3impl import CODEC_NAMES
+
+# The settings of the db_pool dictionary of lnt.cfg.
+DB_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_recycle',
+                   'pool_timeout')
 
 
 class EmailConfig:
@@ -117,6 +122,9 @@ class Config:
         else:
             blacklist = None
         secretKey = data.get('secret_key', None)
+        post_submit_workers = data.get('post_submit_workers', 0)
+        db_pool = data.get('db_pool', {})
+        profile_codec = data.get('profile_codec', None)
 
         return Config(data.get('name', 'LNT'), data['zorgURL'],
                       dbDir, os.path.join(baseDir, tempDir),
@@ -125,7 +133,8 @@ class Config:
                                                  default_email_config,
                                                  0))
                            for k, v in data['databases'].items()]),
-                      blacklist, schemasDir, api_auth_token)
+                      blacklist, schemasDir, api_auth_token,
+                      post_submit_workers, db_pool, profile_codec)
 
     @staticmethod
     def dummy_instance():
@@ -159,7 +168,10 @@ class Config:
                  databases,
                  blacklist,
                  schemasDir,
-                 api_auth_token=None):
+                 api_auth_token=None,
+                 post_submit_workers=0,
+                 db_pool=None,
+                 profile_codec=None):
         self.name = name
         self.zorgURL = zorgURL
         self.dbDir = dbDir
@@ -174,6 +186,23 @@ class Config:
         for db in self.databases.values():
             db.config = self
         self.api_auth_token = api_auth_token
+        # The number of threads performing post submission jobs. If non-zero,
+        # submissions to the server queue their analysis instead of performing
+        # it before responding.
+        self.post_submit_workers = post_submit_workers
+        # The connection pool settings of the database engines, passed to
+        # sqlalchemy.create_engine (pool_size, max_overflow, pool_recycle
+        # and pool_timeout). They do not apply to SQLite databases.
+        self.db_pool = {}
+        for key, value in (db_pool or {}).items():
+            if key not in DB_POOL_OPTIONS:
+                raise ValueError("unknown db_pool option %r" % key)
+            self.db_pool[key] = value
+        # The codec compressing the profiles stored by the server, see
+        # lnt.testing.profile.profilev3impl; None for the default, zlib.
+        if profile_codec is not None and profile_codec not in CODEC_NAMES:
+            raise ValueError("unknown profile_codec %r" % profile_codec)
+        self.profile_codec = profile_codec
 
     def get_database(self, name):
         """
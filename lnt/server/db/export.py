@@ -0,0 +1,105 @@
+"""
+Bulk export of sample data in a columnar, streamable format.
+
+The export is a sequence of JSON documents, one per line. The first line
+describes the columns::
+
+    {"columns": ["run_id", ...], "format": "lnt-columnar-v1"}
+
+and every following line holds a chunk of rows, stored column by column::
+
+    {"data": [[1, 1], ["machine", "machine"], ...], "rows": 2}
+
+Every chunk can be decoded on its own, so neither the server nor a reader has
+to keep more than one chunk of samples in memory. The keys of the documents
+are written in sorted order.
+"""
+
+import itertools
+import json
+
+from lnt.server.ui.util import convert_revision, revision_sort_key
+
+FORMAT_NAME = 'lnt-columnar-v1'
+
+# The number of samples per exported chunk.
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def query_samples(session, ts, machine_ids=None, test_ids=None, fields=None,
+                  min_order=None, max_order=None):
+    """
+    query_samples(session, ts, ...) -> (column names, query)
+
+    Build a query for the samples of the test-suite `ts`, restricted to the
+    given machine and test ids, and to the orders whose first order field is
+    between the revisions `min_order` and `max_order` (inclusive). `fields`
+    names the sample fields to export; all of them by default.
+    """
+    if fields is None:
+        fields = ts.sample_fields
+    order_field = ts.order_fields[0]
+    names = ['run_id', 'machine', 'order', 'test'] + [f.name for f in fields]
+    columns = [ts.Sample.run_id, ts.Machine.name, order_field.column,
+               ts.Test.name] + [f.column for f in fields]
+
+    q = session.query(*columns) \
+        .select_from(ts.Sample) \
+        .join(ts.Run) \
+        .join(ts.Machine) \
+        .join(ts.Order) \
+        .join(ts.Test)
+    if machine_ids:
+        q = q.filter(ts.Run.machine_id.in_(machine_ids))
+    if test_ids:
+        q = q.filter(ts.Sample.test_id.in_(test_ids))
+    # Use the order sort keys, the revision strings do not compare
+    # numerically. The key of a revision is a prefix of the keys of all
+    # orders it is the first field of, and ':' sorts after every digit.
+    if min_order is not None:
+        q = q.filter(ts.Order.sort_key >=
+                     revision_sort_key(convert_revision(min_order)))
+    if max_order is not None:
+        q = q.filter(ts.Order.sort_key <
+                     revision_sort_key(convert_revision(max_order)) + ':')
+    q = q.order_by(ts.Order.sort_key, ts.Sample.run_id, ts.Sample.id)
+    return names, q
+
+
+def iter_columnar(names, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encode the `rows` (tuples of values for the columns `names`) as the
+    lines of a columnar export, see the module documentation."""
+    yield json.dumps({'format': FORMAT_NAME, 'columns': names},
+                     sort_keys=True) + '\n'
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield json.dumps({'rows': len(chunk),
+                          'data': [list(column) for column in zip(*chunk)]},
+                         sort_keys=True)
+        yield '\n'
+
+
+def export_samples(session, ts, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    """Return a generator of the lines of a columnar export of the samples of
+    `ts` matching `filters`, see query_samples."""
+    names, q = query_samples(session, ts, **filters)
+    return iter_columnar(names, q.yield_per(chunk_size), chunk_size)
+
+
+def read_columnar(lines):
+    """Decode the lines of a columnar export, yielding a dict of column name
+    to values for every chunk."""
+    names = None
+    for line in lines:
+        if not line.strip():
+            continue
+        document = json.loads(line)
+        if names is None:
+            if document.get('format') != FORMAT_NAME:
+                raise ValueError("not an LNT columnar export")
+            names = document['columns']
+            continue
+        yield dict(zip(names, document['data']))
@@ -1,14 +1,18 @@
 import difflib
+from collections import namedtuple
+from operator import attrgetter
+
 import sqlalchemy.sql
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm.exc import ObjectDeletedError
 import lnt.server.reporting.analysis
+from lnt.server.reporting import globalstatus
 from lnt.testing.util.commands import timed
 from lnt.util import logger
 from lnt.server.db.regression import new_regression, RegressionState
 from lnt.server.db.regression import get_ris
+from lnt.server.db.regression import mark_stale_summaries
 from lnt.server.db.regression import rebuild_title
-from sqlalchemy import or_
 from lnt.server.db import rules_manager as rules
 # How many runs backwards to use in the previous run set.
 # More runs are slower (more DB access), but may provide
@@ -18,43 +22,60 @@ FIELD_CHANGE_LOOKBACK = 10
 
 
 def post_submit_tasks(session, ts, run_id):
-    """Run the field change related post submission tasks.
+    """Run the field change related post submission tasks, and store the
+    changes of the run against its baseline for the global status page.
 
     """
     regenerate_fieldchanges_for_run(session, ts, run_id)
+    globalstatus.update_baseline_deltas(session, ts, run_id)
 
 
 def delete_fieldchange(session, ts, change):
     """Delete this field change.  Since it might be attahed to a regression
     via regression indicators, fix those up too.  If this orphans a regression
     delete it as well."""
-    # Find the indicators.
-    indicators = session.query(ts.RegressionIndicator). \
-        filter(ts.RegressionIndicator.field_change_id == change.id). \
-        all()
-    # And all the related regressions.
-    regression_ids = [r.regression_id for r in indicators]
-
-    # Remove the idicators that point to this change.
-    for ind in indicators:
-        session.delete(ind)
-
-    # Now we can remove the change, itself.
-    session.delete(change)
-
-    # We might have just created a regression with no changes.
-    # If so, delete it as well.
+    return delete_fieldchanges(session, ts, [change.id])
+
+
+def delete_fieldchanges(session, ts, change_ids):
+    """Delete the field changes with the given ids, and their regression
+    indicators, with a few bulk statements. Regressions left without changes
+    are deleted as well; their ids are returned."""
+    if not change_ids:
+        return []
+    # Find all the related regressions.
+    regression_ids = set(r for r, in session.query(
+        ts.RegressionIndicator.regression_id)
+        .filter(ts.RegressionIndicator.field_change_id.in_(change_ids)))
+
+    # Remove the indicators that point to these changes, then the changes.
+    session.query(ts.RegressionIndicator) \
+        .filter(ts.RegressionIndicator.field_change_id.in_(change_ids)) \
+        .delete(synchronize_session=False)
+    session.query(ts.FieldChange) \
+        .filter(ts.FieldChange.id.in_(change_ids)) \
+        .delete(synchronize_session=False)
+
+    # We might have just created regressions with no changes.
+    # If so, delete them as well.
     deleted_ids = []
-    for r in regression_ids:
-        remaining = session.query(ts.RegressionIndicator). \
-            filter(ts.RegressionIndicator.regression_id == r). \
-            all()
-        if len(remaining) == 0:
-            r = session.query(ts.Regression).get(r)
-            logger.info("Deleting regression because it has not changes:" +
-                        repr(r))
-            session.delete(r)
-            deleted_ids.append(r)
+    remaining = set()
+    if regression_ids:
+        remaining = set(r for r, in session.query(
+            ts.RegressionIndicator.regression_id)
+            .filter(ts.RegressionIndicator.regression_id.in_(regression_ids))
+            .distinct())
+        deleted_ids = sorted(regression_ids - remaining)
+    if deleted_ids:
+        logger.info("Deleting regressions because they have no changes: " +
+                    repr(deleted_ids))
+        session.query(ts.RegressionSummary) \
+            .filter(ts.RegressionSummary.regression_id.in_(deleted_ids)) \
+            .delete(synchronize_session=False)
+        session.query(ts.Regression) \
+            .filter(ts.Regression.id.in_(deleted_ids)) \
+            .delete(synchronize_session=False)
+    mark_stale_summaries(session, ts, regression_ids=remaining)
     session.commit()
     return deleted_ids
 
@@ -100,63 +121,77 @@ def regenerate_fieldchanges_for_run(session, ts, run_id):
                        "That will be very slow.".format(run_size))
     runinfo = lnt.server.reporting.analysis.RunInfo(session, ts, runs_to_load)
 
+    # Fetch the existing field changes of the order window at once.
+    existing_changes = dict(
+        ((f.field_id, f.test_id), f)
+        for f in session.query(ts.FieldChange)
+        .filter(ts.FieldChange.start_order_id == start_order.id)
+        .filter(ts.FieldChange.end_order_id == end_order.id)
+        .filter(ts.FieldChange.machine_id == run.machine_id))
+
     # Only store fieldchanges for "metric" samples like execution time;
     # not for fields with other data, e.g. hash of a binary
+    stale_ids = []
+    new_changes = []
     for field in list(ts.Sample.get_metric_fields()):
-        for test_id in runinfo.test_ids:
-            f = None
-            result = runinfo.get_comparison_result(
-                runs, previous_runs, test_id, field,
-                ts.Sample.get_hash_of_binary_field())
-            # Try and find a matching FC and update, else create one.
+        results = runinfo.get_comparison_results(
+            runs, previous_runs, field, ts.Sample.get_hash_of_binary_field())
+        for test_id, result in results.items():
+            f = existing_changes.get((field.id, test_id))
+            is_change = result.is_result_performance_change()
+            if f is not None:
+                if not is_change:
+                    # With more data, its not a regression. Kill it!
+                    logger.info("Removing field change: {}".format(f.id))
+                    stale_ids.append(f.id)
+                else:
+                    # Always update FCs with new values.
+                    f.old_value = result.previous
+                    f.new_value = result.current
+                    f.run_id = run.id
+            elif is_change:
+                new_changes.append({
+                    'start_order_id': start_order.id,
+                    'end_order_id': run.order_id,
+                    'machine_id': run.machine_id,
+                    'test_id': test_id,
+                    'field_id': field.id,
+                    'old_value': result.previous,
+                    'new_value': result.current,
+                    'run_id': run.id,
+                })
+    session.commit()
+    delete_fieldchanges(session, ts, stale_ids)
+
+    if new_changes:
+        last_id = session.query(sqlalchemy.func.max(ts.FieldChange.id)) \
+            .scalar() or 0
+        session.bulk_insert_mappings(ts.FieldChange, new_changes)
+        session.commit()
+        created = dict(
+            ((f.field_id, f.test_id), f)
+            for f in session.query(ts.FieldChange)
+            .filter(ts.FieldChange.id > last_id)
+            .filter(ts.FieldChange.run_id == run.id))
+        # Find a regression for every new change, in the order they were
+        # detected.
+        matcher = RegressionMatcher(session, ts)
+        for c in new_changes:
+            f = created[(c['field_id'], c['test_id'])]
             try:
-                f = session.query(ts.FieldChange) \
-                    .filter(ts.FieldChange.start_order == start_order) \
-                    .filter(ts.FieldChange.end_order == end_order) \
-                    .filter(ts.FieldChange.test_id == test_id) \
-                    .filter(ts.FieldChange.machine == run.machine) \
-                    .filter(ts.FieldChange.field_id == field.id) \
-                    .one()
-            except sqlalchemy.orm.exc.NoResultFound:
-                f = None
-
-            if not result.is_result_performance_change() and f:
-                # With more data, its not a regression. Kill it!
-                logger.info("Removing field change: {}".format(f.id))
-                deleted = delete_fieldchange(session, ts, f)
-                continue
-
-            if result.is_result_performance_change() and not f:
-                test = session.query(ts.Test) \
-                    .filter(ts.Test.id == test_id) \
-                    .one()
-                f = ts.FieldChange(start_order=start_order,
-                                   end_order=run.order,
-                                   machine=run.machine,
-                                   test=test,
-                                   field_id=field.id)
-                session.add(f)
-                try:
-                    found, new_reg = identify_related_changes(session, ts,
-                                                              f)
-                except ObjectDeletedError:
-                    # This can happen from time to time.
-                    # So, lets retry once.
-                    found, new_reg = identify_related_changes(session, ts,
-                                                              f)
-
-                if found:
-                    logger.info("Found field change: {}".format(
-                                run.machine))
-
-            # Always update FCs with new values.
-            if f:
-                f.old_value = result.previous
-                f.new_value = result.current
-                f.run = run
+                found, new_reg = identify_related_changes(session, ts, f,
+                                                          matcher)
+            except ObjectDeletedError:
+                # This can happen from time to time.
+                # So, lets retry once.
+                found, new_reg = identify_related_changes(session, ts, f,
+                                                          matcher)
+
+            if found:
+                logger.info("Found field change: {}".format(
+                            run.machine))
     session.commit()
 
-    regressions = session.query(ts.Regression).all()[::-1]
     rules.post_submission_hooks(session, ts, run_id)
 
 
@@ -185,50 +220,200 @@ def percent_similar(a, b):
     return s.ratio()
 
 
-@timed
-def identify_related_changes(session, ts, fc):
-    """Can we find a home for this change in some existing regression? If a
-    match is found add a regression indicator adding this change to that
-    regression, otherwise create a new regression for this change.
+# A field change of an active regression, as indexed by RegressionMatcher.
+# `seq` preserves the order in which the changes were added to the index.
+_IndexedChange = namedtuple('_IndexedChange', [
+    'seq', 'regression_id', 'field_id', 'machine', 'test', 'start', 'end'])
 
-    Regression matching looks for regressions that happen in overlapping order
-    ranges. Then looks for changes that are similar.
 
-    """
-    active_indicators = session.query(ts.RegressionIndicator) \
-        .join(ts.Regression) \
-        .filter(or_(ts.Regression.state == RegressionState.DETECTED,
-                ts.Regression.state == RegressionState.DETECTED_FIXED)) \
-        .options(joinedload(ts.RegressionIndicator.field_change)) \
-        .all()
+def _order_key(order):
+    """The sort key of an order, also for orders not flushed yet."""
+    if order.sort_key is not None:
+        return order.sort_key
+    return order.compute_sort_key()
 
-    for change in active_indicators:
-        regression_change = change.field_change
 
-        if is_overlaping(regression_change, fc):
-            confidence = 0.0
+class _IntervalTree(object):
+    """
+    A static centered interval tree over the (start, end) keys of the given
+    items.
+    """
 
-            confidence += percent_similar(regression_change.machine.name,
-                                          fc.machine.name)
-            confidence += percent_similar(regression_change.test.name,
-                                          fc.test.name)
+    def __init__(self, items):
+        keys = sorted(k for item in items for k in (item.start, item.end))
+        self.center = keys[len(keys) // 2]
+        left, right, here = [], [], []
+        for item in items:
+            if item.end < self.center:
+                left.append(item)
+            elif item.start > self.center:
+                right.append(item)
+            else:
+                here.append(item)
+        self.by_start = sorted(here, key=attrgetter('start'))
+        self.by_end = sorted(here, key=attrgetter('end'), reverse=True)
+        self.left = _IntervalTree(left) if left else None
+        self.right = _IntervalTree(right) if right else None
+
+    def overlapping(self, start, end):
+        """Yield the items whose closed interval intersects [start, end]."""
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if end < node.center:
+                for item in node.by_start:
+                    if item.start > end:
+                        break
+                    yield item
+                if node.left is not None:
+                    nodes.append(node.left)
+            elif start > node.center:
+                for item in node.by_end:
+                    if item.end < start:
+                        break
+                    yield item
+                if node.right is not None:
+                    nodes.append(node.right)
+            else:
+                for item in node.by_start:
+                    yield item
+                if node.left is not None:
+                    nodes.append(node.left)
+                if node.right is not None:
+                    nodes.append(node.right)
+
+
+class RegressionMatcher(object):
+    """
+    Index of the field changes of the active regressions, to find the
+    regression a new field change belongs to.
 
-            if regression_change.field_id == fc.field_id:
+    The changes are kept in an interval tree over the sort keys of their
+    start and end orders, so only the changes with overlapping order ranges
+    are scored, and the name similarities are memoized. Build it once for all
+    the new changes of a submission, see identify_related_changes.
+    """
+
+    def __init__(self, session, ts):
+        self._similarity = {}
+        self._tree = None
+        self._indexed = []
+        self._pending = []
+
+        start_order = aliased(ts.Order)
+        end_order = aliased(ts.Order)
+        rows = session.query(ts.RegressionIndicator.regression_id,
+                             ts.FieldChange.field_id, ts.Machine.name,
+                             ts.Test.name, start_order.sort_key,
+                             end_order.sort_key) \
+            .select_from(ts.RegressionIndicator) \
+            .join(ts.Regression) \
+            .join(ts.FieldChange) \
+            .join(ts.Machine, ts.FieldChange.machine_id == ts.Machine.id) \
+            .join(ts.Test, ts.FieldChange.test_id == ts.Test.id) \
+            .join(start_order,
+                  ts.FieldChange.start_order_id == start_order.id) \
+            .join(end_order, ts.FieldChange.end_order_id == end_order.id) \
+            .filter(ts.Regression.state.in_(
+                [RegressionState.DETECTED, RegressionState.DETECTED_FIXED])) \
+            .order_by(ts.RegressionIndicator.id)
+        for row in rows:
+            self._add(*row)
+
+    def _add(self, regression_id, field_id, machine, test, start, end):
+        self._pending.append(_IndexedChange(
+            len(self._indexed) + len(self._pending), regression_id, field_id,
+            machine, test, start, end))
+        # Rebuild the tree once the changes scanned linearly outnumber the
+        # square root of all the changes.
+        if len(self._pending) ** 2 > len(self._indexed) + len(self._pending):
+            self._indexed.extend(self._pending)
+            self._pending = []
+            self._tree = _IntervalTree(self._indexed)
+
+    def add(self, regression_id, fc):
+        """Index the field change `fc`, which belongs to the regression
+        `regression_id`."""
+        self._add(regression_id, fc.field_id, fc.machine.name, fc.test.name,
+                  _order_key(fc.start_order), _order_key(fc.end_order))
+
+    def _percent_similar(self, a, b):
+        key = (a, b)
+        similarity = self._similarity.get(key)
+        if similarity is None:
+            similarity = percent_similar(a, b)
+            self._similarity[key] = similarity
+        return similarity
+
+    def find(self, fc):
+        """
+        find(fc) -> (regression id, confidence) or (None, None)
+
+        Find the regression of the first indexed change whose order range
+        overlaps the range of `fc` and which is similar enough to it.
+        """
+        if fc.start_order is None or fc.end_order is None:
+            return None, None
+        start = _order_key(fc.start_order)
+        end = _order_key(fc.end_order)
+
+        candidates = [c for c in self._pending
+                      if c.start <= end and c.end >= start]
+        if self._tree is not None:
+            candidates.extend(self._tree.overlapping(start, end))
+        candidates.sort(key=attrgetter('seq'))
+
+        machine = fc.machine.name
+        test = fc.test.name
+        for change in candidates:
+            # Only keep the ranges which are equal or overlap strictly, like
+            # is_overlaping.
+            if not ((change.start == start and change.end == end) or
+                    (change.start < end and start < change.end)):
+                continue
+            confidence = 0.0
+            confidence += self._percent_similar(change.machine, machine)
+            confidence += self._percent_similar(change.test, test)
+            if change.field_id == fc.field_id:
                 confidence += 1.0
 
             if confidence >= 2.0:
-                # Matching
-                MSG = "Found a match: {} with score {}."
-                regression = session.query(ts.Regression) \
-                    .get(change.regression_id)
-                logger.info(MSG.format(str(regression),
-                                       confidence))
-                ri = ts.RegressionIndicator(regression, fc)
-                session.add(ri)
-                # Update the default title if needed.
-                rebuild_title(session, ts, regression)
-                session.commit()
-                return True, regression
+                return change.regression_id, confidence
+        return None, None
+
+
+@timed
+def identify_related_changes(session, ts, fc, matcher=None):
+    """Can we find a home for this change in some existing regression? If a
+    match is found add a regression indicator adding this change to that
+    regression, otherwise create a new regression for this change.
+
+    Regression matching looks for regressions that happen in overlapping order
+    ranges. Then looks for changes that are similar.
+
+    When matching several changes, pass the same RegressionMatcher for all of
+    them; the changes are then flushed instead of committed.
+    """
+    commit = matcher is None
+    if matcher is None:
+        matcher = RegressionMatcher(session, ts)
+
+    regression_id, confidence = matcher.find(fc)
+    if regression_id is not None:
+        # Matching
+        MSG = "Found a match: {} with score {}."
+        regression = session.query(ts.Regression).get(regression_id)
+        logger.info(MSG.format(str(regression),
+                               confidence))
+        ri = ts.RegressionIndicator(regression, fc)
+        session.add(ri)
+        # Update the default title if needed.
+        rebuild_title(session, ts, regression)
+        if commit:
+            session.commit()
+        matcher.add(regression_id, fc)
+        return True, regression
     logger.info("Could not find a partner, creating new Regression for change")
-    new_reg = new_regression(session, ts, [fc.id])
+    new_reg = new_regression(session, ts, [fc.id], commit=commit)
+    matcher.add(new_reg.id, fc)
     return False, new_reg
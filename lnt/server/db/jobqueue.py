@@ -0,0 +1,223 @@
+"""
+A database backed queue for the work that happens after a run was submitted.
+
+Instead of regenerating field changes, running the rule hooks and sending the
+run report while the submitting client waits, a submission can add a job to
+this queue once its run is committed. A pool of worker threads (see
+`lnt runserver --workers`) picks the jobs up and performs them. As the queue
+lives in the database, jobs survive server restarts and can be worked on by
+several server processes at once. A job left running by a worker which died
+is performed again once it has been running for longer than
+STALE_JOB_TIMEOUT.
+"""
+
+import datetime
+import threading
+import traceback
+
+import sqlalchemy
+import sqlalchemy.ext.declarative
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, Text, \
+    and_, or_
+
+from lnt.util import logger
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+# How long a job may run before it is assumed that its worker died, and the
+# job is handed to another worker.
+STALE_JOB_TIMEOUT = datetime.timedelta(hours=1)
+
+
+class JobState:
+    # Waiting for a worker.
+    QUEUED = 0
+    # A worker is performing the job.
+    RUNNING = 1
+    # The job finished successfully.
+    DONE = 2
+    # The job raised an exception, see the job message.
+    FAILED = 3
+    names = {
+        QUEUED: u'queued',
+        RUNNING: u'running',
+        DONE: u'done',
+        FAILED: u'failed',
+    }
+
+
+class PostSubmitJob(Base):
+    __tablename__ = 'PostSubmitJob'
+
+    id = Column("ID", Integer, primary_key=True)
+    testsuite_name = Column("TestSuiteName", String(256))
+    run_id = Column("RunID", Integer)
+    state = Column("State", Integer, index=True)
+    created_time = Column("CreatedTime", DateTime)
+    started_time = Column("StartedTime", DateTime)
+    finished_time = Column("FinishedTime", DateTime)
+    # The traceback of failed jobs.
+    message = Column("Message", Text)
+    # The disable_email and disable_report options of the submission.
+    disable_email = Column("DisableEmail", Boolean)
+    disable_report = Column("DisableReport", Boolean)
+
+    def __init__(self, testsuite_name, run_id, disable_email=False,
+                 disable_report=False):
+        self.testsuite_name = testsuite_name
+        self.run_id = run_id
+        self.disable_email = disable_email
+        self.disable_report = disable_report
+        self.state = JobState.QUEUED
+        self.created_time = datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return '%s%r' % (self.__class__.__name__,
+                         (self.id, self.testsuite_name, self.run_id,
+                          self.state))
+
+    def __json__(self):
+        return {
+            'id': self.id,
+            'testsuite': self.testsuite_name,
+            'run_id': self.run_id,
+            'state': JobState.names[self.state],
+            'created_time': self.created_time,
+            'started_time': self.started_time,
+            'finished_time': self.finished_time,
+            'message': self.message,
+        }
+
+
+def enqueue(session, ts, run_id, disable_email=False, disable_report=False):
+    """Add a post submission job for the run `run_id` of the test-suite `ts`
+    and commit it. Returns the new job."""
+    job = PostSubmitJob(ts.name, run_id, disable_email, disable_report)
+    session.add(job)
+    session.commit()
+    return job
+
+
+def get_job(session, job_id):
+    return session.query(PostSubmitJob) \
+        .filter(PostSubmitJob.id == job_id) \
+        .first()
+
+
+def claim_job(session, stale_timeout=STALE_JOB_TIMEOUT):
+    """Mark the oldest queued job as running and return it, or return None if
+    there is no queued job.
+
+    Jobs which have been running for longer than `stale_timeout` are claimed
+    like queued ones, as the process performing them most likely died before
+    it could finish them.
+
+    The state change is done with a conditional UPDATE so that only one of
+    several workers polling the same database can claim a job.
+    """
+    while True:
+        now = datetime.datetime.utcnow()
+        claimable = or_(PostSubmitJob.state == JobState.QUEUED,
+                        and_(PostSubmitJob.state == JobState.RUNNING,
+                             PostSubmitJob.started_time < now - stale_timeout))
+        job = session.query(PostSubmitJob) \
+            .filter(claimable) \
+            .order_by(PostSubmitJob.id) \
+            .first()
+        if job is None:
+            session.commit()
+            return None
+
+        # Matching the start time as well keeps two workers from both taking
+        # over the same stale job.
+        stale = job.state == JobState.RUNNING
+        claimed = session.query(PostSubmitJob) \
+            .filter(PostSubmitJob.id == job.id) \
+            .filter(PostSubmitJob.state == job.state) \
+            .filter(PostSubmitJob.started_time == job.started_time) \
+            .update({PostSubmitJob.state: JobState.RUNNING,
+                     PostSubmitJob.started_time: now},
+                    synchronize_session=False)
+        session.commit()
+        if claimed == 1:
+            if stale:
+                logger.warning("Performing stale %r again" % job)
+            return job
+
+
+def _finish_job(session, job, state, message=None):
+    job.state = state
+    job.message = message
+    job.finished_time = datetime.datetime.utcnow()
+    session.add(job)
+    session.commit()
+
+
+class WorkerPool(object):
+    """
+    A set of threads performing the queued post submission jobs of all the
+    databases of an LNT instance.
+
+    `perform` is called as perform(config, db_name, db, session, job) for
+    every job; the job fails if it raises an exception.
+    """
+
+    def __init__(self, instance, num_workers, perform, poll_interval=1.0):
+        self.instance = instance
+        self.num_workers = num_workers
+        self.perform = perform
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work,
+                                      name='post-submit-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %d post submission workers" % self.num_workers)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_pending_job():
+                    continue
+            except Exception:
+                logger.error("Post submission worker: " +
+                             traceback.format_exc())
+            self._stop.wait(self.poll_interval)
+
+    def run_pending_job(self):
+        """Perform one queued job from any of the instance databases.
+
+        Returns False if there was no job to perform."""
+        config = self.instance.config
+        for db_name in config.get_database_names():
+            db = self.instance.get_database(db_name)
+            session = db.make_session()
+            try:
+                job = claim_job(session)
+                if job is None:
+                    continue
+                logger.info("Performing %r on database %s" % (job, db_name))
+                try:
+                    self.perform(config, db_name, db, session, job)
+                except Exception:
+                    message = traceback.format_exc()
+                    logger.error("%r failed: %s" % (job, message))
+                    session.rollback()
+                    _finish_job(session, job, JobState.FAILED, message)
+                else:
+                    _finish_job(session, job, JobState.DONE)
+                return True
+            finally:
+                session.close()
+        return False
@@ -11,6 +11,7 @@ import os
 import re
 
 import sqlalchemy
+import sqlalchemy.exc
 import sqlalchemy.ext.declarative
 import sqlalchemy.orm
 from sqlalchemy import Column, String, Integer
@@ -42,7 +43,26 @@ class SchemaVersion(Base):
 # Migrations auto-discovery.
 
 
+_migrations = None
+
+
 def _load_migrations():
+    """
+    Return the available migration scripts, only looking them up on the first
+    call.
+    """
+    global _migrations
+    if _migrations is None:
+        _migrations = _find_migrations()
+    return _migrations
+
+
+def current_version(schema_name='__core__'):
+    """Return the schema version the migration scripts upgrade to."""
+    return _load_migrations()[schema_name]['current_version']
+
+
+def _find_migrations():
     """
     Load available migration scripts from a directory.
 
@@ -181,11 +201,26 @@ def update_schema(engine, versions, available_migrations, schema_name):
     return True
 
 
+def _is_up_to_date(engine, available_migrations):
+    """Check with a single query whether the core schema of the database is
+    at the current version."""
+    try:
+        db_version = engine.execute(
+            sqlalchemy.select([SchemaVersion.version])
+            .where(SchemaVersion.name == '__core__')).scalar()
+    except sqlalchemy.exc.DBAPIError:
+        # There is no SchemaVersion table yet.
+        return False
+    return db_version == available_migrations['__core__']['current_version']
+
+
 def update(engine):
     any_changed = False
 
     # Load the available migrations.
     available_migrations = _load_migrations()
+    if _is_up_to_date(engine, available_migrations):
+        return
 
     Base.metadata.create_all(engine)
 
@@ -0,0 +1,60 @@
+"""This upgrade adds a SortKey column to the Order table of every test-suite.
+
+The key sorts the same way orders compare, so the neighbors of a new order
+can be found with an index range query instead of loading and sorting all the
+orders of the suite.
+"""
+
+import re
+
+from sqlalchemy import Column, Index, String, bindparam, select
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.db.util import add_column
+
+_integral_rex = re.compile(r"[\d]+")
+
+
+def _revision_sort_key(dotted):
+    # Keep in sync with lnt.server.ui.util.revision_sort_key (applied to the
+    # output of convert_revision). Duplicated here to keep this script stable.
+    revision = [int(d) for d in _integral_rex.findall(dotted or '')]
+    return ''.join('%02d%s' % (len(str(i)), i) for i in revision) + '.'
+
+
+def _add_sort_key(engine, suite_id, db_key_name):
+    table_name = '%s_Order' % db_key_name
+    if not engine.has_table(table_name):
+        return
+
+    order_fields = introspect_table(engine, 'TestSuiteOrderFields')
+    field_names = [row[0] for row in engine.execute(
+        select([order_fields.c.Name])
+        .where(order_fields.c.TestSuiteID == suite_id)
+        .order_by(order_fields.c.Ordinal, order_fields.c.ID))]
+
+    add_column(engine, table_name, Column('SortKey', String(256)))
+    order_table = introspect_table(engine, table_name)
+    Index('ix_%s_SortKey' % table_name, order_table.c.SortKey).create(engine)
+
+    updates = []
+    for row in engine.execute(select([order_table])):
+        key = ''.join(_revision_sort_key(row[name]) for name in field_names)
+        updates.append({'order_id': row['ID'], 'sort_key': key})
+    if updates:
+        update = order_table.update() \
+            .where(order_table.c.ID == bindparam('order_id')) \
+            .values(SortKey=bindparam('sort_key'))
+        with engine.begin() as trans:
+            trans.execute(update, updates)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.ID,
+                                            test_suite.c.DBKeyName])))
+
+    for suite_id, db_key_name in suites:
+        _add_sort_key(engine, suite_id, db_key_name)
@@ -0,0 +1,41 @@
+"""This upgrade copies the order SortKey into the Run table of every
+test-suite and indexes it together with the MachineID.
+
+This allows finding the runs of a machine that are adjacent to a given run
+with a bounded index range scan instead of sorting all the orders the machine
+ever reported at.
+"""
+
+from sqlalchemy import Column, Index, String, select
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.db.util import add_column
+
+
+def _add_order_sort_key(engine, db_key_name):
+    run_table_name = '%s_Run' % db_key_name
+    order_table_name = '%s_Order' % db_key_name
+    if not engine.has_table(run_table_name):
+        return
+
+    add_column(engine, run_table_name, Column('OrderSortKey', String(256)))
+    run_table = introspect_table(engine, run_table_name)
+    order_table = introspect_table(engine, order_table_name)
+    Index('ix_%s_MachineID_OrderSortKey' % run_table_name,
+          run_table.c.MachineID, run_table.c.OrderSortKey).create(engine)
+
+    sort_key = select([order_table.c.SortKey]) \
+        .where(order_table.c.ID == run_table.c.OrderID) \
+        .as_scalar()
+    with engine.begin() as trans:
+        trans.execute(run_table.update().values(OrderSortKey=sort_key))
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        db_keys = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in db_keys:
+        _add_order_sort_key(engine, db_key_name)
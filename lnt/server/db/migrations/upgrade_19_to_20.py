@@ -0,0 +1,25 @@
+# Version 20 adds the PostSubmitJob table, a queue of work (field change
+# regeneration, rule hooks, reports) to perform after a run was submitted.
+
+import sqlalchemy
+import sqlalchemy.ext.declarative
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class PostSubmitJob(Base):
+    __tablename__ = 'PostSubmitJob'
+
+    id = Column("ID", Integer, primary_key=True)
+    testsuite_name = Column("TestSuiteName", String(256))
+    run_id = Column("RunID", Integer)
+    state = Column("State", Integer, index=True)
+    created_time = Column("CreatedTime", DateTime)
+    started_time = Column("StartedTime", DateTime)
+    finished_time = Column("FinishedTime", DateTime)
+    message = Column("Message", Text)
+
+
+def upgrade(engine):
+    Base.metadata.create_all(engine)
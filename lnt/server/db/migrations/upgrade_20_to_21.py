@@ -0,0 +1,115 @@
+"""This upgrade adds an OrderGeomean table to every test-suite and fills it.
+
+The table holds, for every machine, order and metric field, the geometric
+mean over all tests of the per-test minimum. The mean trend line of graphs
+reads it instead of aggregating every sample of the machine.
+"""
+
+import itertools
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, \
+    MetaData, Table, and_, func, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+# Keep in sync with lnt.server.reporting.analysis.calc_geomean. Duplicated
+# here to keep this script stable.
+MIN_VALUE_PRECISION = 0.0001
+
+# The number of rows inserted at once.
+_INSERT_BATCH_SIZE = 1000
+
+
+def _geomean(values):
+    values = [v + MIN_VALUE_PRECISION for v in values]
+    exponent = 1. / len(values)
+    return reduce(lambda a, b: a * b,
+                  [v ** exponent for v in values]) - MIN_VALUE_PRECISION
+
+
+def _add_order_geomeans(engine, suite_id, db_key_name, metric_types):
+    run_table_name = '%s_Run' % db_key_name
+    table_name = '%s_OrderGeomean' % db_key_name
+    if not engine.has_table(run_table_name) or engine.has_table(table_name):
+        return
+
+    metadata = MetaData(engine)
+    run_table = Table(run_table_name, metadata, autoload=True)
+    sample_table = Table('%s_Sample' % db_key_name, metadata, autoload=True)
+    Table('%s_Machine' % db_key_name, metadata, autoload=True)
+    Table('%s_Order' % db_key_name, metadata, autoload=True)
+    sample_fields = Table('TestSuiteSampleFields', metadata, autoload=True)
+
+    geomean_table = Table(
+        table_name, metadata,
+        Column('ID', Integer, primary_key=True),
+        Column('MachineID', Integer,
+               ForeignKey('%s_Machine.ID' % db_key_name)),
+        Column('OrderID', Integer, ForeignKey('%s_Order.ID' % db_key_name)),
+        Column('FieldID', Integer, ForeignKey('TestSuiteSampleFields.ID')),
+        Column('Value', Float),
+        Column('StartTime', DateTime))
+    Index('ix_%s_MachineID_FieldID' % table_name,
+          geomean_table.c.MachineID, geomean_table.c.FieldID)
+    geomean_table.create(engine)
+
+    fields = list(engine.execute(
+        select([sample_fields.c.ID, sample_fields.c.Name])
+        .where(and_(sample_fields.c.TestSuiteID == suite_id,
+                    sample_fields.c.Type.in_(metric_types)))
+        .order_by(sample_fields.c.ID)))
+    if not fields:
+        return
+
+    start_times = dict(((machine_id, order_id), start_time)
+                       for machine_id, order_id, start_time in engine.execute(
+        select([run_table.c.MachineID, run_table.c.OrderID,
+                func.min(run_table.c.StartTime)])
+        .group_by(run_table.c.MachineID, run_table.c.OrderID)))
+
+    # The per-test minima come sorted by machine and order, so only those of
+    # one machine and order are held in memory at a time.
+    with engine.begin() as trans:
+        minima = trans.execute(
+            select([run_table.c.MachineID, run_table.c.OrderID] +
+                   [func.min(sample_table.c[name]) for _, name in fields])
+            .select_from(sample_table.join(run_table))
+            .group_by(run_table.c.MachineID, run_table.c.OrderID,
+                      sample_table.c.TestID)
+            .order_by(run_table.c.MachineID, run_table.c.OrderID))
+        rows = []
+        for (machine_id, order_id), group in itertools.groupby(
+                minima, lambda row: (row[0], row[1])):
+            test_minima = [row[2:] for row in group]
+            for i, (field_id, _) in enumerate(fields):
+                values = [m[i] for m in test_minima if m[i] is not None]
+                if not values:
+                    continue
+                try:
+                    value = _geomean(values)
+                except (ValueError, ZeroDivisionError, OverflowError):
+                    continue
+                rows.append({'MachineID': machine_id, 'OrderID': order_id,
+                             'FieldID': field_id, 'Value': value,
+                             'StartTime': start_times.get((machine_id,
+                                                           order_id))})
+            if len(rows) >= _INSERT_BATCH_SIZE:
+                trans.execute(geomean_table.insert(), rows)
+                rows = []
+        if rows:
+            trans.execute(geomean_table.insert(), rows)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+    sample_type = introspect_table(engine, 'SampleType')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.ID,
+                                            test_suite.c.DBKeyName])))
+        metric_types = [row[0] for row in trans.execute(
+            select([sample_type.c.ID])
+            .where(sample_type.c.Name.in_(['Real', 'Integer'])))]
+
+    for suite_id, db_key_name in suites:
+        _add_order_geomeans(engine, suite_id, db_key_name, metric_types)
@@ -0,0 +1,12 @@
+# Version 22 adds a Fingerprint column to the TestSuiteJSONSchemas table. It
+# identifies the schema file and LNT version the test-suite was last
+# synchronized with, so unchanged schema files are not loaded again.
+
+from sqlalchemy import Column, String
+
+from lnt.server.db.util import add_column
+
+
+def upgrade(engine):
+    add_column(engine, 'TestSuiteJSONSchemas',
+               Column('Fingerprint', String(64)))
@@ -0,0 +1,44 @@
+"""This upgrade adds a RegressionSummary table to every test-suite.
+
+The table holds the number of indicators, the machines, the combined impact
+and the age of every regression, and is read by the regression list. It starts
+out empty: the summaries of existing regressions are computed the first time
+the list shows them.
+"""
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, \
+    MetaData, Table, Text, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _add_regression_summary(engine, db_key_name):
+    regression_table_name = '%s_Regression' % db_key_name
+    table_name = '%s_RegressionSummary' % db_key_name
+    if not engine.has_table(regression_table_name) or \
+            engine.has_table(table_name):
+        return
+
+    metadata = MetaData(engine)
+    Table(regression_table_name, metadata, autoload=True)
+    summary_table = Table(
+        table_name, metadata,
+        Column('RegressionID', Integer,
+               ForeignKey('%s.ID' % regression_table_name),
+               primary_key=True),
+        Column('NumIndicators', Integer),
+        Column('Machines', Text),
+        Column('ImpactPrevious', Float),
+        Column('ImpactCurrent', Float),
+        Column('Age', DateTime))
+    summary_table.create(engine)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        _add_regression_summary(engine, db_key_name)
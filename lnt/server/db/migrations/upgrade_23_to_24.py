@@ -0,0 +1,43 @@
+"""This upgrade adds a DailyReportSnapshot table to every test-suite.
+
+The table holds the daily report results of a machine for a range of days, and
+is read by the daily report. It starts out empty: the snapshots are computed
+the first time a report shows them.
+"""
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, \
+    LargeBinary, MetaData, Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _add_daily_report_snapshot(engine, db_key_name):
+    machine_table_name = '%s_Machine' % db_key_name
+    table_name = '%s_DailyReportSnapshot' % db_key_name
+    if not engine.has_table(machine_table_name) or \
+            engine.has_table(table_name):
+        return
+
+    metadata = MetaData(engine)
+    Table(machine_table_name, metadata, autoload=True)
+    snapshot_table = Table(
+        table_name, metadata,
+        Column('ID', Integer, primary_key=True),
+        Column('MachineID', Integer,
+               ForeignKey('%s.ID' % machine_table_name)),
+        Column('StartTime', DateTime),
+        Column('EndTime', DateTime),
+        Column('Data', LargeBinary))
+    Index('ix_%s_DailyReportSnapshot_MachineID_EndTime' % db_key_name,
+          snapshot_table.c.MachineID, snapshot_table.c.EndTime)
+    snapshot_table.create(engine)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        _add_daily_report_snapshot(engine, db_key_name)
@@ -0,0 +1,45 @@
+"""This upgrade adds a SummaryReportData table to every test-suite.
+
+The table holds the summary report datapoints of the runs of a machine at an
+order, and is read by the summary report. It starts out empty: the datapoints
+are computed the first time a report needs them.
+"""
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, LargeBinary, \
+    MetaData, Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _add_summary_report_data(engine, db_key_name):
+    machine_table_name = '%s_Machine' % db_key_name
+    order_table_name = '%s_Order' % db_key_name
+    table_name = '%s_SummaryReportData' % db_key_name
+    if not engine.has_table(machine_table_name) or \
+            engine.has_table(table_name):
+        return
+
+    metadata = MetaData(engine)
+    Table(machine_table_name, metadata, autoload=True)
+    Table(order_table_name, metadata, autoload=True)
+    data_table = Table(
+        table_name, metadata,
+        Column('ID', Integer, primary_key=True),
+        Column('MachineID', Integer,
+               ForeignKey('%s.ID' % machine_table_name)),
+        Column('OrderID', Integer,
+               ForeignKey('%s.ID' % order_table_name)),
+        Column('Data', LargeBinary))
+    Index('ix_%s_SummaryReportData_MachineID_OrderID' % db_key_name,
+          data_table.c.MachineID, data_table.c.OrderID)
+    data_table.create(engine)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        _add_summary_report_data(engine, db_key_name)
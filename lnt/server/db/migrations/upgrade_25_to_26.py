@@ -0,0 +1,47 @@
+"""This upgrade adds a BaselineDelta table to every test-suite.
+
+The table holds the percentage changes between a run and a baseline run, and
+is read by the global status page. It starts out empty: the changes are
+computed when runs are submitted, or the first time the page shows them.
+"""
+
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, MetaData, \
+    Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _add_baseline_delta(engine, db_key_name):
+    run_table_name = '%s_Run' % db_key_name
+    test_table_name = '%s_Test' % db_key_name
+    field_table_name = 'TestSuiteSampleFields'
+    table_name = '%s_BaselineDelta' % db_key_name
+    if not engine.has_table(run_table_name) or engine.has_table(table_name):
+        return
+
+    metadata = MetaData(engine)
+    Table(run_table_name, metadata, autoload=True)
+    Table(test_table_name, metadata, autoload=True)
+    Table(field_table_name, metadata, autoload=True)
+    delta_table = Table(
+        table_name, metadata,
+        Column('ID', Integer, primary_key=True),
+        Column('RunID', Integer, ForeignKey('%s.ID' % run_table_name)),
+        Column('BaselineRunID', Integer,
+               ForeignKey('%s.ID' % run_table_name)),
+        Column('FieldID', Integer, ForeignKey('%s.ID' % field_table_name)),
+        Column('TestID', Integer, ForeignKey('%s.ID' % test_table_name)),
+        Column('Delta', Float))
+    Index('ix_%s_BaselineDelta_RunID_BaselineRunID' % db_key_name,
+          delta_table.c.RunID, delta_table.c.BaselineRunID)
+    delta_table.create(engine)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        _add_baseline_delta(engine, db_key_name)
@@ -0,0 +1,39 @@
+"""This upgrade makes the OrderGeomean rows unique per machine, order and
+metric field.
+
+Imports replace the rows of a machine and order by deleting and inserting
+them, so two imports doing that at the same time could leave duplicates.
+These are dropped, keeping the latest row, before the unique index is added.
+"""
+
+from sqlalchemy import Index, MetaData, Table, func, select
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+def _make_geomeans_unique(engine, db_key_name):
+    table_name = '%s_OrderGeomean' % db_key_name
+    if not engine.has_table(table_name):
+        return
+
+    geomean_table = Table(table_name, MetaData(engine), autoload=True)
+    latest = select([func.max(geomean_table.c.ID)]) \
+        .group_by(geomean_table.c.MachineID, geomean_table.c.OrderID,
+                  geomean_table.c.FieldID)
+    with engine.begin() as trans:
+        trans.execute(geomean_table.delete().where(
+            ~geomean_table.c.ID.in_(latest)))
+
+    Index('ix_%s_MachineID_OrderID_FieldID' % table_name,
+          geomean_table.c.MachineID, geomean_table.c.OrderID,
+          geomean_table.c.FieldID, unique=True).create(engine)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        _make_geomeans_unique(engine, db_key_name)
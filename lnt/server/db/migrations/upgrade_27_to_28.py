@@ -0,0 +1,12 @@
+# Version 28 adds the DisableEmail and DisableReport columns to the
+# PostSubmitJob table, so deferred post submission jobs follow the options of
+# their submission like the ones performed right away.
+
+from sqlalchemy import Boolean, Column
+
+from lnt.server.db.util import add_column
+
+
+def upgrade(engine):
+    add_column(engine, 'PostSubmitJob', Column('DisableEmail', Boolean))
+    add_column(engine, 'PostSubmitJob', Column('DisableReport', Boolean))
@@ -0,0 +1,25 @@
+"""This upgrade adds a ChangeCount column to the Run table of every
+test-suite.
+
+It counts how often a run was replaced or moved to another order, which keeps
+its ID. Reports cached by any server process are keyed by it, so that they
+are not used anymore once one of their runs changes.
+"""
+
+from sqlalchemy import Column, Integer, select
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.db.util import add_column
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        db_keys = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in db_keys:
+        run_table_name = '%s_Run' % db_key_name
+        if engine.has_table(run_table_name):
+            add_column(engine, run_table_name,
+                       Column('ChangeCount', Integer))
@@ -0,0 +1,58 @@
+"""This upgrade makes the report rows computed from the runs unique, and adds
+a Generation column to them.
+
+The SummaryReportData, DailyReportSnapshot and BaselineDelta rows are stored
+by the first request showing them, and discarded when their runs are
+imported. Two requests could store the same rows, and an import committing
+while a request computed them left rows of the earlier runs behind. The
+Generation records which runs a row was computed from, so that such rows are
+computed again.
+
+The rows are dropped, as they lack a generation; the reports compute them
+again when they need them.
+"""
+
+from sqlalchemy import Column, Index, MetaData, String, Table, select
+
+from lnt.server.db.migrations.util import introspect_table
+from lnt.server.db.util import add_column
+
+# The unique index of every table, and the index it replaces, if any.
+_UNIQUE_INDEXES = [
+    ('SummaryReportData', ('MachineID', 'OrderID'),
+     'ix_%s_SummaryReportData_MachineID_OrderID'),
+    ('DailyReportSnapshot', ('MachineID', 'StartTime', 'EndTime'), None),
+    ('BaselineDelta', ('RunID', 'BaselineRunID', 'FieldID', 'TestID'),
+     'ix_%s_BaselineDelta_RunID_BaselineRunID'),
+]
+
+
+def _make_rows_unique(engine, db_key_name, name, columns, replaced_index):
+    table_name = '%s_%s' % (db_key_name, name)
+    if not engine.has_table(table_name):
+        return
+
+    table = Table(table_name, MetaData(engine), autoload=True)
+    with engine.begin() as trans:
+        trans.execute(table.delete())
+    if replaced_index is not None:
+        for index in table.indexes:
+            if index.name == replaced_index % db_key_name:
+                index.drop(engine)
+    add_column(engine, table_name, Column('Generation', String(64)))
+
+    Index('ix_%s_%s' % (table_name, '_'.join(columns)),
+          *[table.c[column] for column in columns], unique=True) \
+        .create(engine)
+
+
+def upgrade(engine):
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        for name, columns, replaced_index in _UNIQUE_INDEXES:
+            _make_rows_unique(engine, db_key_name, name, columns,
+                              replaced_index)
@@ -0,0 +1,45 @@
+"""This upgrade makes PostgreSQL compare the order sort keys byte by byte.
+
+The SortKey of the Order table, and its OrderSortKey copy in the Run table,
+only sort like the orders when compared byte by byte. PostgreSQL compares
+them with the collation of the database instead, which ignores the
+punctuation of the keys in most locales. SQLite compares strings byte by byte
+already, so there is nothing to do there.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import DDLElement
+
+from lnt.server.db.migrations.util import introspect_table
+
+
+class _SetByteCollation(DDLElement):
+    def __init__(self, table_name, column_name):
+        self.table_name = table_name
+        self.column_name = column_name
+
+
+@compiles(_SetByteCollation)
+def _visit_set_byte_collation(element, compiler, **_):
+    return ('ALTER TABLE %s ALTER COLUMN %s TYPE VARCHAR(256) COLLATE "C"' %
+            (compiler.preparer.quote(element.table_name),
+             compiler.preparer.quote(element.column_name)))
+
+
+def upgrade(engine):
+    if engine.dialect.name != 'postgresql':
+        return
+
+    test_suite = introspect_table(engine, 'TestSuite')
+
+    with engine.begin() as trans:
+        suites = list(trans.execute(select([test_suite.c.DBKeyName])))
+
+    for db_key_name, in suites:
+        for table_name, column_name in (
+                ('%s_Order' % db_key_name, 'SortKey'),
+                ('%s_Run' % db_key_name, 'OrderSortKey')):
+            if engine.has_table(table_name):
+                _SetByteCollation(table_name, column_name).execute(
+                    bind=engine)
@@ -1,9 +1,11 @@
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, func
+from sqlalchemy.orm import joinedload
 import datetime
 import re
 from collections import namedtuple
 from lnt.server.reporting.analysis import RunInfo
 from lnt.server.ui.util import guess_test_short_name as shortname
+from lnt.server.ui.util import PrecomputedCR
 
 
 class RegressionState:
@@ -36,9 +38,14 @@ class RegressionState:
 ChangeRuns = namedtuple("ChangeRuns", ["before", "after"])
 ChangeData = namedtuple("ChangeData", ["ri", "cr", "run", "latest_cr"])
 
+# The session.info entry listing, for every test-suite, the regressions, field
+# changes and machines whose regression summaries are out of date.
+_STALE_SUMMARIES = 'lnt_stale_regression_summaries'
 
-def new_regression(session, ts, field_changes):
-    """Make a new regression and add to DB."""
+
+def new_regression(session, ts, field_changes, commit=True):
+    """Make a new regression and add to DB. With commit=False, it is only
+    flushed."""
     today = datetime.date.today()
     MSG = "Regression of 0 benchmarks"
     title = MSG
@@ -49,7 +56,10 @@ def new_regression(session, ts, field_changes):
         ri1 = ts.RegressionIndicator(regression, fc)
         session.add(ri1)
     rebuild_title(session, ts, regression)
-    session.commit()
+    if commit:
+        session.commit()
+    else:
+        session.flush()
     return regression
 
 
@@ -124,6 +134,29 @@ def get_first_runs_of_fieldchange(session, ts, fc):
     return run
 
 
+def get_first_runs_of_fieldchanges(session, ts, field_changes):
+    """
+    get_first_runs_of_fieldchanges(session, ts, field_changes)
+        -> {field change id: Run}
+
+    Find the first run of the machine of every field change at its end
+    order, with a single query.
+    """
+    if not field_changes:
+        return {}
+    machine_ids = set(fc.machine_id for fc in field_changes)
+    order_ids = set(fc.end_order_id for fc in field_changes)
+    first_run_ids = session.query(func.min(ts.Run.id)) \
+        .filter(ts.Run.machine_id.in_(machine_ids)) \
+        .filter(ts.Run.order_id.in_(order_ids)) \
+        .group_by(ts.Run.machine_id, ts.Run.order_id)
+    runs = dict(((run.machine_id, run.order_id), run)
+                for run in session.query(ts.Run)
+                .filter(ts.Run.id.in_(first_run_ids)))
+    return dict((fc.id, runs.get((fc.machine_id, fc.end_order_id)))
+                for fc in field_changes)
+
+
 def get_cr_for_field_change(session, ts, field_change, current=False):
     """Given a filed_change, calculate a comparison result for that change.
     And the last run."""
@@ -141,7 +174,174 @@ def get_cr_for_field_change(session, ts, field_change, current=False):
     return cr, runs.after[0], runs_all
 
 
+def get_current_crs_for_field_changes(session, ts, field_changes):
+    """
+    get_current_crs_for_field_changes(session, ts, field_changes)
+        -> {field change id: ComparisonResult}
+
+    Compare every field change between the runs of its start order and the
+    runs of the newest order of its machine, like get_cr_for_field_change
+    with current=True. The runs and samples of all the changes are loaded
+    with a few queries.
+    """
+    if not field_changes:
+        return {}
+    machine_ids = set(fc.machine_id for fc in field_changes)
+
+    # Find the newest order of every machine.
+    newest_order_ids = {}
+    for machine_id, order_id, _ in session.query(
+            ts.Run.machine_id, ts.Order.id, ts.Order.llvm_project_revision) \
+            .join(ts.Order) \
+            .filter(ts.Run.machine_id.in_(machine_ids)) \
+            .distinct() \
+            .order_by(asc(ts.Order.llvm_project_revision)):
+        newest_order_ids[machine_id] = order_id
+
+    order_ids = set(newest_order_ids.values())
+    order_ids.update(fc.start_order_id for fc in field_changes)
+    runs_by_order = {}
+    for run in session.query(ts.Run) \
+            .filter(ts.Run.machine_id.in_(machine_ids)) \
+            .filter(ts.Run.order_id.in_(order_ids)) \
+            .order_by(ts.Run.id):
+        runs_by_order.setdefault((run.machine_id, run.order_id),
+                                 []).append(run)
+
+    changes = []
+    run_ids = set()
+    for fc in field_changes:
+        before = runs_by_order.get((fc.machine_id, fc.start_order_id), [])
+        after = runs_by_order.get(
+            (fc.machine_id, newest_order_ids[fc.machine_id]), [])
+        changes.append((fc, before, after))
+        run_ids.update(r.id for r in before + after)
+
+    ri = RunInfo(session, ts, list(run_ids),
+                 only_tests=list(set(fc.test_id for fc in field_changes)))
+    fields = dict((f.id, f) for f in ts.sample_fields)
+    hash_of_binary_field = ts.Sample.get_hash_of_binary_field()
+    return dict((fc.id, ri.get_comparison_result(after, before, fc.test_id,
+                                                 fields[fc.field_id],
+                                                 hash_of_binary_field))
+                for fc, before, after in changes)
+
+
 def get_fieldchange(session, ts, fc_id):
     """Get a fieldchange given an ID."""
     return session.query(ts.FieldChange) \
         .filter(ts.FieldChange.id == fc_id).one()
+
+
+def calc_impact(session, ts, fcs):
+    """Combine the field changes of a regression into a single comparison
+    result: the sums of their previous and current values."""
+    crs = []
+    for fc in fcs:
+        if fc is None:
+            continue
+        if fc.old_value is None:
+            cr, _, _ = get_cr_for_field_change(session, ts, fc)
+        else:
+            cr = PrecomputedCR(fc.old_value, fc.new_value,
+                               fc.field.bigger_is_better)
+        crs.append(cr)
+    if crs:
+        olds = sum([x.previous for x in crs if x.previous])
+        news = sum([x.current for x in crs if x.current])
+        if olds and news:
+            new_cr = PrecomputedCR(olds, news, crs[0].bigger_is_better)
+            # TODO both directions
+            return new_cr
+
+    return PrecomputedCR(1, 1, True)
+
+
+def update_regression_summaries(session, ts, regression_ids):
+    """
+    update_regression_summaries(session, ts, regression_ids)
+
+    Recompute the RegressionSummary rows of the given regressions from their
+    indicators. The summaries of regressions that no longer exist are removed.
+    """
+    regression_ids = set(regression_ids)
+    if not regression_ids:
+        return
+    summary_table = ts.RegressionSummary.__table__
+    session.execute(summary_table.delete().where(
+        summary_table.c.RegressionID.in_(regression_ids)))
+
+    changes = dict((regression_id, []) for regression_id, in
+                   session.query(ts.Regression.id)
+                   .filter(ts.Regression.id.in_(regression_ids)))
+    if not changes:
+        return
+    for regression_id, fc in session.query(
+            ts.RegressionIndicator.regression_id, ts.FieldChange) \
+            .outerjoin(ts.FieldChange) \
+            .options(joinedload(ts.FieldChange.machine),
+                     joinedload(ts.FieldChange.run),
+                     joinedload(ts.FieldChange.field)) \
+            .filter(ts.RegressionIndicator.regression_id.in_(changes)) \
+            .order_by(ts.RegressionIndicator.id):
+        changes[regression_id].append(fc)
+
+    rows = []
+    for regression_id, fcs in changes.items():
+        impact = calc_impact(session, ts, fcs)
+        machines = sorted(set(fc.machine.name for fc in fcs
+                              if fc is not None))
+        # Guess the age of the regression from its first change.
+        age = None
+        if fcs and fcs[0] is not None and fcs[0].run is not None:
+            age = fcs[0].run.end_time
+        rows.append({'RegressionID': regression_id,
+                     'NumIndicators': len(fcs),
+                     'Machines': ', '.join(machines),
+                     'ImpactPrevious': impact.previous,
+                     'ImpactCurrent': impact.current,
+                     'Age': age})
+    session.execute(summary_table.insert(), rows)
+
+
+def mark_stale_summaries(session, ts, regression_ids=(), field_change_ids=(),
+                         machine_ids=()):
+    """Note that the summaries of the given regressions, and of the
+    regressions of the given field changes and machines, are out of date.
+    They are discarded when the session commits, see
+    discard_stale_summaries."""
+    if session is None:
+        return
+    stale = session.info.setdefault(_STALE_SUMMARIES, {})
+    ids = stale.setdefault(ts, (set(), set(), set()))
+    ids[0].update(r for r in regression_ids if r is not None)
+    ids[1].update(field_change_ids)
+    ids[2].update(machine_ids)
+
+
+def _chunks(ids, size=500):
+    """Split a set of ids into sorted lists small enough for an IN clause."""
+    ids = sorted(ids)
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+def discard_stale_summaries(session):
+    """Delete the regression summaries marked out of date in the session; the
+    regression list computes them again when it shows them. Registered to
+    run before every commit of a database session."""
+    session.flush()
+    stale = session.info.pop(_STALE_SUMMARIES, {})
+    for ts, (regression_ids, field_change_ids, machine_ids) in stale.items():
+        for chunk in _chunks(field_change_ids):
+            regression_ids.update(r for r, in session.query(
+                ts.RegressionIndicator.regression_id)
+                .filter(ts.RegressionIndicator.field_change_id.in_(chunk)))
+        for chunk in _chunks(machine_ids):
+            regression_ids.update(r for r, in session.query(
+                ts.RegressionIndicator.regression_id)
+                .join(ts.FieldChange)
+                .filter(ts.FieldChange.machine_id.in_(chunk)))
+        summary_table = ts.RegressionSummary.__table__
+        for chunk in _chunks(regression_ids):
+            session.execute(summary_table.delete().where(
+                summary_table.c.RegressionID.in_(chunk)))
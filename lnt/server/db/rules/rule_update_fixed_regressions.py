@@ -5,48 +5,42 @@ Staged or Active + fixed -> Verify
 from sqlalchemy.orm.session import Session
 
 from lnt.server.db.regression import RegressionState
-from lnt.server.db.regression import get_cr_for_field_change, get_ris
+from lnt.server.db.regression import get_current_crs_for_field_changes
 from lnt.server.db.testsuitedb import TestSuiteDB
 from lnt.testing.util.commands import timed
 from lnt.util import logger
 
 
-def _fixed_rind(session, ts, rind):
-    """Is this regression indicator fixed?"""
-    fc = rind.field_change
-    if fc is None:
-        return False
-    current_cr, _, _ = get_cr_for_field_change(session, ts, fc, current=True)
-    if current_cr.pct_delta < 0.01:
-        return True
-    else:
-        return False
+def fixed_regressions(session, ts, regression_ids):
+    """Comparing the current values to the regressions, which of these
+    regressions are now fixed? A regression is fixed when none of its changes
+    differs by more than 1% anymore."""
+    if not regression_ids:
+        return set()
+    indicators = session.query(ts.RegressionIndicator.regression_id,
+                               ts.FieldChange) \
+        .outerjoin(ts.FieldChange,
+                   ts.RegressionIndicator.field_change_id ==
+                   ts.FieldChange.id) \
+        .filter(ts.RegressionIndicator.regression_id.in_(regression_ids)) \
+        .all()
+    field_changes = dict((fc.id, fc) for _, fc in indicators
+                         if fc is not None)
+    current_crs = get_current_crs_for_field_changes(
+        session, ts, list(field_changes.values()))
+
+    fixed = set(regression_ids)
+    for regression_id, fc in indicators:
+        if fc is None or not current_crs[fc.id].pct_delta < 0.01:
+            fixed.discard(regression_id)
+    return fixed
 
 
 def is_fixed(session, ts, regression):
     """Comparing the current value to the regression, is this regression now
     fixed?
     """
-    r_inds = get_ris(session, ts, regression.id)
-    fixes = [_fixed_rind(session, ts, x) for x in r_inds]
-    return all(fixes)
-
-
-def impacts(session, ts, run_id, regression):
-    # type: (Session, TestSuiteDB, int, object) -> bool
-    """Does this run have a chance of impacting this regression?
-
-    This is just to prevent doing a full comparison, so we don't have
-    to be toally accurate. For now, compare machines."""
-    machine_id = session.query(ts.Run.machine_id).filter(ts.Run.id == run_id).scalar()
-
-    regression_machines = [x[0] for x in session.query(ts.FieldChange.machine_id)
-        .join(ts.RegressionIndicator)
-        .filter(ts.RegressionIndicator.regression_id == regression.id)
-        .all()]
-
-    regression_machines_set = set(regression_machines)
-    return machine_id in regression_machines_set
+    return regression.id in fixed_regressions(session, ts, [regression.id])
 
 
 def age_out_oldest_regressions(session, ts, num_to_keep=50):
@@ -96,39 +90,44 @@ def regression_evolution(session, ts, run_id):
     changed = 0
     evolve_states = [RegressionState.DETECTED, RegressionState.STAGED,
                      RegressionState.ACTIVE]
+
+    # Only the regressions with changes on the machine of the run can be
+    # impacted by it; a full comparison is not needed for the others.
+    machine_id = session.query(ts.Run.machine_id) \
+        .filter(ts.Run.id == run_id).scalar()
+    impacted = session.query(ts.RegressionIndicator.regression_id) \
+        .join(ts.FieldChange) \
+        .filter(ts.FieldChange.machine_id == machine_id) \
+        .subquery()
     regressions = session.query(ts.Regression) \
         .filter(ts.Regression.state.in_(evolve_states)) \
+        .filter(ts.Regression.id.in_(impacted)) \
         .all()
-
-    detects = [r for r in regressions if r.state == RegressionState.DETECTED]
-    staged = [r for r in regressions if r.state == RegressionState.STAGED]
-    active = [r for r in regressions if r.state == RegressionState.ACTIVE]
+    states = dict((r.id, r.state) for r in regressions)
 
     # Remove the oldest detected regressions if needed.
     num_regression_to_keep = 50
-    if len(detects) > num_regression_to_keep:
+    num_detects = session.query(ts.Regression.id) \
+        .filter(ts.Regression.state == RegressionState.DETECTED) \
+        .count()
+    if num_detects > num_regression_to_keep:
         changed += age_out_oldest_regressions(session, ts, num_regression_to_keep)
 
-    for regression in detects:
-        if impacts(session, ts, run_id, regression) and is_fixed(session, ts, regression):
+    fixed = fixed_regressions(session, ts, [r.id for r in regressions])
+    for regression in regressions:
+        if regression.id not in fixed:
+            continue
+        if states[regression.id] == RegressionState.DETECTED:
             logger.info("Detected fixed regression" + str(regression))
             regression.state = RegressionState.IGNORED
-            regression.title = regression.title + " [Detected Fixed]"
-            changed += 1
-
-    for regression in staged:
-        if impacts(session, ts, run_id, regression) and is_fixed(session, ts, regression):
+        elif states[regression.id] == RegressionState.STAGED:
             logger.info("Staged fixed regression" + str(regression))
             regression.state = RegressionState.DETECTED_FIXED
-            regression.title = regression.title + " [Detected Fixed]"
-            changed += 1
-
-    for regression in active:
-        if impacts(session, ts, run_id, regression) and is_fixed(session, ts, regression):
+        else:
             logger.info("Active fixed regression" + str(regression))
             regression.state = RegressionState.DETECTED_FIXED
-            regression.title = regression.title + " [Detected Fixed]"
-            changed += 1
+        regression.title = regression.title + " [Detected Fixed]"
+        changed += 1
 
     session.commit()
     logger.info("Changed the state of {} regressions".format(changed))
@@ -75,6 +75,9 @@ class TestSuiteJSONSchema(Base):
     __tablename__ = 'TestSuiteJSONSchemas'
     testsuite_name = Column("TestSuiteName", String(256), primary_key=True)
     jsonschema = Column("JSONSchema", Binary)
+    # Fingerprint of the schema file the metatables were last synchronized
+    # with, see V4DB.
+    fingerprint = Column("Fingerprint", String(64))
 
     def __init__(self, testsuite_name, data):
         self.testsuite_name = testsuite_name
@@ -452,6 +455,23 @@ def check_testsuite_schema_changes(session, testsuite):
         session.commit()
 
 
+def load_schema_info(testsuite, jsonschema):
+    """Set the display names and units of the sample fields of a testsuite
+    loaded from the database, which are only kept in its json schema."""
+    data = json.loads(jsonschema)
+    metrics = dict((m['name'], m) for m in data.get('metrics', []))
+    for sample_field in testsuite.sample_fields:
+        metric_desc = metrics.get(sample_field.name)
+        if metric_desc is None:
+            continue
+        display_name = metric_desc.get('display_name')
+        sample_field.display_name = sample_field.name \
+            if display_name is None else display_name
+        sample_field.unit = metric_desc.get('unit')
+        sample_field.unit_abbrev = metric_desc.get('unit_abbrev')
+    testsuite.jsonschema = data
+
+
 def _sync_fields(session, existing_fields, new_fields):
     for new_field in new_fields:
         existing = None
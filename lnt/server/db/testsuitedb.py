@@ -6,6 +6,7 @@ suite metadata, so we only create the classes at runtime.
 """
 
 import datetime
+import itertools
 import json
 import os
 
@@ -20,8 +21,11 @@ from lnt.util import logger
 
 import testsuite
 import lnt.testing.profile.profile as profile
+import lnt.testing.profile.textpool as textpool
 import lnt
-from lnt.server.ui.util import convert_revision
+from lnt.server.reporting.analysis import calc_geomean
+from lnt.server.db.regression import mark_stale_summaries
+from lnt.server.ui.util import convert_revision, revision_sort_key
 
 
 def _dict_update_abort_on_duplicates(base_dict, to_merge):
@@ -61,6 +65,18 @@ def make_machine_column(name):
     return Column(name, String(256))
 
 
+# The number of rows to insert, or names to look up, per statement when
+# importing a run.
+_BULK_CHUNK_SIZE = 500
+
+# The type of the order sort keys, which only sort right when compared byte by
+# byte (see revision_sort_key). PostgreSQL compares strings with the collation
+# of the database, which ignores punctuation in most locales; SQLite compares
+# them byte by byte already.
+_sort_key_type = String(256).with_variant(String(256, collation='C'),
+                                          'postgresql')
+
+
 class MachineInfoChanged(ValueError):
     pass
 
@@ -189,27 +205,16 @@ class TestSuiteDB(object):
                 this machine also reported.
                 """
 
-                # FIXME: Scalability! Pretty fast in practice, but still.
+                # The orders are walked through the (machine, order sort key)
+                # index, so this does not depend on the machine's history.
                 ts = Machine.testsuite
-                # Search for best order.
-                best_order = None
-                for order in session.query(ts.Order).\
-                        join(ts.Run).\
-                        filter(ts.Run.machine_id == self.id).distinct():
-                    if order >= order_to_find and \
-                          (best_order is None or order < best_order):
-                        best_order = order
-
-                # Find the most recent run on this machine that used
-                # that order.
-                closest_run = None
-                if best_order:
-                    closest_run = session.query(ts.Run)\
-                        .filter(ts.Run.machine_id == self.id)\
-                        .filter(ts.Run.order_id == best_order.id)\
-                        .order_by(ts.Run.start_time.desc()).first()
-
-                return closest_run
+                return session.query(ts.Run) \
+                    .filter(ts.Run.machine_id == self.id) \
+                    .filter(ts.Run.order_sort_key >=
+                            order_to_find.compute_sort_key()) \
+                    .order_by(ts.Run.order_sort_key,
+                              ts.Run.start_time.desc()) \
+                    .first()
 
             def set_from_dict(self, data):
                 data_name = data.pop('name', None)
@@ -253,6 +258,11 @@ class TestSuiteDB(object):
                                   uselist=False)
             order_name_cache = {}
 
+            # A string which sorts the same way orders compare, see
+            # compute_sort_key(). This allows finding the neighbors of an
+            # order with an index range query instead of sorting all orders.
+            sort_key = Column("SortKey", _sort_key_type, index=True)
+
             # Dynamically create fields for all of the test suite defined order
             # fields.
             class_dict = locals()
@@ -310,6 +320,17 @@ class TestSuiteDB(object):
                            [convert_revision(b.get_field(item),  cache=Order.order_name_cache)
                             for item in self.fields])
 
+            def compute_sort_key(self):
+                """Return the value of the sort_key column for this order.
+
+                Comparing the keys of two orders gives the same result as
+                __cmp__ on the orders themselves."""
+                return ''.join(
+                    revision_sort_key(
+                        convert_revision(self.get_field(item),
+                                         cache=Order.order_name_cache))
+                    for item in self.fields)
+
             def __json__(self, include_id=True):
                 result = {}
                 if include_id:
@@ -330,6 +351,12 @@ class TestSuiteDB(object):
             start_time = Column("StartTime", DateTime)
             end_time = Column("EndTime", DateTime)
             simple_run_id = Column("SimpleRunID", Integer)
+            # Copy of the sort key of the order, so that the runs of a machine
+            # can be walked in order through the compound index created below.
+            order_sort_key = Column("OrderSortKey", _sort_key_type)
+            # The number of times the run was replaced or moved, which tells
+            # cached reports of the run apart (see lnt.server.reporting.runs).
+            change_count = Column("ChangeCount", Integer)
 
             # The parameters blob is used to store any additional information
             # reported by the run but not promoted into the machine record.
@@ -434,19 +461,21 @@ class TestSuiteDB(object):
                 self.created_time = datetime.datetime.now()
                 self.accessed_time = datetime.datetime.now()
 
-                if config is not None:
-                    profileDir = config.config.profileDir
-                    prefix = 't-%s-s-' % os.path.basename(testid)
-                    self.filename = \
-                        profile.Profile.saveFromRendered(encoded,
-                                                         profileDir=profileDir,
-                                                         prefix=prefix)
-
                 p = profile.Profile.fromRendered(encoded)
                 s = ','.join('%s=%s' % (k, v)
                              for k, v in p.getTopLevelCounters().items())
                 self.counters = s[:512]
 
+                if config is not None:
+                    # Store the disassembly text in a pool shared with the
+                    # other profiles of the test.
+                    profileDir = config.config.profileDir
+                    prefix = 't-%s-s-' % os.path.basename(testid)
+                    self.filename = p.upgrade().save(
+                        profileDir=profileDir, prefix=prefix,
+                        pool_store=textpool.TextPoolStore(profileDir),
+                        codec=config.config.profile_codec)
+
             def getTopLevelCounters(self):
                 d = dict()
                 for i in self.counters.split('='):
@@ -731,6 +760,125 @@ class TestSuiteDB(object):
             def __str__(self):
                 return "Baseline({})".format(self.name)
 
+        class OrderGeomean(self.base, ParameterizedMixin):
+            """The geometric mean over all tests of the minimum value of a
+            metric field, for every order a machine has runs at. Kept up to
+            date when runs are imported or deleted, this is what graphs plot
+            as the mean trend line."""
+            __tablename__ = db_key_name + '_OrderGeomean'
+
+            id = Column("ID", Integer, primary_key=True)
+            machine_id = Column("MachineID", Integer, ForeignKey(Machine.id))
+            order_id = Column("OrderID", Integer, ForeignKey(Order.id))
+            field_id = Column("FieldID", Integer,
+                              ForeignKey(testsuite.SampleField.id))
+            value = Column("Value", Float)
+            # The start time of the first run of the machine at the order.
+            start_time = Column("StartTime", DateTime)
+
+            machine = relation(Machine)
+            order = relation(Order)
+            field = relation(testsuite.SampleField)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.machine_id, self.order_id,
+                                     self.field_id, self.value))
+
+        class RegressionSummary(self.base, ParameterizedMixin):
+            """The number of indicators, machines, combined impact and age of
+            a regression. The regression list reads it instead of the
+            indicators of every regression, and computes it again when it is
+            discarded because the indicators changed."""
+            __tablename__ = db_key_name + '_RegressionSummary'
+
+            regression_id = Column("RegressionID", Integer,
+                                   ForeignKey(Regression.id), primary_key=True)
+            num_indicators = Column("NumIndicators", Integer)
+            # The names of the machines of the changes, comma separated.
+            machines = Column("Machines", Text)
+            impact_previous = Column("ImpactPrevious", Float)
+            impact_current = Column("ImpactCurrent", Float)
+            # The end time of the run of the first change.
+            age = Column("Age", DateTime)
+
+            regression = relation(Regression)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.regression_id, self.num_indicators,
+                                     self.machines))
+
+        class DailyReportSnapshot(self.base, ParameterizedMixin):
+            """The daily report results of a machine for the days between
+            StartTime and EndTime, serialized by the daily report. Discarded
+            when a run of the machine in that range is imported or deleted;
+            the report computes it again when it is missing, or when its
+            runs no longer have the generation it was computed from."""
+            __tablename__ = db_key_name + '_DailyReportSnapshot'
+
+            id = Column("ID", Integer, primary_key=True)
+            machine_id = Column("MachineID", Integer, ForeignKey(Machine.id))
+            start_time = Column("StartTime", DateTime)
+            end_time = Column("EndTime", DateTime)
+            data = Column("Data", LargeBinary)
+            # See TestSuiteDB.get_run_generations.
+            generation = Column("Generation", String(64))
+
+            machine = relation(Machine)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.machine_id, self.start_time,
+                                     self.end_time))
+
+        class SummaryReportData(self.base, ParameterizedMixin):
+            """The summary report datapoints of the runs of a machine at an
+            order, serialized by the summary report. Discarded when a run of
+            the machine at the order is imported or deleted; the report
+            computes it again when it is missing, or when its runs no longer
+            have the generation it was computed from."""
+            __tablename__ = db_key_name + '_SummaryReportData'
+
+            id = Column("ID", Integer, primary_key=True)
+            machine_id = Column("MachineID", Integer, ForeignKey(Machine.id))
+            order_id = Column("OrderID", Integer, ForeignKey(Order.id))
+            data = Column("Data", LargeBinary)
+            # See TestSuiteDB.get_run_generations.
+            generation = Column("Generation", String(64))
+
+            machine = relation(Machine)
+            order = relation(Order)
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.machine_id, self.order_id))
+
+        class BaselineDelta(self.base, ParameterizedMixin):
+            """The percentage change of a metric field of a test between a
+            run and a baseline run, as shown by the global status page. Filled
+            in for the default baseline when a run is submitted, and discarded
+            when either run is replaced or deleted. The Generation holds the
+            change counts of both runs when the delta was computed, which
+            tells apart deltas of a run that was replaced since."""
+            __tablename__ = db_key_name + '_BaselineDelta'
+
+            id = Column("ID", Integer, primary_key=True)
+            run_id = Column("RunID", Integer, ForeignKey(Run.id))
+            baseline_run_id = Column("BaselineRunID", Integer,
+                                     ForeignKey(Run.id))
+            field_id = Column("FieldID", Integer,
+                              ForeignKey(testsuite.SampleField.id))
+            test_id = Column("TestID", Integer, ForeignKey(Test.id))
+            delta = Column("Delta", Float)
+            generation = Column("Generation", String(64))
+
+            def __repr__(self):
+                return '%s_%s%r' % (db_key_name, self.__class__.__name__,
+                                    (self.run_id, self.baseline_run_id,
+                                     self.field_id, self.test_id,
+                                     self.delta))
+
         self.Machine = Machine
         self.Run = Run
         self.Test = Test
@@ -742,10 +890,120 @@ class TestSuiteDB(object):
         self.RegressionIndicator = RegressionIndicator
         self.ChangeIgnore = ChangeIgnore
         self.Baseline = Baseline
-
-        # Create the compound index we cannot declare inline.
+        self.OrderGeomean = OrderGeomean
+        self.RegressionSummary = RegressionSummary
+        self.DailyReportSnapshot = DailyReportSnapshot
+        self.SummaryReportData = SummaryReportData
+        self.BaselineDelta = BaselineDelta
+
+        # Orders and runs may be created by other code than the importer (the
+        # REST API, tests, ...), so fill in the sort keys whenever they get
+        # inserted.
+        @sqlalchemy.event.listens_for(Order, 'before_insert')
+        def set_order_sort_key(mapper, connection, order):
+            if order.sort_key is None:
+                order.sort_key = order.compute_sort_key()
+
+        @sqlalchemy.event.listens_for(Run, 'before_insert')
+        def set_run_order_sort_key(mapper, connection, run):
+            if run.order_sort_key is None and run.order is not None:
+                run.order_sort_key = run.order.sort_key
+
+        # The samples of a deleted run no longer count towards the geometric
+        # means and summary reports of its machine and order, nor the daily
+        # reports of its day.
+        @sqlalchemy.event.listens_for(Run, 'after_delete')
+        def update_deleted_run_geomeans(mapper, connection, run):
+            self.update_order_geomeans(connection, run.machine_id,
+                                       run.order_id)
+            self.discard_summary_report_data(connection, run.machine_id,
+                                             run.order_id)
+            self.discard_daily_report_snapshots(connection, run.machine_id,
+                                                run.start_time)
+
+        # The deltas refer to the run, so they have to go first.
+        @sqlalchemy.event.listens_for(Run, 'before_delete')
+        def discard_deleted_run_deltas(mapper, connection, run):
+            self.discard_baseline_deltas(connection, run.id)
+
+        # Moving a run to another machine, order or time increments the
+        # change count stored in its row, so that every process sees the
+        # change (replaced runs take over the count, see _getOrCreateRun).
+        # Other updates, such as recording the file a run was imported from,
+        # leave the reports of the run alone.
+        @sqlalchemy.event.listens_for(Run, 'before_update')
+        def count_changed_run(mapper, connection, run):
+            state = sqlalchemy.inspect(run)
+            if any(state.attrs[name].history.has_changes()
+                   for name in ('machine_id', 'order_id', 'start_time',
+                                'end_time')):
+                run.change_count = \
+                    sqlalchemy.func.coalesce(Run.change_count, 0) + 1
+
+        # Regression summaries are discarded when the session commits; note
+        # which regressions are affected by the flushed changes.
+        @sqlalchemy.event.listens_for(RegressionIndicator, 'after_insert')
+        @sqlalchemy.event.listens_for(RegressionIndicator, 'after_update')
+        @sqlalchemy.event.listens_for(RegressionIndicator, 'before_delete')
+        def mark_indicator_regression(mapper, connection, indicator):
+            history = sqlalchemy.inspect(indicator).attrs.regression_id.history
+            mark_stale_summaries(
+                sqlalchemy.orm.object_session(indicator), self,
+                regression_ids=[indicator.regression_id] +
+                list(history.deleted or []))
+
+        @sqlalchemy.event.listens_for(FieldChange, 'after_update')
+        def mark_field_change_regressions(mapper, connection, field_change):
+            state = sqlalchemy.inspect(field_change)
+            if not any(state.attrs[name].history.has_changes()
+                       for name in ('old_value', 'new_value', 'machine_id',
+                                    'run_id')):
+                return
+            mark_stale_summaries(sqlalchemy.orm.object_session(field_change),
+                                 self, field_change_ids=[field_change.id])
+
+        @sqlalchemy.event.listens_for(Machine, 'after_update')
+        def mark_machine_regressions(mapper, connection, machine):
+            if sqlalchemy.inspect(machine).attrs.name.history.has_changes():
+                mark_stale_summaries(sqlalchemy.orm.object_session(machine),
+                                     self, machine_ids=[machine.id])
+
+        @sqlalchemy.event.listens_for(Regression, 'before_delete')
+        def delete_regression_summary(mapper, connection, regression):
+            summary_table = RegressionSummary.__table__
+            connection.execute(summary_table.delete().where(
+                summary_table.c.RegressionID == regression.id))
+
+        # Create the compound indices we cannot declare inline.
         sqlalchemy.schema.Index("ix_%s_Sample_RunID_TestID" % db_key_name,
                                 Sample.run_id, Sample.test_id)
+        sqlalchemy.schema.Index("ix_%s_Run_MachineID_OrderSortKey" %
+                                db_key_name,
+                                Run.machine_id, Run.order_sort_key)
+        sqlalchemy.schema.Index("ix_%s_OrderGeomean_MachineID_FieldID" %
+                                db_key_name,
+                                OrderGeomean.machine_id, OrderGeomean.field_id)
+        sqlalchemy.schema.Index(
+            "ix_%s_OrderGeomean_MachineID_OrderID_FieldID" % db_key_name,
+            OrderGeomean.machine_id, OrderGeomean.order_id,
+            OrderGeomean.field_id, unique=True)
+        sqlalchemy.schema.Index("ix_%s_DailyReportSnapshot_MachineID_EndTime" %
+                                db_key_name,
+                                DailyReportSnapshot.machine_id,
+                                DailyReportSnapshot.end_time)
+        sqlalchemy.schema.Index(
+            "ix_%s_DailyReportSnapshot_MachineID_StartTime_EndTime" %
+            db_key_name, DailyReportSnapshot.machine_id,
+            DailyReportSnapshot.start_time, DailyReportSnapshot.end_time,
+            unique=True)
+        sqlalchemy.schema.Index("ix_%s_SummaryReportData_MachineID_OrderID" %
+                                db_key_name,
+                                SummaryReportData.machine_id,
+                                SummaryReportData.order_id, unique=True)
+        sqlalchemy.schema.Index(
+            "ix_%s_BaselineDelta_RunID_BaselineRunID_FieldID_TestID" %
+            db_key_name, BaselineDelta.run_id, BaselineDelta.baseline_run_id,
+            BaselineDelta.field_id, BaselineDelta.test_id, unique=True)
 
     def create_tables(self, engine):
         self.base.metadata.create_all(engine)
@@ -896,27 +1154,28 @@ class TestSuiteDB(object):
         # If not, then we need to insert this order into the total ordering
         # linked list.
 
-        # Add the new order and commit, to assign an ID.
+        # Add the new order and flush, to assign an ID and sort key.
         session.add(order)
-        session.commit()
-
-        # Load all the orders.
-        orders = list(session.query(self.Order))
-
-        # Sort the objects to form the total ordering.
-        orders.sort()
-
-        # Find the order we just added.
-        index = orders.index(order)
+        session.flush()
+
+        # Find the neighbors of the new order in the total ordering. Orders
+        # comparing equal to the new one keep their place in front of it.
+        previous_order = session.query(self.Order) \
+            .filter(self.Order.sort_key <= order.sort_key) \
+            .filter(self.Order.id != order.id) \
+            .order_by(self.Order.sort_key.desc(), self.Order.id.desc()) \
+            .first()
+        next_order = session.query(self.Order) \
+            .filter(self.Order.sort_key > order.sort_key) \
+            .order_by(self.Order.sort_key, self.Order.id) \
+            .first()
 
         # Insert this order into the linked list which forms the total
         # ordering.
-        if index > 0:
-            previous_order = orders[index - 1]
+        if previous_order is not None:
             previous_order.next_order_id = order.id
             order.previous_order_id = previous_order.id
-        if index + 1 < len(orders):
-            next_order = orders[index + 1]
+        if next_order is not None:
             next_order.previous_order_id = order.id
             order.next_order_id = next_order.id
 
@@ -954,6 +1213,7 @@ class TestSuiteDB(object):
         # Find the order record.
         order = self._getOrCreateOrder(session, run_parameters)
         new_id = None
+        change_count = None
 
         if merge != 'append':
             existing_runs = session.query(self.Run) \
@@ -972,7 +1232,14 @@ class TestSuiteDB(object):
 
                         # Keep the latest ID so the URL is still valid on replace
                         new_id = previous_run.id
-
+                        change_count = (previous_run.change_count or 0) + 1
+
+                        # The new run takes over the row, which does not
+                        # count as a delete; discard the reports of the day
+                        # of the previous run here.
+                        self.discard_daily_report_snapshots(
+                            session.connection(), machine.id,
+                            previous_run.start_time)
                         session.delete(previous_run)
                 else:
                     raise ValueError('Invalid Run mergeStrategy %r' % merge)
@@ -993,6 +1260,7 @@ class TestSuiteDB(object):
         run_parameters.pop('end_time')
 
         run = self.Run(new_id, machine, order, start_time, end_time)
+        run.change_count = change_count
 
         # First, extract all of the specified run fields.
         for item in self.run_fields:
@@ -1004,22 +1272,57 @@ class TestSuiteDB(object):
         session.add(run)
         return run
 
-    def _importSampleValues(self, session, tests_data, run, config):
-        # Load a map of all the tests, which we will extend when we find tests
-        # that need to be added.
-        # Downcast to str, so we match on MySQL.
-        test_cache = dict((test.name, test)
-                          for test in session.query(self.Test))
+    def _getOrCreateTests(self, session, names):
+        """
+        _getOrCreateTests(session, names) -> {name: test_id}
+
+        Look up the ids of the tests with the given names, inserting the tests
+        which do not exist yet. Only the tests of the submission are queried,
+        in chunks, and missing tests are added with a single bulk insert.
+        """
+        test_ids = dict()
+        for i in range(0, len(names), _BULK_CHUNK_SIZE):
+            chunk = names[i:i + _BULK_CHUNK_SIZE]
+            test_ids.update(session.query(self.Test.name, self.Test.id)
+                            .filter(self.Test.name.in_(chunk)))
+
+        missing = [name for name in names if name not in test_ids]
+        for i in range(0, len(missing), _BULK_CHUNK_SIZE):
+            chunk = missing[i:i + _BULK_CHUNK_SIZE]
+            session.execute(self.Test.__table__.insert(),
+                            [{'Name': name} for name in chunk])
+            test_ids.update(session.query(self.Test.name, self.Test.id)
+                            .filter(self.Test.name.in_(chunk)))
+        return test_ids
 
-        profiles = dict()
+    def _importSampleValues(self, session, tests_data, run, config):
+        # Make sure the run has an ID we can reference from the samples.
+        session.flush()
+
+        # The tests may be read from the submission as they are iterated over
+        # (see lnt.formats.read_any), so import them a chunk at a time.
+        tests_data = iter(tests_data)
+        while True:
+            chunk = list(itertools.islice(tests_data, _BULK_CHUNK_SIZE))
+            if not chunk:
+                break
+            self._importSampleChunk(session, chunk, run, config)
+
+    def _importSampleChunk(self, session, tests_data, run, config):
+        names = list(set(test_data['name'] for test_data in tests_data))
+        test_ids = self._getOrCreateTests(session, names)
+
+        # Build plain rows for the sample table; they are written with
+        # executemany below instead of going through one ORM object each.
+        empty_row = dict((f.name, None) for f in self.sample_fields)
+        empty_row['RunID'] = run.id
+        empty_row['ProfileID'] = None
+        rows = []
+        profiles = []
         field_dict = dict([(f.name, f) for f in self.sample_fields])
         for test_data in tests_data:
             name = test_data['name']
-            test = test_cache.get(name)
-            if test is None:
-                test = self.Test(test_data['name'])
-                test_cache[name] = test
-                session.add(test)
+            test_id = test_ids[name]
 
             samples = []
             for key, values in test_data.items():
@@ -1033,15 +1336,144 @@ class TestSuiteDB(object):
                 if not isinstance(values, list):
                     values = [values]
                 while len(samples) < len(values):
-                    sample = self.Sample(run, test)
-                    session.add(sample)
+                    sample = dict(empty_row)
+                    sample['TestID'] = test_id
                     samples.append(sample)
                 for sample, value in zip(samples, values):
                     if key == 'profile':
                         profile = self.Profile(value, config, name)
-                        sample.profile = profiles.get(hash(value), profile)
+                        session.add(profile)
+                        profiles.append((sample, profile))
                     else:
-                        sample.set_field(field, value)
+                        sample[field.name] = value
+            rows.extend(samples)
+
+        # Profiles still go through the ORM as they write their own files;
+        # flush them to learn their IDs.
+        if profiles:
+            session.flush()
+            for sample, profile in profiles:
+                sample['ProfileID'] = profile.id
+
+        insert = self.Sample.__table__.insert()
+        for i in range(0, len(rows), _BULK_CHUNK_SIZE):
+            session.execute(insert, rows[i:i + _BULK_CHUNK_SIZE])
+
+    def update_order_geomeans(self, connection, machine_id, order_id):
+        """
+        update_order_geomeans(connection, machine_id, order_id)
+
+        Recompute the OrderGeomean rows of a machine and order from the
+        samples of its runs: for every metric field, the geometric mean over
+        all tests of the per-test minimum.
+
+        The rows are unique per machine, order and field, so if another
+        transaction replaces the same rows at the same time, one of the two
+        fails instead of leaving duplicates behind.
+        """
+        run_table = self.Run.__table__
+        geomean_table = self.OrderGeomean.__table__
+        fields = list(self.Sample.get_metric_fields())
+        in_order = and_(run_table.c.MachineID == machine_id,
+                        run_table.c.OrderID == order_id)
+
+        connection.execute(geomean_table.delete().where(
+            and_(geomean_table.c.MachineID == machine_id,
+                 geomean_table.c.OrderID == order_id)))
+        if not fields:
+            return
+
+        minima = connection.execute(
+            select([func.min(f.column) for f in fields])
+            .select_from(self.Sample.__table__.join(run_table))
+            .where(in_order)
+            .group_by(self.Sample.test_id)).fetchall()
+        start_time = connection.execute(
+            select([func.min(run_table.c.StartTime)]).where(in_order)).scalar()
+
+        rows = []
+        for i, field in enumerate(fields):
+            values = [row[i] for row in minima if row[i] is not None]
+            if not values:
+                continue
+            try:
+                value = calc_geomean(values)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                # Not defined for negative values.
+                continue
+            rows.append({'MachineID': machine_id, 'OrderID': order_id,
+                         'FieldID': field.id, 'Value': value,
+                         'StartTime': start_time})
+        if rows:
+            connection.execute(geomean_table.insert(), rows)
+
+    def discard_daily_report_snapshots(self, connection, machine_id,
+                                       start_time=None):
+        """
+        discard_daily_report_snapshots(connection, machine_id, start_time=None)
+
+        Delete the DailyReportSnapshot rows of a machine which include runs
+        started at start_time, or all its rows if start_time is None. The
+        daily report computes them again from the runs.
+        """
+        snapshot_table = self.DailyReportSnapshot.__table__
+        where = snapshot_table.c.MachineID == machine_id
+        if start_time is not None:
+            where = and_(where, snapshot_table.c.StartTime < start_time,
+                         snapshot_table.c.EndTime >= start_time)
+        connection.execute(snapshot_table.delete().where(where))
+
+    def discard_summary_report_data(self, connection, machine_id, order_id):
+        """
+        discard_summary_report_data(connection, machine_id, order_id)
+
+        Delete the SummaryReportData rows of a machine and order. The summary
+        report computes them again from the runs.
+        """
+        data_table = self.SummaryReportData.__table__
+        connection.execute(data_table.delete().where(
+            and_(data_table.c.MachineID == machine_id,
+                 data_table.c.OrderID == order_id)))
+
+    def discard_baseline_deltas(self, connection, run_id):
+        """
+        discard_baseline_deltas(connection, run_id)
+
+        Delete the BaselineDelta rows comparing a run, or comparing against
+        it. The global status page computes them again when it is missing.
+        """
+        delta_table = self.BaselineDelta.__table__
+        connection.execute(delta_table.delete().where(
+            or_(delta_table.c.RunID == run_id,
+                delta_table.c.BaselineRunID == run_id)))
+
+    def get_run_generations(self, session, key_columns, *criteria):
+        """
+        get_run_generations(session, key_columns, *criteria)
+            -> {key: generation}
+
+        Return a string identifying the runs matching the criteria, for every
+        value of the key columns (a tuple when there are several). It changes
+        whenever one of these runs is imported, replaced, moved or deleted.
+
+        Reports store it with the rows they compute from the runs, and
+        compute a row again when it no longer matches: an import committing
+        while a report was being computed leaves behind a row the import
+        could not discard yet.
+        """
+        Run = self.Run
+        key_columns = list(key_columns)
+        generations = {}
+        for row in session.query(*(key_columns + [
+                func.count(Run.id), func.max(Run.id),
+                func.sum(func.coalesce(Run.change_count, 0))])) \
+                .filter(*criteria) \
+                .group_by(*key_columns):
+            key = row[:len(key_columns)]
+            if len(key) == 1:
+                key = key[0]
+            generations[key] = '%d:%d:%d' % tuple(row[len(key_columns):])
+        return generations
 
     def importDataFromDict(self, session, data, config, select_machine,
                            merge_run):
@@ -1058,6 +1490,13 @@ class TestSuiteDB(object):
                                            select_machine)
         run = self._getOrCreateRun(session, data['run'], machine, merge_run)
         self._importSampleValues(session, data['tests'], run, config)
+        self.update_order_geomeans(session.connection(), run.machine_id,
+                                   run.order_id)
+        self.discard_daily_report_snapshots(session.connection(),
+                                            run.machine_id, run.start_time)
+        self.discard_summary_report_data(session.connection(),
+                                         run.machine_id, run.order_id)
+        self.discard_baseline_deltas(session.connection(), run.id)
         return run
 
     # Simple query support (mostly used by templates)
@@ -1096,65 +1535,75 @@ class TestSuiteDB(object):
         if N == 0:
             return []
 
-        # The obvious algorithm here is to step through the run orders in the
-        # appropriate direction and yield any runs on the same machine which
-        # were reported at that order.
-        #
-        # However, this has one large problem. In some cases, the gap between
-        # orders reported on that machine may be quite high. This will be
-        # particularly true when a machine has stopped reporting for a while,
-        # for example, as there may be large gap between the largest reported
-        # order and the last order the machine reported at.
-        #
-        # In such cases, we could end up executing a large number of individual
-        # SA object materializations in traversing the order list, which is
-        # very bad.
-        #
-        # We currently solve this by instead finding all the orders reported on
-        # this machine, ordering those programatically, and then iterating over
-        # that. This performs worse (O(N) instead of O(1)) than the obvious
-        # algorithm in the common case but more uniform and significantly
-        # better in the worst cast, and I prefer that response times be
-        # uniform. In practice, this appears to perform fine even for quite
-        # large (~1GB, ~20k runs) databases.
-
-        # Find all the orders on this machine, then sort them.
-        #
-        # FIXME: Scalability! However, pretty fast in practice, see elaborate
-        # explanation above.
-        all_machine_orders = session.query(self.Order).\
-            join(self.Run).\
-            filter(self.Run.machine == run.machine).distinct().all()
-        all_machine_orders.sort()
-
-        # Find the index of the current run.
-        index = all_machine_orders.index(run.order)
-
-        # Gather the next N orders.
+        # Runs carry a copy of the sort key of their order and are indexed by
+        # (machine, order sort key), so we can find the closest N orders the
+        # machine reported at with a single bounded index range scan, no
+        # matter how many runs the machine has submitted over time.
+        key = run.order_sort_key
+        keys = session.query(self.Run.order_sort_key) \
+            .filter(self.Run.machine_id == run.machine_id)
         if direction == -1:
-            orders_to_return = all_machine_orders[max(0, index - N):index]
+            keys = keys.filter(self.Run.order_sort_key < key) \
+                .order_by(self.Run.order_sort_key.desc())
         else:
-            orders_to_return = all_machine_orders[index+1:index+N]
-
-        # Get all the runs for those orders on this machine in a single query.
-        ids_to_fetch = [o.id
-                        for o in orders_to_return]
-        if not ids_to_fetch:
+            keys = keys.filter(self.Run.order_sort_key > key) \
+                .order_by(self.Run.order_sort_key)
+        # The following runs have always been those of the next N-1 orders.
+        # FieldChanges are stored by the (start, end) orders of that window,
+        # so changing it would lose track of the existing ones.
+        limit = N - 1 if direction == 1 else N
+        keys_to_fetch = [k for k, in keys.distinct().limit(limit)]
+        if not keys_to_fetch:
             return []
 
-        runs = session.query(self.Run).\
-            filter(self.Run.machine == run.machine).\
-            filter(self.Run.order_id.in_(ids_to_fetch)).all()
+        # Get all the runs for those orders on this machine in a single query.
+        runs = session.query(self.Run) \
+            .filter(self.Run.machine_id == run.machine_id) \
+            .filter(self.Run.order_sort_key.in_(keys_to_fetch)) \
+            .all()
 
         # Sort the result by order, accounting for direction to satisfy our
         # requirement of returning the runs in adjacency order.
-        #
-        # Even though we already know the right order, this is faster than
-        # issueing separate queries.
-        runs.sort(key=lambda r: r.order, reverse=(direction == -1))
+        runs.sort(key=lambda r: r.order_sort_key, reverse=(direction == -1))
 
         return runs
 
+    def get_closest_previously_reported_runs(self, session, machine_ids,
+                                             order_to_find):
+        """
+        get_closest_previously_reported_runs(session, machine_ids,
+                                             order_to_find) -> {id: Run}
+
+        Batched version of Machine.get_closest_previously_reported_run: map
+        the ID of each of the given machines to its run closest to the
+        requested order. Machines without such a run are left out.
+        """
+        machine_ids = list(machine_ids)
+        if not machine_ids:
+            return {}
+
+        # Find the closest order sort key of every machine, then the runs at
+        # those keys, all through the (machine, order sort key) index.
+        keys = session.query(self.Run.machine_id.label('machine_id'),
+                             func.min(self.Run.order_sort_key)
+                             .label('order_sort_key')) \
+            .filter(self.Run.machine_id.in_(machine_ids)) \
+            .filter(self.Run.order_sort_key >=
+                    order_to_find.compute_sort_key()) \
+            .group_by(self.Run.machine_id) \
+            .subquery()
+        runs = session.query(self.Run) \
+            .join(keys, and_(self.Run.machine_id == keys.c.machine_id,
+                             self.Run.order_sort_key ==
+                             keys.c.order_sort_key)) \
+            .order_by(self.Run.start_time.desc())
+
+        # Like the unbatched version, prefer the latest run at that order.
+        closest = {}
+        for run in runs:
+            closest.setdefault(run.machine_id, run)
+        return closest
+
     def get_previous_runs_on_machine(self, session, run, N):
         return self.get_adjacent_runs_on_machine(session, run, N, direction=-1)
 
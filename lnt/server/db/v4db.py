@@ -1,4 +1,8 @@
+import collections
 import glob
+import hashlib
+import os
+import time
 import yaml
 import sys
 
@@ -8,11 +12,15 @@ except Exception:
     import dummy_threading as threading
 
 import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.pool
 
+import lnt
 import lnt.testing
 
 import lnt.server.db.testsuitedb
 import lnt.server.db.migrate
+import lnt.server.db.regression
 
 from lnt.util import logger
 from lnt.server.db import testsuite
@@ -20,14 +28,101 @@ from sqlalchemy.orm import joinedload, subqueryload
 import lnt.server.db.util
 
 
+class MeteredQueuePool(sqlalchemy.pool.QueuePool):
+    """
+    A QueuePool counting the connection checkouts which had to wait for
+    another checkout to return its connection.
+    """
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        super(MeteredQueuePool, self).__init__(creator, pool_size=pool_size,
+                                               max_overflow=max_overflow,
+                                               **kw)
+        self.max_overflow = max_overflow
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _do_get(self):
+        exhausted = self.max_overflow > -1 and \
+            self.checkedout() >= self.size() + self.max_overflow
+        if not exhausted:
+            return super(MeteredQueuePool, self)._do_get()
+        start = time.time()
+        try:
+            return super(MeteredQueuePool, self)._do_get()
+        finally:
+            self.waits += 1
+            self.wait_time += time.time() - start
+
+    def recreate(self):
+        pool = super(MeteredQueuePool, self).recreate()
+        pool.waits = self.waits
+        pool.wait_time = self.wait_time
+        return pool
+
+
+def schema_fingerprint(schema_data):
+    """
+    schema_fingerprint(schema_data) -> str
+
+    Return the fingerprint of the contents of a schema file. It also covers
+    the LNT version and the database schema version, as either may change how
+    the schema maps to the metatables and tables of the test-suite.
+    """
+    fingerprint = hashlib.sha1(schema_data)
+    fingerprint.update('\0%s\0%d' % (lnt.__version__,
+                                      lnt.server.db.migrate.current_version()))
+    return fingerprint.hexdigest()
+
+
+class TestSuites(collections.Mapping):
+    """
+    The test-suites of a database, by name.
+
+    The model classes of a test-suite are only built when the test-suite is
+    first looked up, so that commands pay only for the test-suites they use.
+    """
+    def __init__(self, v4db):
+        self.v4db = v4db
+        self._names = set()
+        self._suites = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, tsdb=None):
+        """Register the test-suite `name`, with its TestSuiteDB if it was
+        already built."""
+        self._names.add(name)
+        if tsdb is not None:
+            self._suites[name] = tsdb
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        tsdb = self._suites.get(name)
+        if tsdb is None:
+            with self._lock:
+                tsdb = self._suites.get(name)
+                if tsdb is None:
+                    tsdb = self.v4db._load_testsuite(name)
+                    self._suites[name] = tsdb
+        return tsdb
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(sorted(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+
 class V4DB(object):
     """
     Wrapper object for LNT v0.4+ databases.
     """
-    def _load_schema_file(self, schema_file):
+    def _load_schema_file(self, schema_file, data, fingerprint):
         session = self.make_session(expire_on_commit=False)
-        with open(schema_file) as schema_fd:
-            data = yaml.load(schema_fd)
+        data = yaml.load(data)
         suite = testsuite.TestSuite.from_json(data)
         testsuite.check_testsuite_schema_changes(session, suite)
         suite = testsuite.sync_testsuite_with_metatables(session, suite)
@@ -37,26 +132,62 @@ class V4DB(object):
         # Create tables if necessary
         tsdb = lnt.server.db.testsuitedb.TestSuiteDB(self, suite.name, suite)
         tsdb.create_tables(self.engine)
+
+        # Remember the schema file is in sync with the database.
+        session = self.make_session()
+        session.query(testsuite.TestSuiteJSONSchema) \
+            .filter(testsuite.TestSuiteJSONSchema.testsuite_name ==
+                    suite.name) \
+            .update({'fingerprint': fingerprint}, synchronize_session=False)
+        session.commit()
+        session.close()
         return tsdb
 
+    def _load_testsuite(self, name):
+        session = self.make_session(expire_on_commit=False)
+        suite = session.query(testsuite.TestSuite) \
+            .filter(testsuite.TestSuite.name == name).one()
+        if name in self._synced_schemas:
+            # The suite comes from an unchanged schema file, take the field
+            # information the metatables do not store from its json schema.
+            jsonschema = session.query(
+                testsuite.TestSuiteJSONSchema.jsonschema) \
+                .filter(testsuite.TestSuiteJSONSchema.testsuite_name == name) \
+                .scalar()
+            testsuite.load_schema_info(suite, jsonschema)
+        session.expunge_all()
+        session.close()
+        return lnt.server.db.testsuitedb.TestSuiteDB(self, name, suite)
+
     def _load_schemas(self):
-        # Load schema files (preferred)
+        session = self.make_session()
+        synced = dict((fingerprint, name) for name, fingerprint in
+                      session.query(testsuite.TestSuiteJSONSchema
+                                    .testsuite_name,
+                                    testsuite.TestSuiteJSONSchema.fingerprint)
+                      if fingerprint is not None)
+        suite_names = set(name for name, in
+                          session.query(testsuite.TestSuite.name))
+        session.close()
+
+        # Load schema files (preferred). The files which did not change since
+        # they were last loaded need no checks, their test-suites are loaded
+        # from the database like the others.
         schemasDir = self.config.schemasDir
         for schema_file in glob.glob('%s/*.yaml' % schemasDir):
-            tsdb = self._load_schema_file(schema_file)
-            self.testsuite[tsdb.name] = tsdb
+            with open(schema_file) as schema_fd:
+                data = schema_fd.read()
+            fingerprint = schema_fingerprint(data)
+            name = synced.get(fingerprint)
+            if name in suite_names:
+                self._synced_schemas.add(name)
+                continue
+            tsdb = self._load_schema_file(schema_file, data, fingerprint)
+            self.testsuite.add(tsdb.name, tsdb)
 
         # Load schemas from database.
-        session = self.make_session(expire_on_commit=False)
-        ts_list = session.query(testsuite.TestSuite).all()
-        session.expunge_all()
-        session.close()
-        for suite in ts_list:
-            name = suite.name
-            if name in self.testsuite:
-                continue
-            tsdb = lnt.server.db.testsuitedb.TestSuiteDB(self, name, suite)
-            self.testsuite[name] = tsdb
+        for name in suite_names:
+            self.testsuite.add(name)
 
     def __init__(self, path, config, baseline_revision=0):
         # If the path includes no database type, assume sqlite.
@@ -67,29 +198,87 @@ class V4DB(object):
         self.config = config
         self.baseline_revision = baseline_revision
         connect_args = {}
+        engine_args = {}
         if path.startswith("sqlite://"):
             # Some of the background tasks keep database transactions
             # open for a long time. Make it less likely to hit
             # "(OperationalError) database is locked" because of that.
             connect_args['timeout'] = 30
+            # SQLite connections cannot be shared between threads, keep the
+            # pool SQLAlchemy picks for them.
+        else:
+            # The engine lives as long as the process, and keeps a pool of
+            # connections open across requests.
+            engine_args = dict(config.db_pool)
+            engine_args['poolclass'] = MeteredQueuePool
         self.engine = sqlalchemy.create_engine(path,
-                                               connect_args=connect_args)
+                                               connect_args=connect_args,
+                                               **engine_args)
+        self.pid = os.getpid()
+        self.checkouts = 0
+        self.connects = 0
+        sqlalchemy.event.listen(self.engine, 'connect', self._on_connect)
+        sqlalchemy.event.listen(self.engine, 'checkout', self._on_checkout)
 
-        # Update the database to the current version, if necessary. Only check
-        # this once per path.
+        # Update the database to the current version, if necessary.
         lnt.server.db.migrate.update(self.engine)
 
         self.sessionmaker = sqlalchemy.orm.sessionmaker(self.engine)
+        # Keep the regression summaries in sync with their indicators.
+        sqlalchemy.event.listen(
+            self.sessionmaker, 'before_commit',
+            lnt.server.db.regression.discard_stale_summaries)
 
-        self.testsuite = dict()
+        self.testsuite = TestSuites(self)
+        self._synced_schemas = set()
         self._load_schemas()
 
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record,
+                     connection_proxy):
+        self.checkouts += 1
+
     def close(self):
         self.engine.dispose()
 
     def make_session(self, expire_on_commit=True):
+        # Connections must not be shared with a parent process, as happens
+        # when the server forks its workers after loading the app.
+        if os.getpid() != self.pid:
+            self.engine.dispose()
+            self.pid = os.getpid()
         return self.sessionmaker(expire_on_commit=expire_on_commit)
 
+    def pool_status(self):
+        """
+        pool_status() -> dict
+
+        Return the metrics of the connection pool of this database: the
+        number of connections opened and checked out since the start, and
+        for pools of a fixed size, the connections currently checked out,
+        the overflow connections and the checkouts which had to wait.
+        """
+        pool = self.engine.pool
+        status = {
+            'pool': pool.__class__.__name__,
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+        }
+        if isinstance(pool, sqlalchemy.pool.QueuePool):
+            status.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+            })
+        if isinstance(pool, MeteredQueuePool):
+            status.update({
+                'waits': pool.waits,
+                'wait_time': round(pool.wait_time, 3),
+            })
+        return status
+
     def settings(self):
         """All the setting needed to recreate this instnace elsewhere."""
         return {
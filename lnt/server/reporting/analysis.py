@@ -5,7 +5,6 @@ from lnt.testing import FAIL
 from lnt.util import logger
 from lnt.util import multidict
 from lnt.util import stats
-from lnt.util import stats
 
 REGRESSED = 'REGRESSED'
 IMPROVED = 'IMPROVED'
@@ -45,7 +44,7 @@ def calc_geomean(run_values):
     return stats.geometric_mean(values) - MIN_VALUE_PRECISION
 
 
-class ComparisonResult:
+class ComparisonResult(object):
     """A ComparisonResult is ultimatly responsible for determining if a test
     improves, regresses or does not change, given some new and old data."""
 
@@ -81,35 +80,52 @@ class ComparisonResult:
                 self.pct_delta = self.delta / value
             self.previous = value
 
+        # The distribution estimates and value statuses are computed on first
+        # use; most results of a run are only ever bucketed by status.
+        self._stddev = self._MAD = self._stddev_mean = None
+        self._distribution_computed = False
+        self._value_status = {}
+
+        self.failed = cur_failed
+        self.prev_failed = prev_failed
+        self.samples = samples
+        self.prev_samples = prev_samples
+
+        self.confidence_lv = confidence_lv
+        self.bigger_is_better = bigger_is_better
+
+    def _compute_distribution(self):
         # If we have multiple values for this run, use that to estimate the
         # distribution.
         #
         # We can get integer sample types here - for example if the field is
         # .exec.status. Make sure we don't assert by avoiding the stats
         # functions in this case.
+        samples = self.samples
         if samples and len(samples) > 1 and isinstance(samples[0], float):
-            self.stddev = stats.standard_deviation(samples)
-            self.MAD = stats.median_absolute_deviation(samples)
-        else:
-            self.stddev = None
-            self.MAD = None
+            self._stddev = stats.standard_deviation(samples)
+            self._MAD = stats.median_absolute_deviation(samples)
+        self._distribution_computed = True
 
-        self.stddev_mean = None  # Only calculate this if needed.
-        self.failed = cur_failed
-        self.prev_failed = prev_failed
-        self.samples = samples
-        self.prev_samples = prev_samples
+    @property
+    def stddev(self):
+        if not self._distribution_computed:
+            self._compute_distribution()
+        return self._stddev
 
-        self.confidence_lv = confidence_lv
-        self.bigger_is_better = bigger_is_better
+    @property
+    def MAD(self):
+        if not self._distribution_computed:
+            self._compute_distribution()
+        return self._MAD
 
     @property
     def stddev_mean(self):
         """The mean around stddev for current sampples. Cached after first call.
         """
-        if not self.stddev_mean:
-            self.stddev_mean = stats.mean(self.samples)
-        return self.stddev_mean
+        if self._stddev_mean is None:
+            self._stddev_mean = stats.mean(self.samples)
+        return self._stddev_mean
 
     def __repr__(self):
         """Print this ComparisonResult's constructor.
@@ -128,8 +144,11 @@ class ComparisonResult:
                           bool(self.bigger_is_better))
 
     def __json__(self):
-        simple_dict = self.__dict__
+        simple_dict = dict((k, v) for k, v in self.__dict__.items()
+                           if not k.startswith('_'))
         simple_dict['aggregation_fn'] = self.aggregation_fn.__name__
+        simple_dict['stddev'] = self.stddev
+        simple_dict['MAD'] = self.MAD
         return simple_dict
 
     def is_result_performance_change(self):
@@ -168,6 +187,18 @@ class ComparisonResult:
     def get_value_status(self, confidence_interval=2.576,
                          value_precision=MIN_VALUE_PRECISION,
                          ignore_small=True):
+        # The status is asked for several times per result (bucketing,
+        # is_result_interesting, templates); only run the tests once.
+        key = (confidence_interval, value_precision, ignore_small)
+        status = self._value_status.get(key, self)
+        if status is self:
+            status = self._compute_value_status(confidence_interval,
+                                                value_precision, ignore_small)
+            self._value_status[key] = status
+        return status
+
+    def _compute_value_status(self, confidence_interval, value_precision,
+                              ignore_small):
         if self.current is None or self.previous is None:
             return None
 
@@ -299,13 +330,63 @@ class RunInfo(object):
 
     def get_comparison_result(self, runs, compare_runs, test_id, field,
                               hash_of_binary_field):
-        # Get the field which indicates the requested field's status.
+        return self._compare(runs, compare_runs, test_id,
+                             self.get_samples(runs, test_id),
+                             self.get_samples(compare_runs, test_id),
+                             field, self._get_field_indices(
+                                 field, hash_of_binary_field))
+
+    def get_comparison_results(self, runs, compare_runs, field,
+                               hash_of_binary_field, test_ids=None):
+        """Compare `field` between `runs` and `compare_runs` for all the loaded
+        tests, or only those in `test_ids`.
+
+        This gives the same results as calling get_comparison_result for every
+        test, but the samples of all tests are grouped in a single pass over
+        the runs and the field lookups are done once. Returns a dict mapping
+        test ids to ComparisonResults.
+        """
+        if test_ids is None:
+            test_ids = self.test_ids
+        else:
+            test_ids = set(test_ids)
+        run_samples = self._group_samples(runs, test_ids)
+        prev_samples = self._group_samples(compare_runs, test_ids)
+        indices = self._get_field_indices(field, hash_of_binary_field)
+
+        return dict((test_id,
+                     self._compare(runs, compare_runs, test_id,
+                                   run_samples.get(test_id, []),
+                                   prev_samples.get(test_id, []),
+                                   field, indices))
+                    for test_id in test_ids)
+
+    def _group_samples(self, runs, test_ids):
+        """Return a dict of test id to the samples of `runs` for the tests in
+        `test_ids`, in the same order as get_samples returns them."""
+        samples_by_test = {}
+        for run in runs:
+            for test_id in test_ids:
+                samples = self.sample_map.get((run.id, test_id))
+                if samples is not None:
+                    samples_by_test.setdefault(test_id, []).extend(samples)
+        return samples_by_test
+
+    def _get_field_indices(self, field, hash_of_binary_field):
         status_field = field.status_field
+        status_field_index = None
+        if status_field:
+            status_field_index = self.testsuite.get_field_index(status_field)
+        hash_of_binary_field_index = None
+        if hash_of_binary_field:
+            hash_of_binary_field_index = \
+                self.testsuite.get_field_index(hash_of_binary_field)
+        return (self.testsuite.get_field_index(field), status_field_index,
+                hash_of_binary_field_index)
 
-        # Load the sample data for the current and previous runs and the
-        # comparison window.
-        run_samples = self.get_samples(runs, test_id)
-        prev_samples = self.get_samples(compare_runs, test_id)
+    def _compare(self, runs, compare_runs, test_id, run_samples, prev_samples,
+                 field, indices):
+        field_index, status_field_index, hash_of_binary_field_index = indices
 
         cur_profile = prev_profile = None
         if runs:
@@ -320,23 +401,18 @@ class RunInfo(object):
         # FIXME: Support XFAILs and non-determinism (mixed fail and pass)
         # better.
         run_failed = prev_failed = False
-        if status_field:
-            status_field_index = self.testsuite.get_field_index(status_field)
+        if status_field_index is not None:
             for sample in run_samples:
                 run_failed |= sample[status_field_index] == FAIL
             for sample in prev_samples:
                 prev_failed |= sample[status_field_index] == FAIL
 
-        field_index = self.testsuite.get_field_index(field)
-
         # Get the current and previous values.
         run_values = [s[field_index] for s in run_samples
                       if s[field_index] is not None]
         prev_values = [s[field_index] for s in prev_samples
                        if s[field_index] is not None]
-        if hash_of_binary_field:
-            hash_of_binary_field_index = \
-                    self.testsuite.get_field_index(hash_of_binary_field)
+        if hash_of_binary_field_index is not None:
             hash_values = [s[hash_of_binary_field_index] for s in run_samples
                            if s[hash_of_binary_field_index] is not None]
             prev_hash_values = [s[hash_of_binary_field_index]
@@ -1,21 +1,34 @@
-from collections import namedtuple
 from lnt.server.reporting.analysis import REGRESSED, UNCHANGED_FAIL
 from lnt.util import multidict
+from lnt.util import stats
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 import colorsys
 import datetime
+import json
 import lnt.server.reporting.analysis
 import lnt.server.ui.app
 import re
-import sqlalchemy.sql
 import urllib
+import zlib
 
-OrderAndHistory = namedtuple('OrderAndHistory', ['max_order', 'recent_orders'])
+# The number of ids to look up per query.
+_QUERY_CHUNK_SIZE = 500
 
 
 def _pairs(list):
     return zip(list[:-1], list[1:])
 
 
+def _encode_snapshot(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')))
+
+
+def _decode_snapshot(data):
+    return json.loads(zlib.decompress(data))
+
+
 # The hash color palette avoids green and red as these colours are already used
 # in quite a few places to indicate "good" or "bad".
 _hash_color_palette = (
@@ -135,6 +148,8 @@ class DailyReport(object):
         self.day_start_offset = datetime.timedelta(
             hours=day_start_offset_hours)
         self.for_mail = for_mail
+        self.aggregation_fn = stats.safe_min
+        self.confidence_lv = .05
         self.filter_machine_regex_str = filter_machine_regex
         self.filter_machine_re = None
         if self.filter_machine_regex_str:
@@ -147,7 +162,7 @@ class DailyReport(object):
         self.error = None
         self.next_day = None
         self.prior_days = None
-        self.machine_runs = None
+        self.key_runs = None
         self.reporting_machines = None
         self.reporting_tests = None
         self.result_table = None
@@ -178,17 +193,12 @@ class DailyReport(object):
         that reported for the reported run order, for that machine and day.
         """
 
-        if self.machine_runs is None:
+        if self.key_runs is None:
             raise ValueError("report not initialized")
         if day_index >= self.num_prior_days_to_include:
             raise ValueError("invalid day index")
 
-        runs = self.machine_runs.get((machine.id, day_index))
-        if runs is None:
-            return None
-
-        # Select a key run arbitrarily.
-        return runs[0]
+        return self.key_runs.get((machine.id, day_index))
 
     def build(self, session):
         ts = self.ts
@@ -207,119 +217,91 @@ class DailyReport(object):
         self.prior_days = [(datetime.datetime.fromordinal(day_ordinal - i) +
                             self.day_start_offset)
                            for i in range(self.num_prior_days_to_include + 1)]
-
-        # Find all the runs that occurred for each day slice.
-        prior_runs = [session.query(ts.Run).
-                      filter(ts.Run.start_time > prior_day).
-                      filter(ts.Run.start_time <= day).all()
-                      for day, prior_day in _pairs(self.prior_days)]
-
-        if self.filter_machine_re is not None:
-            prior_runs = [[run for run in runs
-                           if self.filter_machine_re.search(run.machine.name)]
-                          for runs in prior_runs]
-
-        # For every machine, we only want to report on the last run order that
-        # was reported for that machine for the particular day range.
-        #
-        # Note that this *does not* mean that we will only report for one
-        # particular run order for each day, because different machines may
-        # report on different orders.
-        #
-        # However, we want to limit ourselves to a single run order for each
-        # (day,machine) so that we don't obscure any details through our
-        # aggregation.
-        self.prior_days_machine_order_map = \
-            [None] * self.num_prior_days_to_include
-        historic_runs = [None] * len(prior_runs)
-        for i, runs in enumerate(prior_runs):
-            # Aggregate the runs by machine.
-            machine_to_all_orders = multidict.multidict()
-            for r in runs:
-                machine_to_all_orders[r.machine] = r.order
-
-            # Create a map from machine to max order and some history.
-            self.prior_days_machine_order_map[i] = machine_order_map = dict(
-                (machine, OrderAndHistory(max(orders), sorted(orders)))
-                for machine, orders in machine_to_all_orders.items())
-
-            # Update the run list to only include the runs with that order.
-            def is_max_order(r):
-                return r.order is machine_order_map[r.machine].max_order
-            prior_runs[i] = [r for r in runs if is_max_order(r)]
-
-            # Also keep some recent runs, so we have some extra samples.
-            def is_recent_order(r):
-                return r.order in machine_order_map[r.machine].recent_orders
-            historic_runs[i] = [r for r in runs if is_recent_order(r)]
-
-        # Form a list of all relevant runs.
-        relevant_runs = sum(prior_runs, [])
-        less_relevant_runs = sum(historic_runs, relevant_runs)
-
-        # Find the union of all machines reporting in the relevant runs.
-        self.reporting_machines = list(set(r.machine for r in relevant_runs))
-        self.reporting_machines.sort(key=lambda m: m.name)
-
-        # We aspire to present a "lossless" report, in that we don't ever hide
-        # any possible change due to aggregation. In addition, we want to make
-        # it easy to see the relation of results across all the reporting
-        # machines. In particular:
-        #
-        #   (a) When a test starts failing or passing on one machine, it should
-        #       be easy to see how that test behaved on other machines. This
-        #       makes it easy to identify the scope of the change.
-        #
-        #   (b) When a performance change occurs, it should be easy to see the
-        #       performance of that test on other machines. This makes it easy
-        #       to see the scope of the change and to potentially apply human
-        #       discretion in determining whether or not a particular result is
-        #       worth considering (as opposed to noise).
-        #
-        # The idea is as follows, for each (machine, test, metric_field),
-        # classify the result into one of REGRESSED, IMPROVED, UNCHANGED_FAIL,
-        # ADDED, REMOVED, PERFORMANCE_REGRESSED, PERFORMANCE_IMPROVED.
-        #
-        # For now, we then just aggregate by test and present the results as
-        # is. This is lossless, but not nearly as nice to read as the old style
-        # per-machine reports. In the future we will want to find a way to
-        # combine the per-machine report style of presenting results aggregated
-        # by the kind of status change, while still managing to present the
-        # overview across machines.
-
-        # Aggregate runs by machine ID and day index.
-        self.machine_runs = machine_runs = multidict.multidict()
-        for day_index, day_runs in enumerate(prior_runs):
-            for run in day_runs:
-                machine_runs[(run.machine_id, day_index)] = run
-
-        # Also aggregate past runs by day.
-        self.machine_past_runs = multidict.multidict()
-        for day_index, day_runs in enumerate(historic_runs):
-            for run in day_runs:
-                self.machine_past_runs[(run.machine_id, day_index)] = run
-
-        relevant_run_ids = [r.id for r in relevant_runs]
+        start_time, end_time = self.prior_days[-1], self.prior_days[0]
+
+        # Find the machines which reported in the report range.
+        machine_ids = [
+            machine_id for machine_id, name in session.query(
+                ts.Machine.id, ts.Machine.name)
+            .filter(ts.Machine.id.in_(
+                session.query(ts.Run.machine_id)
+                .filter(ts.Run.start_time > start_time)
+                .filter(ts.Run.start_time <= end_time)))
+            if self.filter_machine_re is None or
+            self.filter_machine_re.search(name)]
 
         # If there are no relevant runs, just stop processing (the report will
         # generate an error).
-        if not relevant_run_ids:
+        if not machine_ids:
+            self.reporting_machines = []
+            self.key_runs = {}
             self.error = "no runs to display in selected date range"
             return
 
-        # Get the set all tests reported in the recent runs.
-        self.reporting_tests = session.query(ts.Test).filter(
-            sqlalchemy.sql.exists('*', sqlalchemy.sql.and_(
-                    ts.Sample.run_id.in_(relevant_run_ids),
-                    ts.Sample.test_id == ts.Test.id))).all()
-        self.reporting_tests.sort(key=lambda t: t.name)
-
-        run_ids_to_load = list(relevant_run_ids) + \
-            [r.id for r in less_relevant_runs]
+        # The results of every machine are kept in a DailyReportSnapshot,
+        # compute those which are missing or out of date. The generations are
+        # looked up first, so that the snapshots of runs imported meanwhile
+        # are stored as out of date.
+        generations = ts.get_run_generations(
+            session, [ts.Run.machine_id],
+            ts.Run.machine_id.in_(machine_ids),
+            ts.Run.start_time > start_time, ts.Run.start_time <= end_time)
+        snapshots = self._load_snapshots(session, machine_ids, generations)
+        missing = [machine_id for machine_id in machine_ids
+                   if machine_id not in snapshots]
+        if missing:
+            built = self._build_snapshots(session, missing)
+            snapshots.update(built)
+            # The report of a day which is not over yet changes with every
+            # submission, only store finished days. Late runs discard the
+            # snapshots they belong to, see
+            # TestSuiteDB.discard_daily_report_snapshots.
+            if end_time <= datetime.datetime.utcnow():
+                snapshot_table = ts.DailyReportSnapshot.__table__
+                try:
+                    session.execute(snapshot_table.delete().where(and_(
+                        snapshot_table.c.MachineID.in_(missing),
+                        snapshot_table.c.StartTime == start_time,
+                        snapshot_table.c.EndTime == end_time)))
+                    session.execute(
+                        snapshot_table.insert(),
+                        [{'MachineID': machine_id, 'StartTime': start_time,
+                          'EndTime': end_time, 'Data': _encode_snapshot(data),
+                          'Generation': generations.get(machine_id)}
+                         for machine_id, data in built.items()])
+                    session.commit()
+                except IntegrityError:
+                    # Another request stored the same snapshots first.
+                    session.rollback()
+
+        self.reporting_machines = session.query(ts.Machine) \
+            .filter(ts.Machine.id.in_(machine_ids)).all()
+        self.reporting_machines.sort(key=lambda m: m.name)
 
-        # Create a run info object.
-        sri = lnt.server.reporting.analysis.RunInfo(session, ts,
-                                                    run_ids_to_load)
+        # Load the key runs and the tests the snapshots refer to.
+        key_run_ids = set(run_id for machine_id in machine_ids
+                          for run_id in snapshots[machine_id]['key_runs']
+                          if run_id is not None)
+        runs = dict((run.id, run) for run in session.query(ts.Run)
+                    .options(joinedload(ts.Run.order))
+                    .filter(ts.Run.id.in_(key_run_ids)))
+        self.key_runs = {}
+        for machine_id in machine_ids:
+            for day_index, run_id in enumerate(
+                    snapshots[machine_id]['key_runs']):
+                if run_id is not None:
+                    self.key_runs[(machine_id, day_index)] = runs[run_id]
+
+        # Report on the tests reported in the most recent runs of any of the
+        # machines.
+        test_ids = sorted(set(test_id for machine_id in machine_ids
+                              for test_id in snapshots[machine_id]['tests']))
+        self.reporting_tests = []
+        for i in range(0, len(test_ids), _QUERY_CHUNK_SIZE):
+            self.reporting_tests.extend(
+                session.query(ts.Test)
+                .filter(ts.Test.id.in_(test_ids[i:i + _QUERY_CHUNK_SIZE])))
+        self.reporting_tests.sort(key=lambda t: t.name)
 
         # Build the result table of tests with interesting results.
         def compute_visible_results_priority(visible_results):
@@ -344,61 +326,25 @@ class DailyReport(object):
         self.result_table = []
         self.nr_tests_table = []
         for field in self.fields:
+            machine_results = [
+                (machine, dict(snapshots[machine.id]['results'][field.name]))
+                for machine in self.reporting_machines]
             field_results = []
             for test in self.reporting_tests:
-                # For each machine, compute if there is anything to display for
-                # the most recent day, and if so add it to the view.
                 visible_results = []
-                for machine in self.reporting_machines:
-                    # Get the most recent comparison result.
-                    # Record which days have samples, so that we'll compare
-                    # also consecutive runs that are further than a day
-                    # apart if no runs happened in between.
-                    day_has_samples = []
-                    for i in range(0, self.num_prior_days_to_include):
-                        runs = self.machine_past_runs.get((machine.id, i), ())
-                        samples = sri.get_samples(runs, test.id)
-                        day_has_samples.append(len(samples) > 0)
-
-                    def find_most_recent_run_with_samples(day_nr):
-                        for i in range(day_nr+1,
-                                       self.num_prior_days_to_include):
-                            if day_has_samples[i]:
-                                return i
-                        return day_nr+1
-
-                    prev_day_index = find_most_recent_run_with_samples(0)
-                    day_runs = machine_runs.get((machine.id, 0), ())
-                    prev_runs = self.machine_past_runs.get(
-                        (machine.id, prev_day_index), ())
-                    cr = sri.get_comparison_result(
-                        day_runs, prev_runs, test.id, field,
-                        self.hash_of_binary_field)
-
-                    # If the result is not "interesting", ignore this machine.
-                    if not cr.is_result_interesting():
+                for machine, results in machine_results:
+                    days = results.get(test.id)
+                    if days is None:
                         continue
-
-                    # Otherwise, compute the results for all the days.
                     day_results = DayResults()
-                    day_results.append(DayResult(cr))
-                    for i in range(1, self.num_prior_days_to_include):
-                        day_runs = machine_runs.get((machine.id, i), ())
-                        if len(day_runs) == 0:
+                    for day in days:
+                        if day is None:
                             day_results.append(None)
-                            continue
-
-                        prev_day_index = find_most_recent_run_with_samples(i)
-                        prev_runs = self.machine_past_runs.get(
-                                       (machine.id, prev_day_index), ())
-                        cr = sri.get_comparison_result(
-                            day_runs, prev_runs, test.id, field,
-                            self.hash_of_binary_field)
-                        day_results.append(DayResult(cr))
-
+                        else:
+                            day_results.append(
+                                DayResult(self._comparison_result(field,
+                                                                  *day)))
                     day_results.complete()
-
-                    # Append the result for the machine.
                     visible_results.append((machine, day_results))
 
                 # If there are visible results for this test, append it to the
@@ -411,17 +357,188 @@ class DailyReport(object):
             self.result_table.append((field, field_results))
 
         for machine in self.reporting_machines:
-            nr_tests_for_machine = []
-            for i in range(0, self.num_prior_days_to_include):
-                # get all runs with the same largest "order" on a given day
-                day_runs = machine_runs.get((machine.id, i), ())
-                nr_tests_seen = 0
-                for test in self.reporting_tests:
-                    samples = sri.get_samples(day_runs, test.id)
-                    if len(samples) > 0:
-                        nr_tests_seen += 1
-                nr_tests_for_machine.append(nr_tests_seen)
-            self.nr_tests_table.append((machine, nr_tests_for_machine))
+            self.nr_tests_table.append(
+                (machine, snapshots[machine.id]['nr_tests']))
+
+    def _comparison_result(self, field, failed, prev_failed, samples,
+                           prev_samples, cur_hash, prev_hash):
+        return lnt.server.reporting.analysis.ComparisonResult(
+            self.aggregation_fn, failed, prev_failed, samples, prev_samples,
+            cur_hash, prev_hash, confidence_lv=self.confidence_lv,
+            bigger_is_better=field.bigger_is_better)
+
+    def _load_snapshots(self, session, machine_ids, generations):
+        """
+        _load_snapshots(session, machine_ids, generations)
+            -> {machine id: data}
+
+        Read the stored snapshots of the report range for the given machines,
+        skipping those which were not computed from the current generation of
+        the runs of their machine.
+        """
+        snapshot = self.ts.DailyReportSnapshot
+        snapshots = {}
+        for machine_id, data, generation in session.query(
+                snapshot.machine_id, snapshot.data, snapshot.generation) \
+                .filter(snapshot.machine_id.in_(machine_ids)) \
+                .filter(snapshot.start_time == self.prior_days[-1]) \
+                .filter(snapshot.end_time == self.prior_days[0]):
+            if generation == generations.get(machine_id):
+                snapshots[machine_id] = _decode_snapshot(data)
+        return snapshots
+
+    def _build_snapshots(self, session, machine_ids):
+        """
+        _build_snapshots(session, machine_ids) -> {machine id: data}
+
+        Compute the report results of the given machines from their runs. The
+        results of a machine only depend on its own runs; for every machine
+        they consist of:
+          key_runs: The id of the key run of every day, see get_key_run.
+          nr_tests: The number of tests reported by the runs of every day.
+          tests: The ids of the tests reported by the runs of any day.
+          results: For every field, a list of test ids and per day
+            comparison results (or None), for the tests with an interesting
+            result on the most recent day. The comparison results are given
+            by the arguments of _comparison_result.
+        """
+        ts = self.ts
+        num_days = self.num_prior_days_to_include
+
+        # Find all the runs that occurred for each day slice, and their orders,
+        # with one query.
+        all_runs = session.query(ts.Run) \
+            .options(joinedload(ts.Run.order)) \
+            .filter(ts.Run.machine_id.in_(machine_ids)) \
+            .filter(ts.Run.start_time > self.prior_days[-1]) \
+            .filter(ts.Run.start_time <= self.prior_days[0]) \
+            .order_by(ts.Run.id).all()
+        machine_days = dict(
+            (machine_id, [[] for i in range(num_days)])
+            for machine_id in machine_ids)
+        for run in all_runs:
+            for i, (day, prior_day) in enumerate(_pairs(self.prior_days)):
+                if prior_day < run.start_time <= day:
+                    machine_days[run.machine_id][i].append(run)
+                    break
+
+        # Create a run info object.
+        sri = lnt.server.reporting.analysis.RunInfo(
+            session, ts, [r.id for r in all_runs],
+            aggregation_fn=self.aggregation_fn,
+            confidence_lv=self.confidence_lv)
+        run_tests = multidict.multidict()
+        for run_id, test_id in sri.sample_map.keys():
+            run_tests[run_id] = test_id
+
+        def tests_of(runs):
+            return set(test_id for r in runs
+                       for test_id in run_tests.get(r.id, ()))
+
+        snapshots = {}
+        for machine_id, past_runs in machine_days.items():
+            # For every machine, we only want to report on the last run order
+            # that was reported for that machine for the particular day range.
+            #
+            # Note that this *does not* mean that we will only report for one
+            # particular run order for each day, because different machines
+            # may report on different orders.
+            #
+            # However, we want to limit ourselves to a single run order for
+            # each (day,machine) so that we don't obscure any details through
+            # our aggregation. All the runs of the day are kept to compare
+            # against, so we have some extra samples.
+            day_runs = []
+            for runs in past_runs:
+                if runs:
+                    max_order = max(r.order for r in runs)
+                    runs = [r for r in runs if r.order is max_order]
+                day_runs.append(runs)
+
+            # We aspire to present a "lossless" report, in that we don't ever
+            # hide any possible change due to aggregation. In addition, we
+            # want to make it easy to see the relation of results across all
+            # the reporting machines. In particular:
+            #
+            #   (a) When a test starts failing or passing on one machine, it
+            #       should be easy to see how that test behaved on other
+            #       machines. This makes it easy to identify the scope of the
+            #       change.
+            #
+            #   (b) When a performance change occurs, it should be easy to see
+            #       the performance of that test on other machines. This makes
+            #       it easy to see the scope of the change and to potentially
+            #       apply human discretion in determining whether or not a
+            #       particular result is worth considering (as opposed to
+            #       noise).
+            #
+            # The idea is as follows, for each (machine, test, metric_field),
+            # classify the result into one of REGRESSED, IMPROVED,
+            # UNCHANGED_FAIL, ADDED, REMOVED, PERFORMANCE_REGRESSED,
+            # PERFORMANCE_IMPROVED.
+            #
+            # For now, we then just aggregate by test and present the results
+            # as is. This is lossless, but not nearly as nice to read as the
+            # old style per-machine reports. In the future we will want to
+            # find a way to combine the per-machine report style of presenting
+            # results aggregated by the kind of status change, while still
+            # managing to present the overview across machines.
+            #
+            # The report only shows the tests of the most recent runs of its
+            # machines, but which machines are shown depends on the report
+            # filter: compute the results of all the tests this machine
+            # reported on, the report picks those it shows.
+            test_ids = sorted(tests_of(sum(past_runs, [])))
+            results = {}
+            for field in self.fields:
+                field_results = results[field.name] = []
+                for test_id in test_ids:
+                    # Record which days have samples, so that we'll compare
+                    # also consecutive runs that are further than a day
+                    # apart if no runs happened in between.
+                    day_has_samples = [
+                        len(sri.get_samples(past_runs[i], test_id)) > 0
+                        for i in range(num_days)]
+
+                    def find_most_recent_run_with_samples(day_nr):
+                        for i in range(day_nr+1, num_days):
+                            if day_has_samples[i]:
+                                return i
+                        return day_nr+1
+
+                    # Get the most recent comparison result.
+                    days = []
+                    for i in range(num_days):
+                        if i > 0 and len(day_runs[i]) == 0:
+                            days.append(None)
+                            continue
+                        prev_day_index = find_most_recent_run_with_samples(i)
+                        if prev_day_index < num_days:
+                            prev_runs = past_runs[prev_day_index]
+                        else:
+                            prev_runs = ()
+                        cr = sri.get_comparison_result(
+                            day_runs[i], prev_runs, test_id, field,
+                            self.hash_of_binary_field)
+
+                        # If the result is not "interesting", ignore this
+                        # test.
+                        if i == 0 and not cr.is_result_interesting():
+                            break
+                        days.append((cr.failed, cr.prev_failed, cr.samples,
+                                     cr.prev_samples, cr.cur_hash,
+                                     cr.prev_hash))
+                    else:
+                        field_results.append((test_id, days))
+
+            snapshots[machine_id] = {
+                'key_runs': [runs[0].id if runs else None
+                             for runs in day_runs],
+                'nr_tests': [len(tests_of(runs)) for runs in day_runs],
+                'tests': sorted(tests_of(sum(day_runs, []))),
+                'results': results,
+            }
+        return snapshots
 
     def render(self, ts_url, only_html_body=True):
         # Strip any trailing slash on the testsuite URL.
@@ -0,0 +1,195 @@
+"""
+The percentage changes between the latest runs of the machines and their
+baselines, as shown by the global status page.
+
+The changes are stored in the BaselineDelta table of the test suite, for every
+metric field and test of a (run, baseline run) pair. The pairs of the default
+baseline revision are filled in when a run is submitted; the page computes any
+other pair it shows once and reads the stored rows from then on. The rows of a
+pair hold the change counts of its runs, so that the deltas of a run replaced
+while they were computed are computed again.
+"""
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+
+import lnt.server.reporting.analysis
+
+# The number of tests shown per page.
+PAGE_SIZE = 100
+
+
+def get_baseline_order(ts, revision):
+    """Return a (transient) order of the test suite for a baseline revision,
+    to look up the closest run of the machines with."""
+    return ts.Order(llvm_project_revision='% 7d' % int(revision))
+
+
+def _get_generation(run, baseline):
+    """Return the generation of the deltas of a run against a baseline run,
+    which changes whenever either run is replaced."""
+    return '%d:%d' % (run.change_count or 0, baseline.change_count or 0)
+
+
+def _get_stored_pairs(session, ts, pairs):
+    """Return the set of (run id, baseline run id) keys of `pairs`, a dict of
+    (run, baseline run) pairs, which already have their deltas stored for the
+    current generation of the runs."""
+    run_ids = set(run_id for run_id, _ in pairs)
+    if not run_ids:
+        return set()
+    stored = session.query(ts.BaselineDelta.run_id,
+                           ts.BaselineDelta.baseline_run_id,
+                           ts.BaselineDelta.generation) \
+        .filter(ts.BaselineDelta.run_id.in_(run_ids)) \
+        .distinct()
+    result = set()
+    for run_id, baseline_run_id, generation in stored:
+        pair = pairs.get((run_id, baseline_run_id))
+        if pair is not None and generation == _get_generation(*pair):
+            result.add((run_id, baseline_run_id))
+    return result
+
+
+def store_baseline_deltas(session, ts, pairs):
+    """Compute and store the deltas of the (run, baseline run) pairs which
+    are not stored yet, or out of date, and commit the session. The samples
+    of all runs involved are loaded at once.
+    """
+    pairs = dict(((run.id, baseline.id), (run, baseline))
+                 for run, baseline in pairs)
+    stored = _get_stored_pairs(session, ts, pairs)
+    missing = [pair for key, pair in pairs.items() if key not in stored]
+    if not missing:
+        return
+
+    run_ids = set()
+    for run, baseline in missing:
+        run_ids.update((run.id, baseline.id))
+    runinfo = lnt.server.reporting.analysis.RunInfo(session, ts, run_ids)
+    fields = list(ts.Sample.get_metric_fields())
+    hash_of_binary_field = ts.Sample.get_hash_of_binary_field()
+
+    rows = []
+    for run, baseline in missing:
+        # Only the tests of the two runs have a (possibly empty) delta.
+        test_ids = set(test_id
+                       for run_id, test_id in runinfo.sample_map.keys()
+                       if run_id in (run.id, baseline.id))
+        for field in fields:
+            results = runinfo.get_comparison_results(
+                [run], [baseline], field, hash_of_binary_field, test_ids)
+            rows.extend({'RunID': run.id, 'BaselineRunID': baseline.id,
+                         'FieldID': field.id, 'TestID': test_id,
+                         'Delta': cr.pct_delta,
+                         'Generation': _get_generation(run, baseline)}
+                        for test_id, cr in results.items())
+
+    delta_table = ts.BaselineDelta.__table__
+    try:
+        for run, baseline in missing:
+            session.connection().execute(delta_table.delete().where(
+                and_(delta_table.c.RunID == run.id,
+                     delta_table.c.BaselineRunID == baseline.id)))
+        if rows:
+            session.connection().execute(delta_table.insert(), rows)
+        session.commit()
+    except IntegrityError:
+        # Another request stored the same deltas first.
+        session.rollback()
+
+
+def update_baseline_deltas(session, ts, run_id):
+    """Store the deltas of a newly submitted run against the default baseline
+    of its machine, and drop those of the earlier runs of the machine, which
+    the global status page does not show anymore."""
+    run = ts.getRun(session, run_id)
+    baseline = ts.get_closest_previously_reported_runs(
+        session, [run.machine_id],
+        get_baseline_order(ts, ts.Machine.DEFAULT_BASELINE_REVISION)) \
+        .get(run.machine_id)
+
+    earlier_runs = session.query(ts.Run.id) \
+        .filter(ts.Run.machine_id == run.machine_id) \
+        .filter(or_(ts.Run.order_sort_key < run.order_sort_key,
+                    and_(ts.Run.order_sort_key == run.order_sort_key,
+                         ts.Run.start_time < run.start_time)))
+    session.query(ts.BaselineDelta) \
+        .filter(ts.BaselineDelta.run_id.in_(earlier_runs.subquery())) \
+        .delete(synchronize_session=False)
+    session.commit()
+
+    if baseline is not None:
+        store_baseline_deltas(session, ts, [(run, baseline)])
+
+
+class GlobalStatus(object):
+    """The worst deltas of the tests between the latest runs of the given
+    machines and their runs closest to a baseline revision, for one field,
+    sorted by the worst delta and split in pages of PAGE_SIZE tests."""
+
+    def __init__(self, ts, machine_runs, revision, field, page=1):
+        self.ts = ts
+        # The latest run of every machine shown.
+        self.machine_runs = machine_runs
+        self.revision = revision
+        self.field = field
+        self.page = page
+
+        # Computed by build().
+        self.machines = None
+        self.tests = None
+        self.num_pages = None
+
+    def build(self, session):
+        ts = self.ts
+        self.machines = sorted(self.machine_runs, key=lambda m: m.name)
+        baselines = ts.get_closest_previously_reported_runs(
+            session, [m.id for m in self.machines],
+            get_baseline_order(ts, self.revision))
+        pairs = [(self.machine_runs[m], baselines[m.id])
+                 for m in self.machines if m.id in baselines]
+        store_baseline_deltas(session, ts, pairs)
+
+        self.tests = []
+        self.num_pages = 1
+        if not pairs:
+            return
+
+        delta = ts.BaselineDelta
+        shown = and_(delta.field_id == self.field.id,
+                     or_(*[and_(delta.run_id == run.id,
+                                delta.baseline_run_id == baseline.id)
+                           for run, baseline in pairs]))
+        num_tests = session.query(func.count(delta.test_id.distinct())) \
+            .filter(shown).scalar()
+        self.num_pages = max(1, (num_tests + PAGE_SIZE - 1) // PAGE_SIZE)
+
+        # Sort by the worst delta, putting the tests without any last.
+        worst = func.max(delta.delta)
+        page = session.query(delta.test_id, worst) \
+            .filter(shown) \
+            .group_by(delta.test_id) \
+            .order_by(worst.is_(None), worst.desc(), delta.test_id) \
+            .offset((self.page - 1) * PAGE_SIZE) \
+            .limit(PAGE_SIZE) \
+            .all()
+        if not page:
+            return
+
+        test_ids = [test_id for test_id, _ in page]
+        names = dict(session.query(ts.Test.id, ts.Test.name)
+                     .filter(ts.Test.id.in_(test_ids)))
+        cells = {}
+        for test_id, run_id, value in session.query(
+                delta.test_id, delta.run_id, delta.delta) \
+                .filter(shown).filter(delta.test_id.in_(test_ids)):
+            cells[(test_id, run_id)] = value
+
+        # Each row is the test, its worst delta and the delta of every
+        # machine, None for the machines without a baseline.
+        for test_id, worst_value in page:
+            row = [(test_id, names[test_id]), worst_value]
+            row.extend(cells.get((test_id, self.machine_runs[m].id))
+                       for m in self.machines)
+            self.tests.append(row)
@@ -2,11 +2,61 @@
 Report functionality centered around individual runs.
 """
 
+import collections
+import threading
 import time
 import lnt.server.reporting.analysis
 import lnt.server.ui.app
 import lnt.util.stats
 
+# The number of run reports whose analysis is kept in memory.
+REPORT_CACHE_SIZE = 32
+
+
+class ReportCache(object):
+    """
+    A bounded cache of the analysis of run reports: the samples loaded for
+    the runs compared and the comparison results, which are by far the most
+    expensive part of a report.
+
+    Entries are keyed by the exact runs the report compares, including how
+    often each was changed (see generate_run_data), so a run being added to,
+    replaced in or deleted from a comparison window makes the report use a
+    different entry, whichever process made the change; stale entries are
+    simply not used anymore and age out.
+    """
+    def __init__(self, size=REPORT_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+report_cache = ReportCache()
+
+
+def _window_key(runs):
+    # Replaced runs keep their ID, but not their change count.
+    return tuple((r.id, r.change_count, r.start_time, r.end_time)
+                 for r in runs)
+
 
 def generate_run_data(session, run, baseurl, num_comparison_runs=0,
                       result=None, compare_to=None, baseline=None,
@@ -53,39 +103,26 @@ def generate_run_data(session, run, baseurl, num_comparison_runs=0,
     if compare_to is None and comparison_window:
         compare_to = comparison_window[0]
 
-    # Create the run info analysis object.
-    runs_to_load = set(r.id for r in comparison_window)
-    for r in baseline_window:
-        runs_to_load.add(r.id)
-    runs_to_load.add(run.id)
-    if compare_to:
-        runs_to_load.add(compare_to.id)
-    if baseline:
-        runs_to_load.add(baseline.id)
-    sri = lnt.server.reporting.analysis.RunInfo(
-        session, ts, runs_to_load, aggregation_fn, confidence_lv)
-
-    # Get the test names, metric fields and total test counts.
-    test_names = session.query(ts.Test.name, ts.Test.id).\
-        order_by(ts.Test.name).\
-        filter(ts.Test.id.in_(sri.test_ids)).all()
     metric_fields = list(ts.Sample.get_metric_fields())
-    num_total_tests = len(metric_fields) * len(test_names)
-
-    # Gather the run-over-run changes to report, organized by field and then
-    # collated by change type.
-    run_to_run_info, test_results = _get_changes_by_type(
-        ts, run, compare_to, metric_fields, test_names, num_comparison_runs,
-        sri)
 
-    # If we have a baseline, gather the run-over-baseline results and
-    # changes.
-    if baseline:
-        run_to_baseline_info, baselined_results = _get_changes_by_type(
-            ts, run, baseline, metric_fields, test_names, num_comparison_runs,
-            sri)
-    else:
-        run_to_baseline_info = baselined_results = None
+    # Reuse the analysis of an identical report. Everything it depends on is
+    # in the key, including the runs of the comparison windows, so that it
+    # is not used anymore once they change.
+    cache_key = (ts, _window_key([run]),
+                 _window_key(filter(None, [compare_to])),
+                 _window_key(filter(None, [baseline])),
+                 _window_key(comparison_window), _window_key(baseline_window),
+                 aggregation_fn, confidence_lv, num_comparison_runs)
+    analysis = report_cache.get(cache_key)
+    if analysis is None:
+        analysis = _analyze_run(session, ts, run, compare_to, baseline,
+                                comparison_window, baseline_window,
+                                metric_fields, num_comparison_runs,
+                                aggregation_fn, confidence_lv)
+        report_cache.put(cache_key, analysis)
+    (sri, test_names, run_to_run_info, test_results, run_to_baseline_info,
+     baselined_results) = analysis
+    num_total_tests = len(metric_fields) * len(test_names)
 
     # Gather the run-over-run changes to report.
 
@@ -212,6 +249,50 @@ def generate_run_data(session, run, baseurl, num_comparison_runs=0,
     return data
 
 
+def _analyze_run(session, ts, run, compare_to, baseline, comparison_window,
+                 baseline_window, metric_fields, num_comparison_runs,
+                 aggregation_fn, confidence_lv):
+    """
+    Load the samples of the runs of a report and compare them, returning the
+    RunInfo, the names of the tests and the run-over-run and run-over-baseline
+    changes.
+    """
+    # Create the run info analysis object.
+    runs_to_load = set(r.id for r in comparison_window)
+    for r in baseline_window:
+        runs_to_load.add(r.id)
+    runs_to_load.add(run.id)
+    if compare_to:
+        runs_to_load.add(compare_to.id)
+    if baseline:
+        runs_to_load.add(baseline.id)
+    sri = lnt.server.reporting.analysis.RunInfo(
+        session, ts, runs_to_load, aggregation_fn, confidence_lv)
+
+    # Get the test names.
+    test_names = session.query(ts.Test.name, ts.Test.id).\
+        order_by(ts.Test.name).\
+        filter(ts.Test.id.in_(sri.test_ids)).all()
+
+    # Gather the run-over-run changes to report, organized by field and then
+    # collated by change type.
+    run_to_run_info, test_results = _get_changes_by_type(
+        ts, run, compare_to, metric_fields, test_names, num_comparison_runs,
+        sri)
+
+    # If we have a baseline, gather the run-over-baseline results and
+    # changes.
+    if baseline:
+        run_to_baseline_info, baselined_results = _get_changes_by_type(
+            ts, run, baseline, metric_fields, test_names, num_comparison_runs,
+            sri)
+    else:
+        run_to_baseline_info = baselined_results = None
+
+    return (sri, test_names, run_to_run_info, test_results,
+            run_to_baseline_info, baselined_results)
+
+
 def _get_changes_by_type(ts, run_a, run_b, metric_fields, test_names,
                          num_comparison_runs, sri):
     comparison_results = {}
@@ -225,10 +306,12 @@ def _get_changes_by_type(ts, run_a, run_b, metric_fields, test_names,
         added_tests = []
         existing_failures = []
         unchanged_tests = []
+        field_results = sri.get_comparison_results(
+            [run_a], [run_b] if run_b is not None else [], field,
+            ts.Sample.get_hash_of_binary_field(),
+            [test_id for _, test_id in test_names])
         for name, test_id in test_names:
-            cr = sri.get_run_comparison_result(
-                run_a, run_b, test_id, field,
-                ts.Sample.get_hash_of_binary_field())
+            cr = field_results[test_id]
             comparison_results[(name, field)] = cr
             test_status = cr.get_test_status()
             perf_status = cr.get_value_status()
@@ -1,4 +1,9 @@
+import json
 import re
+import zlib
+
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
 
 import lnt.testing
 import lnt.util.stats
@@ -86,6 +91,17 @@ class NormalizedMean(Mean):
                             for v in values])
 
 ###
+# Stored datapoints
+
+
+def _encode_datapoints(datapoints):
+    return zlib.compress(json.dumps(datapoints, separators=(',', ':')))
+
+
+def _decode_datapoints(data):
+    return json.loads(zlib.decompress(data))
+
+###
 
 
 class SummaryReport(object):
@@ -105,33 +121,35 @@ class SummaryReport(object):
         self.data_table = None
         self.requested_machine_ids = None
         self.requested_machines = None
-        self.runs_at_index = None
+        self.machine_orders_at_index = None
 
         self.warnings = []
 
     def build(self, session):
-        # Build a per-testsuite list of the machines that match the specified
-        # patterns.
-        def should_be_in_report(machine):
-            if machine.name in self.report_machine_names:
+        # Build a per-testsuite map of the machines that match the specified
+        # patterns, from machine id to name.
+        def should_be_in_report(name):
+            if name in self.report_machine_names:
                 return True
             for rex in self.report_machine_rexes:
-                if rex.match(machine.name):
+                if rex.match(name):
                     return True
         self.requested_machines = dict(
-            (ts, filter(should_be_in_report, session.query(ts.Machine).all()))
+            (ts, dict((machine_id, name) for machine_id, name in
+                      session.query(ts.Machine.id, ts.Machine.name)
+                      if should_be_in_report(name)))
             for ts in self.testsuites)
         self.requested_machine_ids = dict(
-            (ts, [m.id for m in machines])
+            (ts, list(machines))
             for ts, machines in self.requested_machines.items()
         )
 
-        # First, collect all the runs to summarize on, for each index in the
-        # report orders.
-        self.runs_at_index = []
+        # First, collect the machines and orders with runs to summarize on,
+        # for each index in the report orders.
+        self.machine_orders_at_index = []
         for _, orders in self.report_orders:
             # For each test suite...
-            runs = []
+            machine_orders = []
             for ts in self.testsuites:
                 # Find all the orders that match.
                 result = session.query(ts.Order.id).\
@@ -139,27 +157,24 @@ class SummaryReport(object):
                         orders)).all()
                 ts_order_ids = [id for id, in result]
 
-                # Find all the runs that matchs those orders.
-                if not ts_order_ids:
-                    ts_runs = []
+                # Find all the machines with runs at those orders.
+                if not ts_order_ids or not self.requested_machine_ids[ts]:
+                    ts_machine_orders = []
                 else:
-                    ts_runs = session.query(ts.Run).\
+                    ts_machine_orders = session.query(
+                        ts.Run.machine_id, ts.Run.order_id).\
                         filter(ts.Run.order_id.in_(ts_order_ids)).\
                         filter(ts.Run.machine_id.in_(
-                            self.requested_machine_ids[ts])).all()
+                            self.requested_machine_ids[ts])).\
+                        distinct().all()
 
-                if not ts_runs:
+                if not ts_machine_orders:
                     self.warnings.append(
                         'no runs for test suite %r in orders %r' % (
                             ts.name, orders))
 
-                runs.append((ts_runs, ts_order_ids))
-            self.runs_at_index.append(runs)
-
-        # Load the tests for each testsuite.
-        self.tests = dict((ts, dict((test.id, test)
-                                    for test in session.query(ts.Test)))
-                          for ts in self.testsuites)
+                machine_orders.append((ts_machine_orders, ts_order_ids))
+            self.machine_orders_at_index.append(machine_orders)
 
         # Compute the base table for aggregation.
         #
@@ -179,7 +194,7 @@ class SummaryReport(object):
         #   <machine id>)
 
         self.data_table = {}
-        self._build_data_table()
+        self._build_data_table(session)
 
         # Compute indexed data table by applying the indexing functions.
         self._build_indexed_data_table()
@@ -190,19 +205,105 @@ class SummaryReport(object):
         # Build final organized data tables.
         self._build_final_data_tables()
 
-    def _build_data_table(self):
+    def _build_data_table(self, session):
+        # For each test suite, get the datapoints of the runs of every machine
+        # and order, a list of:
+        #   [<test name>, <metric>, <arch>, <build mode>, <values>]
+        datapoints = {}
+        for i, ts in enumerate(self.testsuites):
+            ts_machine_orders = set()
+            for machine_orders in self.machine_orders_at_index:
+                ts_machine_orders.update(machine_orders[i][0])
+            datapoints[ts] = self._get_datapoints(session, ts,
+                                                  ts_machine_orders)
+
+        # For each column...
+        for index, machine_orders in enumerate(self.machine_orders_at_index):
+            # For each test suite and machine and order...
+            for ts, (ts_machine_orders, _) in zip(self.testsuites,
+                                                  machine_orders):
+                machine_names = self.requested_machines[ts]
+                for machine_id, order_id in ts_machine_orders:
+                    machine_name = machine_names[machine_id]
+                    for test_name, metric, arch, build_mode, values in \
+                            datapoints[ts][(machine_id, order_id)]:
+                        key = (test_name, metric, arch, build_mode,
+                               machine_name)
+                        items = self.data_table.get(key)
+                        if items is None:
+                            items = [[]
+                                     for _ in self.report_orders]
+                            self.data_table[key] = items
+                        items[index].extend(values)
+
+    def _get_datapoints(self, session, ts, machine_orders):
+        """
+        _get_datapoints(session, ts, machine_orders)
+            -> {(machine id, order id): datapoints}
+
+        Read the stored datapoints of the given machines and orders, computing
+        and storing those which are missing or out of date.
+        """
+        datapoints = {}
+        if not machine_orders:
+            return datapoints
+        machine_ids = set(machine_id for machine_id, _ in machine_orders)
+        order_ids = set(order_id for _, order_id in machine_orders)
+        # Look up the generations before computing anything, so that the rows
+        # of runs imported meanwhile are stored as out of date.
+        generations = ts.get_run_generations(
+            session, [ts.Run.machine_id, ts.Run.order_id],
+            ts.Run.machine_id.in_(machine_ids),
+            ts.Run.order_id.in_(order_ids))
+        for machine_id, order_id, data, generation in session.query(
+                ts.SummaryReportData.machine_id,
+                ts.SummaryReportData.order_id,
+                ts.SummaryReportData.data,
+                ts.SummaryReportData.generation) \
+                .filter(ts.SummaryReportData.machine_id.in_(machine_ids)) \
+                .filter(ts.SummaryReportData.order_id.in_(order_ids)):
+            key = (machine_id, order_id)
+            if key in machine_orders and generation == generations.get(key):
+                datapoints[key] = _decode_datapoints(data)
+
+        missing = machine_orders - set(datapoints)
+        if missing:
+            computed = self._compute_datapoints(session, ts, missing)
+            data_table = ts.SummaryReportData.__table__
+            try:
+                for machine_id, order_id in missing:
+                    session.execute(data_table.delete().where(
+                        and_(data_table.c.MachineID == machine_id,
+                             data_table.c.OrderID == order_id)))
+                session.execute(
+                    data_table.insert(),
+                    [{'MachineID': machine_id, 'OrderID': order_id,
+                      'Data': _encode_datapoints(data),
+                      'Generation': generations.get((machine_id, order_id))}
+                     for (machine_id, order_id), data in computed.items()])
+                session.commit()
+            except IntegrityError:
+                # Another request stored the same rows first.
+                session.rollback()
+            datapoints.update(computed)
+        return datapoints
+
+    def _compute_datapoints(self, session, ts, machine_orders):
+        """
+        _compute_datapoints(session, ts, machine_orders)
+            -> {(machine id, order id): datapoints}
+
+        Compute the datapoints of the given machines and orders from the
+        samples of their runs.
+        """
         def get_nts_datapoints_for_sample(ts, sample):
             # Get the basic sample info.
             run_id = sample[0]
-            machine_id = run_machine_id_map[run_id]
             run_parameters = run_parameters_map[run_id]
 
-            # Get the test.
-            test = ts_tests[sample[1]]
-
             # The test name for a sample in the NTS suite is just the name of
             # the sample test.
-            test_name = test.name
+            test_name = sample[1]
 
             # The arch and build mode are derived from the run flags.
             arch = run_parameters['cc_target'].split('-')[0]
@@ -216,6 +317,9 @@ class SummaryReport(object):
 
             # Return a datapoint for each passing field.
             for field_name, field, status_field in ts_sample_metric_fields:
+                if field_name not in ('compile_time', 'execution_time'):
+                    continue
+
                 # Ignore failing samples.
                 if status_field:
                     status_field_index = ts.get_field_index(status_field)
@@ -234,20 +338,15 @@ class SummaryReport(object):
                 else:
                     assert field_name == 'execution_time'
                     metric = 'Execution Time'
-                yield ((test_name, metric, arch, build_mode, machine_id),
-                       value)
+                yield (test_name, metric, arch, build_mode), value
 
         def get_compile_datapoints_for_sample(ts, sample):
             # Get the basic sample info.
             run_id = sample[0]
-            machine_id = run_machine_id_map[run_id]
             run_parameters = run_parameters_map[run_id]
 
-            # Get the test.
-            test = ts_tests[sample[1]]
-
             # Extract the compile flags from the test name.
-            base_name, flags = test.name.split('(')
+            base_name, flags = sample[1].split('(')
             assert flags[-1] == ')'
             other_flags = []
             build_mode = None
@@ -305,7 +404,7 @@ class SummaryReport(object):
 
                 # Otherwise, return a datapoint.
                 yield (('%s.%s' % (test_name_prefix, field_name), metric, arch,
-                        build_mode, machine_id), value)
+                        build_mode), value)
 
         def get_datapoints_for_sample(ts, sample):
             # The exact datapoints in each sample depend on the testsuite
@@ -315,44 +414,45 @@ class SummaryReport(object):
                 assert ts.name == 'compile'
                 return get_compile_datapoints_for_sample(ts, sample)
 
-        # For each column...
-        for index, runs in enumerate(self.runs_at_index):
-            # For each test suite and run list...
-            for ts, (ts_runs, _) in zip(self.testsuites, runs):
-                ts_tests = self.tests[ts]
-
-                # Compute the metric fields.
-                ts_sample_metric_fields = [
-                    (f.name, f, f.status_field)
-                    for f in ts.Sample.get_metric_fields()]
-
-                # Compute a mapping from run id to run.
-                run_id_map = dict((r.id, r)
-                                  for r in ts_runs)
-
-                # Compute a mapping from run id to machine id.
-                run_machine_id_map = dict((r.id, r.machine.name)
-                                          for r in ts_runs)
-
-                # Preload the run parameters.
-                run_parameters_map = dict((r.id, r.parameters)
-                                          for r in ts_runs)
-
-                # Load all the samples for all runs we are interested in.
-                columns = [ts.Sample.run_id, ts.Sample.test_id]
-                columns.extend(f.column for f in ts.sample_fields)
-                samples = session.query(*columns).filter(
-                    ts.Sample.run_id.in_(run_id_map.keys()))
-                for sample in samples:
-                    run = run_id_map[sample[0]]
-                    datapoints = list()
-                    for key, value in get_datapoints_for_sample(ts, sample):
-                        items = self.data_table.get(key)
-                        if items is None:
-                            items = [[]
-                                     for _ in self.report_orders]
-                            self.data_table[key] = items
-                        items[index].append(value)
+        # Compute the metric fields.
+        ts_sample_metric_fields = [
+            (f.name, f, f.status_field)
+            for f in ts.Sample.get_metric_fields()]
+
+        # Load the runs of the machines and orders.
+        runs = [r for r in session.query(ts.Run).
+                filter(ts.Run.machine_id.in_(
+                    set(machine_id for machine_id, _ in machine_orders))).
+                filter(ts.Run.order_id.in_(
+                    set(order_id for _, order_id in machine_orders)))
+                if (r.machine_id, r.order_id) in machine_orders]
+
+        # Compute a mapping from run id to machine and order.
+        run_machine_order_map = dict((r.id, (r.machine_id, r.order_id))
+                                     for r in runs)
+
+        # Preload the run parameters.
+        run_parameters_map = dict((r.id, r.parameters)
+                                  for r in runs)
+
+        # Load all the samples for all runs we are interested in, with the
+        # names of their tests.
+        tables = dict((machine_order, {}) for machine_order in machine_orders)
+        columns = [ts.Sample.run_id, ts.Test.name]
+        columns.extend(f.column for f in ts.sample_fields)
+        samples = session.query(*columns).join(ts.Test).filter(
+            ts.Sample.run_id.in_(run_machine_order_map.keys()))
+        for sample in samples:
+            table = tables[run_machine_order_map[sample[0]]]
+            for key, value in get_datapoints_for_sample(ts, sample):
+                items = table.get(key)
+                if items is None:
+                    items = table[key] = []
+                items.append(value)
+
+        return dict((machine_order,
+                     [list(key) + [values] for key, values in table.items()])
+                    for machine_order, table in tables.items())
 
     def _build_indexed_data_table(self):
         def is_in_execution_time_filter(name):
@@ -1,3 +1,4 @@
+import lnt.server.db.export
 import lnt.util.ImportData
 import sqlalchemy
 from flask import current_app, g, Response, make_response, stream_with_context
@@ -7,7 +8,8 @@ from flask_restful import Resource, abort
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
-from lnt.server.ui.util import convert_revision
+from lnt.server.db import jobqueue
+from lnt.server.ui.util import convert_revision, downsample
 from lnt.server.ui.decorators import in_db
 from lnt.testing import PASS
 from lnt.util import logger
@@ -229,10 +231,27 @@ class Machine(Resource):
                 abort(400, msg="Expected 'into' for merge request")
             into = Machine._get_machine(into_id)
             into_name = "%s:%s" % (into.name, into.id)
+            order_ids = [order_id for order_id, in session.query(
+                ts.Run.order_id).filter(ts.Run.machine_id == machine.id)
+                .distinct()]
             session.query(ts.Run) \
                 .filter(ts.Run.machine_id == machine.id) \
                 .update({ts.Run.machine_id: into.id},
                         synchronize_session=False)
+            # Move the merged runs into the geometric means of their new
+            # machine.
+            for order_id in order_ids:
+                ts.update_order_geomeans(session.connection(), machine.id,
+                                         order_id)
+                ts.update_order_geomeans(session.connection(), into.id,
+                                         order_id)
+                ts.discard_summary_report_data(session.connection(),
+                                               machine.id, order_id)
+                ts.discard_summary_report_data(session.connection(), into.id,
+                                               order_id)
+            ts.discard_daily_report_snapshots(session.connection(),
+                                              machine.id)
+            ts.discard_daily_report_snapshots(session.connection(), into.id)
             session.expire_all()  # be safe after synchronize_session==False
             # re-query Machine so we can delete it.
             machine = Machine._get_machine(machine_spec)
@@ -306,9 +325,11 @@ class Runs(Resource):
         data = request.data
         select_machine = request.values.get('select_machine', 'match')
         merge = request.values.get('merge', None)
+        config = current_app.old_config
         result = lnt.util.ImportData.import_from_string(
-            current_app.old_config, g.db_name, db, session, g.testsuite_name,
-            data, select_machine=select_machine, merge_run=merge)
+            config, g.db_name, db, session, g.testsuite_name,
+            data, select_machine=select_machine, merge_run=merge,
+            defer_post_submit=config.post_submit_workers > 0)
 
         error = result['error']
         if error is not None:
@@ -322,6 +343,10 @@ class Runs(Resource):
                    (request.url_root, g.db_name, g.testsuite_name,
                     result['run_id']))
         result['result_url'] = new_url
+        if 'job_id' in result:
+            result['job_url'] = ('%sapi/db_%s/v4/%s/jobs/%s' %
+                                 (request.url_root, g.db_name,
+                                  g.testsuite_name, result['job_id']))
         response = jsonify(result)
         response.status = '301'
         response.headers.add('Location', new_url)
@@ -345,6 +370,21 @@ class Order(Resource):
         return result
 
 
+class Job(Resource):
+    """The state of the post submission job of a run."""
+    method_decorators = [in_db]
+
+    @staticmethod
+    def get(job_id):
+        session = request.session
+        job = jobqueue.get_job(session, job_id)
+        if job is None or job.testsuite_name != g.testsuite_name:
+            abort(404, message="Invalid job.")
+        result = common_fields_factory()
+        result['job'] = job
+        return result
+
+
 class Schema(Resource):
     method_decorators = [in_db]
 
@@ -411,6 +451,41 @@ class SamplesData(Resource):
         return result
 
 
+class SamplesExport(Resource):
+    """Stream samples in the columnar format of lnt.server.db.export."""
+    method_decorators = [in_db]
+
+    @staticmethod
+    def get():
+        """Export the samples matching the machine, test, field and order
+        range filters of the request."""
+        session = request.session
+        ts = request.get_testsuite()
+        args = request.args.to_dict(flat=False)
+        try:
+            machine_ids = [int(m) for m in args.get('machine', [])]
+            test_ids = [int(t) for t in args.get('test', [])]
+            chunk_size = int(request.args.get(
+                'chunk_size', lnt.server.db.export.DEFAULT_CHUNK_SIZE))
+        except ValueError:
+            abort(400, msg="machine, test and chunk_size must be integers")
+        fields = None
+        if 'field' in args:
+            fields_by_name = dict((f.name, f) for f in ts.sample_fields)
+            unknown = [f for f in args['field'] if f not in fields_by_name]
+            if unknown:
+                abort(400, msg="Unknown fields: %s" % ', '.join(unknown))
+            fields = [fields_by_name[f] for f in args['field']]
+
+        lines = lnt.server.db.export.export_samples(
+            session, ts, chunk_size=max(chunk_size, 1),
+            machine_ids=machine_ids, test_ids=test_ids, fields=fields,
+            min_order=request.args.get('min_order'),
+            max_order=request.args.get('max_order'))
+        return Response(stream_with_context(lines),
+                        mimetype='application/x-ndjson')
+
+
 class Graph(Resource):
     """List all the machines and give summary information."""
     method_decorators = [in_db]
@@ -457,6 +532,16 @@ class Graph(Resource):
             for val, rev, time, rid in q.all()[::-1]
         ]
         samples.sort(key=lambda x: x[0])
+
+        max_points = request.values.get('max_points', None)
+        if max_points:
+            try:
+                max_points = int(max_points)
+            except ValueError:
+                abort(400, msg="max_points must be an integer")
+            if max_points < 0:
+                abort(400, msg="max_points must not be negative")
+            samples = downsample(samples, max_points)
         return samples
 
 
@@ -535,9 +620,11 @@ def load_api_resources(api):
     api.add_resource(Runs, ts_path("runs"), ts_path("runs/"))
     api.add_resource(Run, ts_path("runs/<int:run_id>"))
     api.add_resource(SamplesData, ts_path("samples"), ts_path("samples/"))
+    api.add_resource(SamplesExport, ts_path("samples/export"))
     api.add_resource(SampleData, ts_path("samples/<sample_id>"))
     api.add_resource(Schema, ts_path("schema"), ts_path("schema/"))
     api.add_resource(Order, ts_path("orders/<int:order_id>"))
+    api.add_resource(Job, ts_path("jobs/<int:job_id>"))
     graph_url = "graph/<int:machine_id>/<int:test_id>/<int:field_index>"
     api.add_resource(Graph, ts_path(graph_url))
     regression_url = \
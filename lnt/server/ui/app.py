@@ -20,6 +20,7 @@ from sqlalchemy.exc import DatabaseError
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
 import lnt
+import lnt.server.db.jobqueue
 import lnt.server.db.rules_manager
 import lnt.server.db.v4db
 import lnt.server.instance
@@ -28,6 +29,7 @@ import lnt.server.ui.globals
 import lnt.server.ui.profile_views
 import lnt.server.ui.regression_views
 import lnt.server.ui.views
+import lnt.util.ImportData
 from lnt.server.ui.api import load_api_resources
 from lnt.util import logger
 
@@ -122,9 +124,8 @@ class Request(flask.Request):
         t = self.elapsed_time()
         if t > 10:
             logger.warning("Request {} took {}s".format(self.url, t))
-        db = getattr(self, 'db', None)
-        if db is not None:
-            db.close()
+        # The database is shared by all requests of the instance, its
+        # connection pool stays open; only the session is per request.
         return super(Request, self).close()
 
 
@@ -151,6 +152,9 @@ class App(LNTExceptionLoggerFlask):
         # Load the application configuration.
         app.load_config(instance)
 
+        if app.old_config.post_submit_workers:
+            app.start_post_submit_workers(app.old_config.post_submit_workers)
+
         # Load the application routes.
         app.register_blueprint(lnt.server.ui.views.frontend)
 
@@ -218,6 +222,9 @@ class App(LNTExceptionLoggerFlask):
         # Store a few global things we want available to templates.
         self.version = lnt.__version__
 
+        # The post submission worker pool, if started.
+        self.post_submit_workers = None
+
         # Inject a fix for missing slashes on the root URL (see Flask issue
         # #169).
         self.wsgi_app = RootSlashPatchMiddleware(self.wsgi_app)
@@ -236,6 +243,18 @@ class App(LNTExceptionLoggerFlask):
 
         lnt.server.db.rules_manager.register_hooks()
 
+    def start_post_submit_workers(self, num_workers):
+        """Start `num_workers` threads performing the queued post submission
+        jobs of the instance databases; submissions then queue their analysis
+        instead of performing it before responding."""
+        if self.post_submit_workers is not None:
+            self.post_submit_workers.stop()
+        self.old_config.post_submit_workers = num_workers
+        self.post_submit_workers = lnt.server.db.jobqueue.WorkerPool(
+            self.instance, num_workers,
+            lnt.util.ImportData.perform_post_submit_job)
+        self.post_submit_workers.start()
+
     def start_file_logging(self, log_file_name):
         """Start server production logging.  At this point flask already logs
         to stderr, so just log to a file as well.
@@ -130,6 +130,14 @@ def v4_profile_ajax_getCodeForFunction():
         abort(404)
 
     p = sample.profile.load(profileDir)
+    if request.args.get('columns'):
+        # Send the code column-wise, which is much smaller than a dict of
+        # counters per instruction.
+        counters, addresses, texts = p.getCodeColumnsForFunction(f)
+        return json.dumps({
+            'counters': dict((k, v.tolist()) for k, v in counters.items()),
+            'addresses': addresses,
+            'text': texts})
     return json.dumps([x for x in p.getCodeForFunction(f)])
 
 
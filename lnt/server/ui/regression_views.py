@@ -8,6 +8,7 @@ from flask import request
 from flask import flash
 from flask import redirect
 from sqlalchemy import desc
+from sqlalchemy.orm import contains_eager, joinedload
 from sqlalchemy.orm.exc import NoResultFound
 from wtforms import SelectMultipleField, StringField, widgets, SelectField
 from wtforms import HiddenField
@@ -24,10 +25,25 @@ from lnt.server.ui.util import FLASH_DANGER, FLASH_SUCCESS, PrecomputedCR
 import lnt.server.db.fieldchange
 from lnt.server.db.regression import RegressionState, new_regression
 from lnt.server.db.regression import get_first_runs_of_fieldchange
+from lnt.server.db.regression import get_first_runs_of_fieldchanges
 from lnt.server.db.regression import get_cr_for_field_change
+from lnt.server.db.regression import get_current_crs_for_field_changes
+from lnt.server.db.regression import update_regression_summaries
 from lnt.server.db.regression import ChangeData
 from lnt.server.db import rules_manager as rule_hooks
 
+# The largest number of changes or regressions shown on one page.
+MAX_PAGE_SIZE = 5000
+
+
+def _get_page_size(default):
+    """Return the page_size argument of the request, or abort with 400 if it
+    is not between 1 and MAX_PAGE_SIZE."""
+    page_size = request.args.get('page_size', default, type=int)
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        abort(400)
+    return page_size
+
 
 class MultiCheckboxField(SelectMultipleField):
     """
@@ -73,19 +89,34 @@ def v4_new_regressions():
         session.commit()
         flash(msg + ", ".join(ignored), FLASH_SUCCESS)
 
-#    d = datetime.datetime.now()
-#    two_weeks_ago = d - datetime.timedelta(days=14)
-    recent_fieldchange = session.query(ts.FieldChange) \
+    page_size = _get_page_size(500)
+    before = request.args.get('before', type=int)
+    q = session.query(ts.FieldChange) \
         .join(ts.Test) \
         .outerjoin(ts.ChangeIgnore) \
         .filter(ts.ChangeIgnore.id.is_(None)) \
         .outerjoin(ts.RegressionIndicator) \
         .filter(ts.RegressionIndicator.id.is_(None)) \
-        .order_by(desc(ts.FieldChange.id)) \
-        .limit(500) \
+        .options(joinedload(ts.FieldChange.machine),
+                 joinedload(ts.FieldChange.field),
+                 joinedload(ts.FieldChange.start_order),
+                 joinedload(ts.FieldChange.end_order),
+                 contains_eager(ts.FieldChange.test))
+    if before is not None:
+        q = q.filter(ts.FieldChange.id < before)
+    # Fetch one more change to know whether there is a next page.
+    recent_fieldchange = q.order_by(desc(ts.FieldChange.id)) \
+        .limit(page_size + 1) \
         .all()
+    next_page = None
+    if len(recent_fieldchange) > page_size:
+        recent_fieldchange = recent_fieldchange[:page_size]
+        next_page = recent_fieldchange[-1].id
+
+    key_runs = get_first_runs_of_fieldchanges(session, ts, recent_fieldchange)
+    current_crs = get_current_crs_for_field_changes(session, ts,
+                                                    recent_fieldchange)
     crs = []
-
     form.field_changes.choices = list()
     for fc in recent_fieldchange:
         if fc.old_value is None:
@@ -93,37 +124,14 @@ def v4_new_regressions():
         else:
             cr = PrecomputedCR(fc.old_value, fc.new_value,
                                fc.field.bigger_is_better)
-            key_run = get_first_runs_of_fieldchange(session, ts, fc)
-        current_cr, _, _ = get_cr_for_field_change(session, ts, fc,
-                                                   current=True)
-        crs.append(ChangeData(fc, cr, key_run, current_cr))
+            key_run = key_runs[fc.id]
+        crs.append(ChangeData(fc, cr, key_run, current_crs[fc.id]))
         form.field_changes.choices.append((fc.id, 1,))
     return render_template("v4_new_regressions.html",
                            testsuite_name=g.testsuite_name,
                            changes=crs, analysis=lnt.server.reporting.analysis,
-                           form=form, **ts_data(ts))
-
-
-def calc_impact(session, ts, fcs):
-    crs = []
-    for fc in fcs:
-        if fc is None:
-            continue
-        if fc.old_value is None:
-            cr, _, _ = get_cr_for_field_change(session, ts, fc)
-        else:
-            cr = PrecomputedCR(fc.old_value, fc.new_value,
-                               fc.field.bigger_is_better)
-        crs.append(cr)
-    if crs:
-        olds = sum([x.previous for x in crs if x.previous])
-        news = sum([x.current for x in crs if x.current])
-        if olds and news:
-            new_cr = PrecomputedCR(olds, news, crs[0].bigger_is_better)
-            # TODO both directions
-            return new_cr
-
-    return PrecomputedCR(1, 1, True)
+                           form=form, page_size=page_size,
+                           next_page=next_page, **ts_data(ts))
 
 
 class MergeRegressionForm(Form):
@@ -186,57 +194,74 @@ def v4_regression_list():
         flash(' Deleted: '.join(titles), FLASH_SUCCESS)
         return redirect(v4_url_for(".v4_regression_list", state=state_filter))
 
-    q = session.query(ts.Regression)
+    page_size = _get_page_size(100)
+    before = request.args.get('before', type=int)
     title = "All Regressions"
     if state_filter != -1:
-        q = q.filter(ts.Regression.state == state_filter)
         title = RegressionState.names[state_filter]
-    regression_info = q.all()[::-1]
+
+    def query_page():
+        q = session.query(ts.Regression, ts.RegressionSummary) \
+            .outerjoin(ts.RegressionSummary)
+        if state_filter != -1:
+            q = q.filter(ts.Regression.state == state_filter)
+        if machine_filter:
+            machine_regressions = session.query(
+                ts.RegressionIndicator.regression_id) \
+                .join(ts.FieldChange) \
+                .join(ts.Machine) \
+                .filter(ts.Machine.name == machine_filter)
+            q = q.filter(ts.Regression.id.in_(machine_regressions))
+        if before is not None:
+            q = q.filter(ts.Regression.id < before)
+        # Fetch one more regression to know whether there is a next page.
+        return q.order_by(desc(ts.Regression.id)).limit(page_size + 1).all()
+
+    page = query_page()
+    # Summarize the regressions that predate the summary table.
+    missing = [regression.id for regression, summary in page
+               if summary is None]
+    if missing:
+        update_regression_summaries(session, ts, missing)
+        session.commit()
+        page = query_page()
+    next_page = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_page = page[-1][0].id
+    # A concurrent request may have discarded a summary again since it was
+    # computed; leave those regressions out rather than show them without.
+    page = [(regression, summary) for regression, summary in page
+            if summary is not None]
 
     form.regression_checkboxes.choices = list()
-    regression_sizes = []
+    regressions = []
+    summaries = []
     impacts = []
     ages = []
-
-    filtered_regressions = []
-    for regression in regression_info:
-        reg_inds = session.query(ts.RegressionIndicator) \
-            .filter(ts.RegressionIndicator.regression_id ==
-                    regression.id) \
-            .all()
-        if machine_filter:
-            machine_names = \
-                set([x.field_change.machine.name for x in reg_inds])
-            if machine_filter in machine_names:
-                filtered_regressions.append(regression)
-            else:
-                continue
-        else:
-            filtered_regressions.append(regression)
+    for regression, summary in page:
         form.regression_checkboxes.choices.append((regression.id, 1,))
-
-        regression_sizes.append(len(reg_inds))
-        impacts.append(calc_impact(session, ts,
-                                   [x.field_change for x in reg_inds]))
-        # Now guess the regression age:
-        if len(reg_inds) and reg_inds[0].field_change and \
-                reg_inds[0].field_change.run:
-            age = reg_inds[0].field_change.run.end_time
-        else:
-            age = EmptyDate()
-        ages.append(age)
+        regressions.append(regression)
+        summaries.append(summary)
+        impacts.append(PrecomputedCR(summary.impact_previous,
+                                     summary.impact_current, True))
+        ages.append(summary.age or EmptyDate())
 
     return render_template("v4_regression_list.html",
                            testsuite_name=g.testsuite_name,
-                           regressions=filtered_regressions,
+                           regressions=regressions,
                            highlight=request.args.get('highlight'),
                            title=title,
                            RegressionState=RegressionState,
                            state_filter=state_filter,
+                           machine_filter=machine_filter,
                            form=form,
-                           sizes=regression_sizes,
+                           summaries=summaries,
                            impacts=impacts,
                            ages=ages,
+                           page_size=page_size,
+                           before=before,
+                           next_page=next_page,
                            analysis=lnt.server.reporting.analysis,
                            **ts_data(ts))
 
@@ -443,6 +443,20 @@ function startsWith(string, startString) {
     return string.substr(0, startString.length) === startString;
 }
 
+// Turn the column-wise code of a function, as returned by getCodeForFunction
+// with columns=1, into a list of [counters, address, text] instructions.
+function pf_code_from_columns(data) {
+    var code = [];
+    var names = Object.keys(data.counters);
+    for (var i = 0; i < data.text.length; ++i) {
+        var counters = {};
+        for (var j = 0; j < names.length; ++j)
+            counters[names[j]] = data.counters[names[j]][i];
+        code.push([counters, data.addresses[i], data.text[i]]);
+    }
+    return code;
+}
+
 Profile.prototype = {
     reset: function() {
         $(this.element).empty();
@@ -467,9 +481,9 @@ Profile.prototype = {
         $.ajax(g_urls.getCodeForFunction, {
             dataType: "json",
             data: {'runid': this.runid, 'testid': this.testid,
-                   'f': fname},
+                   'f': fname, 'columns': 1},
             success: function(data) {
-                this_.data = data;
+                this_.data = pf_code_from_columns(data);
                 this_._display();
             },
             error: function(xhr, textStatus, errorThrown) {
@@ -301,6 +301,77 @@ def convert_revision(dotted, cache=None):
     return val
 
 
+def revision_sort_key(revision):
+    """Turn a converted revision (see convert_revision) into a string that
+    sorts the same way the revision tuples compare.
+    (1, 2, 3) -> "011012013."
+    (1, 10) -> "0110210."
+
+    Every component is written as its number of digits followed by the
+    digits themselves, so longer numbers sort after shorter ones. The
+    trailing '.' sorts before any digit, which keeps a revision in front of
+    all revisions it is a prefix of. Concatenating the keys of several
+    revisions therefore sorts like the tuple of the revisions.
+
+    The keys only sort right when compared byte by byte, as Python does.
+    Components of more than 99 digits do not fit the length and raise a
+    ValueError.
+    """
+    key = []
+    for i in revision:
+        digits = str(i)
+        if len(digits) > 99:
+            raise ValueError("revision component %r is too long" % digits)
+        key.append('%02d%s' % (len(digits), digits))
+    return ''.join(key) + '.'
+
+
+def downsample(points, max_points):
+    """Reduce a series of (x, y, ...) points sorted by x to at most
+    `max_points` points with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are always kept. The other points are split
+    into equal buckets and from every bucket the point forming the largest
+    triangle with the previously kept point and the average of the next
+    bucket is kept, which preserves the spikes a plain stride would drop.
+    The triangles are measured with the index of the points as their x
+    coordinate, since x may be anything sortable, like a revision tuple.
+    The series is returned unchanged if it is short enough or `max_points`
+    is 0 (not set); it must not be negative.
+    """
+    assert max_points >= 0
+    num_points = len(points)
+    if not max_points or num_points <= max_points:
+        return points
+    if max_points < 3:
+        return [points[0], points[-1]][:max_points]
+
+    sampled = [points[0]]
+    bucket_size = float(num_points - 2) / (max_points - 2)
+    a = 0
+    for i in range(max_points - 2):
+        # The average point of the next bucket (the last point for the last
+        # bucket).
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, num_points)
+        next_bucket = points[next_start:next_end]
+        avg_x = (next_start + next_end - 1) / 2.0
+        avg_y = sum(p[1] for p in next_bucket) / float(len(next_bucket))
+
+        ay = points[a][1]
+        max_area = -1
+        for j in range(int(i * bucket_size) + 1, next_start):
+            area = abs((a - avg_x) * (points[j][1] - ay) -
+                       (a - j) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        sampled.append(points[next_a])
+        a = next_a
+    sampled.append(points[-1])
+    return sampled
+
+
 class PrecomputedCR():
     """Make a thing that looks like a comprison result, that is derived
     from a field change."""
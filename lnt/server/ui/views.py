@@ -26,6 +26,7 @@ import lnt.server.db.rules_manager
 import lnt.server.db.search
 import lnt.server.reporting.analysis
 import lnt.server.reporting.dailyreport
+import lnt.server.reporting.globalstatus
 import lnt.server.reporting.runs
 import lnt.server.reporting.summaryreport
 import lnt.server.ui.util
@@ -150,9 +151,11 @@ def _do_submit():
     session = request.session
     db = request.get_db()
 
+    config = current_app.old_config
     result = lnt.util.ImportData.import_from_string(
-        current_app.old_config, g.db_name, db, session, g.testsuite_name,
-        data_value, select_machine=select_machine, merge_run=merge_run)
+        config, g.db_name, db, session, g.testsuite_name,
+        data_value, select_machine=select_machine, merge_run=merge_run,
+        defer_post_submit=config.post_submit_workers > 0)
 
     # It is nice to have a full URL to the run, so fixup the request URL
     # here were we know more about the flask instance.
@@ -744,6 +747,99 @@ def v4_graph_for_sample(sample_id, field_name):
     return redirect(graph_url)
 
 
+def _load_graph_data(session, ts, graph_parameters, baselines, show_failures,
+                     revision_cache):
+    """Load the samples of all the requested plots and baselines.
+
+    The samples of every (machine, test, field) plot are fetched with a
+    single query and bucketed per plot, instead of one query per plot and
+    baseline. Returns a pair:
+
+      - for each plot, the list of (revision, [(value, date, run id), ...])
+        sorted by revision.
+      - a dict mapping (baseline run id, plot index) to the (values, revision,
+        machine name) of the baseline samples of the plot's test and field.
+    """
+    # Select every field plotted or used to filter failures once.
+    columns = []
+    column_index = {}
+
+    def add_column(field):
+        if field.name not in column_index:
+            column_index[field.name] = len(columns)
+            columns.append(field.column)
+        return column_index[field.name]
+
+    plots_by_key = defaultdict(list)
+    plots_by_test = defaultdict(list)
+    for i, (machine, test, field, _) in enumerate(graph_parameters):
+        value_index = add_column(field)
+        status_index = None
+        # Unless all samples requested, filter out failing tests.
+        if not show_failures and field.status_field:
+            status_index = add_column(field.status_field)
+        plots_by_key[(machine.id, test.id)].append(
+            (i, value_index, status_index))
+        plots_by_test[test.id].append((i, value_index))
+
+    plots_data = [[] for _ in graph_parameters]
+    baseline_data = {}
+    if not graph_parameters:
+        return plots_data, baseline_data
+    test_ids = list(plots_by_test)
+
+    # Load all the field values for the tests on the plotted machines. This
+    # can fetch some (machine, test) pairs that are not plotted; those rows
+    # are dropped while bucketing.
+    q = session.query(ts.Run.machine_id, ts.Sample.test_id,
+                      ts.Order.llvm_project_revision, ts.Run.start_time,
+                      ts.Run.id, *columns) \
+        .select_from(ts.Sample).join(ts.Run).join(ts.Order) \
+        .filter(ts.Run.machine_id.in_(set(k[0] for k in plots_by_key))) \
+        .filter(ts.Sample.test_id.in_(test_ids))
+    for row in q:
+        plots = plots_by_key.get((row[0], row[1]))
+        if plots is None:
+            continue
+        values = row[5:]
+        for i, value_index, status_index in plots:
+            val = values[value_index]
+            if val is None:
+                continue
+            if status_index is not None and \
+                    values[status_index] not in (PASS, None):
+                continue
+            plots_data[i].append((row[2], (val, row[3], row[4])))
+
+    # Aggregate by revision.
+    for i, samples in enumerate(plots_data):
+        data = multidict.multidict(samples).items()
+        data.sort(key=lambda sample: convert_revision(sample[0],
+                                                      cache=revision_cache))
+        plots_data[i] = data
+
+    if baselines:
+        q = session.query(ts.Run.id, ts.Sample.test_id,
+                          ts.Order.llvm_project_revision, ts.Machine.name,
+                          *columns) \
+            .select_from(ts.Sample) \
+            .join(ts.Run).join(ts.Order).join(ts.Machine) \
+            .filter(ts.Run.id.in_(set(b.id for b in baselines))) \
+            .filter(ts.Sample.test_id.in_(test_ids))
+        for row in q:
+            values = row[4:]
+            for i, value_index in plots_by_test[row[1]]:
+                val = values[value_index]
+                if val is None:
+                    continue
+                key = (row[0], i)
+                if key not in baseline_data:
+                    baseline_data[key] = ([], row[2], row[3])
+                baseline_data[key][0].append(val)
+
+    return plots_data, baseline_data
+
+
 @v4_route("/graph")
 def v4_graph():
 
@@ -789,6 +885,13 @@ def v4_graph():
         request.args.get('show_moving_median'))
     options['moving_window_size'] = moving_window_size = int(
         request.args.get('moving_window_size', 10))
+    try:
+        options['max_points'] = max_points = int(
+            request.args.get('max_points', 0))
+    except ValueError:
+        abort(400)
+    if max_points < 0:
+        abort(400)
     options['hide_highlight'] = bool(
         request.args.get('hide_highlight'))
     options['logarithmic_scale'] = bool(
@@ -797,7 +900,7 @@ def v4_graph():
     show_highlight = not options['hide_highlight']
 
     # Load the graph parameters.
-    graph_parameters = []
+    plot_parameters = []
     for name, value in request.args.items():
         # Plots to graph are passed as::
         #
@@ -816,16 +919,22 @@ def v4_graph():
 
         if not (0 <= field_index < len(ts.sample_fields)):
             return abort(404)
-
-        try:
-            machine = session.query(ts.Machine) \
-                             .filter(ts.Machine.id == machine_id) \
-                             .one()
-            test = session.query(ts.Test).filter(ts.Test.id == test_id).one()
-            field = ts.sample_fields[field_index]
-        except NoResultFound:
+        plot_parameters.append((machine_id, test_id, field_index))
+
+    # Look up the machines and tests of all plots at once.
+    machines = {}
+    tests = {}
+    if plot_parameters:
+        machines = dict((m.id, m) for m in session.query(ts.Machine).filter(
+            ts.Machine.id.in_(set(p[0] for p in plot_parameters))))
+        tests = dict((t.id, t) for t in session.query(ts.Test).filter(
+            ts.Test.id.in_(set(p[1] for p in plot_parameters))))
+    graph_parameters = []
+    for machine_id, test_id, field_index in plot_parameters:
+        if machine_id not in machines or test_id not in tests:
             return abort(404)
-        graph_parameters.append((machine, test, field, field_index))
+        graph_parameters.append((machines[machine_id], tests[test_id],
+                                 ts.sample_fields[field_index], field_index))
 
     # Order the plots by machine name, test name and then field.
     graph_parameters.sort(key=lambda (m, t, f, _): (m.name, t.name, f.name, _))
@@ -922,6 +1031,9 @@ def v4_graph():
     baseline_plots = []
     revision_cache = {}
     num_plots = len(graph_parameters)
+    plots_data, baseline_data = _load_graph_data(
+        session, ts, graph_parameters, [b for b, _ in baseline_parameters],
+        show_failures, revision_cache)
     for i, (machine, test, field, field_index) in enumerate(graph_parameters):
         # Determine the base plot color.
         col = list(util.makeDarkColor(float(i) / num_plots))
@@ -929,49 +1041,16 @@ def v4_graph():
         legend.append(LegendItem(machine, test.name, field.name, tuple(col),
                                  url))
 
-        # Load all the field values for this test on the same machine.
-        #
-        # FIXME: Don't join to Order here, aggregate this across all the tests
-        # we want to load. Actually, we should just make this a single query.
-        #
-        # FIXME: Don't hard code field name.
-        q = session.query(field.column, ts.Order.llvm_project_revision,
-                          ts.Run.start_time, ts.Run.id) \
-            .join(ts.Run).join(ts.Order) \
-            .filter(ts.Run.machine_id == machine.id) \
-            .filter(ts.Sample.test == test) \
-            .filter(field.column.isnot(None))
-
-        # Unless all samples requested, filter out failing tests.
-        if not show_failures:
-            if field.status_field:
-                q = q.filter((field.status_field.column == PASS) |
-                             (field.status_field.column.is_(None)))
-
-        # Aggregate by revision.
-        data = multidict.multidict((rev, (val, date, run_id))
-                                   for val, rev, date, run_id in q).items()
-
-        data.sort(key=lambda sample: convert_revision(sample[0], cache=revision_cache))
-
-        graph_datum.append((test.name, data, col, field, url))
+        graph_datum.append((test.name, plots_data[i], col, field, url))
 
         # Get baselines for this line
         num_baselines = len(baseline_parameters)
         for baseline_id, (baseline, baseline_title) in \
                 enumerate(baseline_parameters):
-            q_baseline = session.query(field.column,
-                                       ts.Order.llvm_project_revision,
-                                       ts.Run.start_time, ts.Machine.name) \
-                         .join(ts.Run).join(ts.Order).join(ts.Machine) \
-                         .filter(ts.Run.id == baseline.id) \
-                         .filter(ts.Sample.test == test) \
-                         .filter(field.column.isnot(None))
             # In the event of many samples, use the mean of the samples as the
             # baseline.
-            samples = []
-            for sample in q_baseline:
-                samples.append(sample[0])
+            samples, revision, machine_name = \
+                baseline_data.get((baseline.id, i), ([], None, None))
             # Skip this baseline if there is no data.
             if not samples:
                 continue
@@ -986,10 +1065,10 @@ def v4_graph():
                 'color': str_dark_col,
                 'lineWidth': 2,
                 'yaxis': {'from': mean, 'to': mean},
-                'name': q_baseline[0].llvm_project_revision,
+                'name': revision,
             })
             baseline_name = ("Baseline {} on {}"
-                             .format(baseline_title, q_baseline[0].name))
+                             .format(baseline_title, machine_name))
             legend.append(LegendItem(BaselineLegendItem(
                 baseline_name, baseline.id), test.name, field.name, dark_col,
                 None))
@@ -1002,23 +1081,19 @@ def v4_graph():
         col = (0, 0, 0)
         legend.append(LegendItem(machine, test_name, field.name, col, None))
 
-        q = session.query(sqlalchemy.sql.func.min(field.column),
+        # The geomean of each revision is maintained on import, see
+        # TestSuiteDB.update_order_geomeans.
+        q = session.query(ts.OrderGeomean.value,
                           ts.Order.llvm_project_revision,
-                          sqlalchemy.sql.func.min(ts.Run.start_time)) \
-                   .join(ts.Run).join(ts.Order).join(ts.Test) \
-                   .filter(ts.Run.machine_id == machine.id) \
-                   .filter(field.column.isnot(None)) \
-                   .group_by(ts.Order.llvm_project_revision, ts.Test)
-
-        # Calculate geomean of each revision.
-        data = multidict.multidict(
-                    ((rev, date), val) for val, rev, date in q).items()
-        data = [(rev,
-                 [(lnt.server.reporting.analysis.calc_geomean(vals), date)])
-                for ((rev, date), vals) in data]
+                          ts.OrderGeomean.start_time) \
+                   .join(ts.Order) \
+                   .filter(ts.OrderGeomean.machine_id == machine.id) \
+                   .filter(ts.OrderGeomean.field_id == field.id)
+        data = [(rev, [(val, date)]) for val, rev, date in q]
 
         # Sort data points according to revision number.
-        data.sort(key=lambda sample: convert_revision(sample[0]))
+        data.sort(key=lambda sample: convert_revision(sample[0],
+                                                      cache=revision_cache))
 
         graph_datum.append((test_name, data, col, field, None))
 
@@ -1095,33 +1170,23 @@ def v4_graph():
         # Compute the moving average and or moving median of our data if
         # requested.
         if moving_average or moving_median:
-
-            def compute_moving_average(x, window, average_list, _):
-                average_list.append((x, lnt.util.stats.mean(window)))
-
-            def compute_moving_median(x, window, _, median_list):
-                median_list.append((x, lnt.util.stats.median(window)))
-
-            def compute_moving_average_and_median(x, window, average_list,
-                                                  median_list):
-                average_list.append((x, lnt.util.stats.mean(window)))
-                median_list.append((x, lnt.util.stats.median(window)))
-
-            if moving_average and moving_median:
-                fun = compute_moving_average_and_median
-            elif moving_average:
-                fun = compute_moving_average
-            else:
-                fun = compute_moving_median
-
-            len_pts = len(pts)
-            for i in range(len_pts):
-                start_index = max(0, i - moving_window_size)
-                end_index = min(len_pts, i + moving_window_size)
-
-                window_pts = [x[1] for x in pts[start_index:end_index]]
-                fun(pts[i][0], window_pts, moving_average_data,
-                    moving_median_data)
+            xs = [x[0] for x in pts]
+            ys = [x[1] for x in pts]
+            if moving_average:
+                moving_average_data = zip(
+                    xs, lnt.util.stats.moving_average(ys, moving_window_size))
+            if moving_median:
+                moving_median_data = zip(
+                    xs, lnt.util.stats.moving_median(ys, moving_window_size))
+
+        # Limit the number of points sent for long series. The statistics
+        # above were computed on all the points.
+        all_pts = pts
+        pts = util.downsample(pts, max_points)
+        points_data = util.downsample(points_data, max_points)
+        errorbar_data = util.downsample(errorbar_data, max_points)
+        moving_average_data = util.downsample(moving_average_data, max_points)
+        moving_median_data = util.downsample(moving_median_data, max_points)
 
         # On the overview, we always show the line plot.
         overview_plots.append({
@@ -1140,8 +1205,8 @@ def v4_graph():
             graph_plots.append(plot)
         # Add regression line, if requested.
         if show_linear_regression:
-            xs = [t for t, v, _ in pts]
-            ys = [v for t, v, _ in pts]
+            xs = [t for t, v, _ in all_pts]
+            ys = [v for t, v, _ in all_pts]
 
             # We compute the regression line in terms of a normalized X scale.
             x_min, x_max = min(xs), max(xs)
@@ -1305,91 +1370,46 @@ def v4_global_status():
                                     ts.Machine.DEFAULT_BASELINE_REVISION))
     field = fields.get(request.args.get('field', None), metric_fields[0])
 
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        abort(400)
+
     # Get the list of all runs we might be interested in.
     recent_runs = session.query(ts.Run) \
+        .options(joinedload(ts.Run.machine)) \
         .filter(ts.Run.start_time > yesterday) \
         .all()
 
-    # Aggregate the runs by machine.
-    recent_runs_by_machine = multidict.multidict()
+    # Choose the "best" run of every machine to report on. We want the most
+    # recent one with the most recent order.
+    machine_runs = {}
     for run in recent_runs:
-        recent_runs_by_machine[run.machine] = run
-
-    # Get a sorted list of recent machines.
-    recent_machines = sorted(recent_runs_by_machine.keys(),
-                             key=lambda m: m.name)
+        best = machine_runs.get(run.machine)
+        if best is None or (run.order_sort_key, run.start_time) > \
+                (best.order_sort_key, best.start_time):
+            machine_runs[run.machine] = run
 
     # We use periods in our machine names. css does not like this
     # since it uses periods to demark classes. Thus we convert periods
-    # in the names of our machines to dashes for use in css. It is
-    # also convenient for our computations in the jinja page to have
-    # access to
-    def get_machine_keys(m):
-        m.css_name = m.name.replace('.', '-')
-        return m
-    recent_machines = map(get_machine_keys, recent_machines)
-
-    # For each machine, build a table of the machine, the baseline run, and the
-    # most recent run. We also computed a list of all the runs we are reporting
-    # over.
-    machine_run_info = []
-    reported_run_ids = []
-
-    for machine in recent_machines:
-        runs = recent_runs_by_machine[machine]
-
-        # Get the baseline run for this machine.
-        baseline = machine.get_closest_previously_reported_run(session,
-                                                               revision)
-
-        # Choose the "best" run to report on. We want the most recent one with
-        # the most recent order.
-        run = max(runs, key=lambda r: (r.order, r.start_time))
-        if baseline:
-            machine_run_info.append((baseline, run))
-            reported_run_ids.append(baseline.id)
-        reported_run_ids.append(run.id)
-
-    # Get the set all tests reported in the recent runs.
-    reported_tests = session.query(ts.Test.id, ts.Test.name).filter(
-        sqlalchemy.sql.exists('*', sqlalchemy.sql.and_(
-            ts.Sample.run_id.in_(reported_run_ids),
-            ts.Sample.test_id == ts.Test.id))).all()
-
-    # Load all of the runs we are interested in.
-    runinfo = lnt.server.reporting.analysis.RunInfo(session, ts,
-                                                    reported_run_ids)
-
-    # Build the test matrix. This is a two dimensional table index by
-    # (machine-index, test-index), where each entry is the percent change.
-    test_table = []
-    for i, (test_id, test_name) in enumerate(reported_tests):
-        # Create the row, starting with the test name and worst entry.
-        row = [(test_id, test_name), None]
-
-        # Compute comparison results for each machine.
-        row.extend((runinfo.get_run_comparison_result(
-                        run, baseline, test_id, field,
-                        ts.Sample.get_hash_of_binary_field),
-                    run.id)
-                   for baseline, run in machine_run_info)
-
-        # Compute the worst cell value.
-        if len(row) > 2:
-            row[1] = max(cr.pct_delta
-                         for cr, _ in row[2:])
-
-        test_table.append(row)
-
-    # Order the table by worst regression.
-    test_table.sort(key=lambda row: row[1], reverse=True)
+    # in the names of our machines to dashes for use in css.
+    for machine in machine_runs:
+        machine.css_name = machine.name.replace('.', '-')
+
+    # Compare the runs with the closest runs to the baseline revision of their
+    # machines, and get a page of the tests sorted by the worst change.
+    status = lnt.server.reporting.globalstatus.GlobalStatus(
+        ts, machine_runs, revision, field, page)
+    status.build(session)
 
     return render_template("v4_global_status.html",
-                           tests=test_table,
-                           machines=recent_machines,
+                           tests=status.tests,
+                           machines=status.machines,
                            fields=metric_fields,
                            selected_field=field,
                            selected_revision=revision,
+                           page=page,
+                           num_pages=status.num_pages,
                            **ts_data(ts))
 
 
@@ -1580,6 +1600,14 @@ def health():
     if mem > 1024**3:
         is_bad_state = True
         msg = "Over memory " + str(mem) + ">" + str(1024**3)
+
+    # Report the connection pool metrics of every database, one per line.
+    lines = [msg]
+    for name, db in sorted(current_app.instance.databases.items()):
+        status = db.pool_status()
+        lines.append("%s: %s" % (name, " ".join(
+            "%s=%s" % item for item in sorted(status.items()))))
+    msg = "\n".join(lines)
     if is_bad_state:
         return msg, 500
     return msg, 200
@@ -3,5 +3,7 @@
 
 from profilev1impl import ProfileV1
 from profilev2impl import ProfileV2
+from profilev3impl import ProfileV3
 from perf import LinuxPerfProfile
-IMPLEMENTATIONS = {0: LinuxPerfProfile, 1: ProfileV1, 2: ProfileV2}
+IMPLEMENTATIONS = {0: LinuxPerfProfile, 1: ProfileV1, 2: ProfileV2,
+                   3: ProfileV3}
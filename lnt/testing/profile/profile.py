@@ -1,3 +1,4 @@
+from array import array
 import base64
 import lnt.testing.profile
 import os
@@ -83,17 +84,34 @@ class Profile(object):
             open(filename, 'w').write(s)
             return filename
 
-    def save(self, filename=None, profileDir=None, prefix=''):
+    def save(self, filename=None, profileDir=None, prefix='',
+             pool_store=None, codec=None):
         """
         Save a profile. One of 'filename' or 'profileDir' must be given.
           - If 'filename' is given, that is where the profile is saved.
           - If 'profileDir' is given, a new unique filename is created
             inside 'profileDir', optionally with 'prefix'.
 
+        If 'pool_store' is given, the disassembly text is put in a text pool
+        shared through that TextPoolStore, which must be the store of the
+        directory the profile is saved in, with the profiles of the same
+        'prefix'. Only version 2 profiles and later support this.
+
+        If 'codec' is given, the profile is compressed with that codec
+        ('zlib', 'zstd' or 'lz4', see profilev3impl.py) instead of the one it
+        was read with, or zlib. Only version 3 profiles and later support
+        this.
+
         The filename written to is returned.
         """
+        kwargs = {}
+        if pool_store is not None:
+            kwargs = {'pool_store': pool_store, 'pool_key': prefix}
+        if codec is not None:
+            kwargs['codec'] = codec
+
         if filename:
-            self.impl.serialize(filename)
+            self.impl.serialize(filename, **kwargs)
             return filename
 
         assert profileDir is not None
@@ -103,7 +121,7 @@ class Profile(object):
                                          suffix='.lntprof',
                                          dir=profileDir,
                                          delete=False)
-        self.impl.serialize(tf.name)
+        self.impl.serialize(tf.name, **kwargs)
 
         # FIXME: make the returned filepath relative to baseDir?
         return os.path.relpath(tf.name, profileDir)
@@ -144,12 +162,30 @@ class Profile(object):
     def getDisassemblyFormat(self):
         return self.impl.getDisassemblyFormat()
 
+    def getTextPoolReference(self):
+        return self.impl.getTextPoolReference()
+
     def getFunctions(self):
         return self.impl.getFunctions()
 
     def getCodeForFunction(self, fname):
         return self.impl.getCodeForFunction(fname)
 
+    def getCodeColumnsForFunction(self, fname):
+        return self.impl.getCodeColumnsForFunction(fname)
+
+
+def codeFromColumns(counters, addresses, texts):
+    """
+    Return a generator of the (counters, address, text) tuples of the code
+    given column-wise, as returned by getCodeColumnsForFunction().
+    """
+    names = sorted(counters)
+    columns = [counters[k] for k in names]
+    for n in xrange(len(texts)):
+        yield (dict(zip(names, [c[n] for c in columns])), addresses[n],
+               texts[n])
+
 
 class ProfileImpl(object):
     @staticmethod
@@ -182,6 +218,10 @@ class ProfileImpl(object):
         """
         Serializes the profile to the given filename (base). If fname is None,
         returns as a bytes instance.
+
+        Implementations supporting shared text pools also take 'pool_store'
+        and 'pool_key' arguments, and those compressing their data a 'codec'
+        argument, see Profile.save().
         """
         raise NotImplementedError("Abstract class")
 
@@ -209,6 +249,13 @@ class ProfileImpl(object):
         """
         raise NotImplementedError("Abstract class")
 
+    def getTextPoolReference(self):
+        """
+        Return the path, relative to the profile's directory, of the shared
+        text pool the profile refers to, or None.
+        """
+        return None
+
     def getFunctions(self):
         """
         Return a dict containing function names to information about that
@@ -248,3 +295,29 @@ class ProfileImpl(object):
         absolute numbers.
         """
         raise NotImplementedError("Abstract class")
+
+    def getCodeColumnsForFunction(self, fname):
+        """
+        Return the same code as getCodeForFunction(), column-wise, as a
+        three-tuple::
+
+          (counters, addresses, texts)
+
+        Where counters is a dict of every counter of the function to an array
+        of its values, and addresses and texts are lists, all with one element
+        per instruction. Addresses may not fit in a C long, so they are not
+        kept in an array.
+
+        This is the cheaper way to read a whole function. The default
+        implementation collects the result of getCodeForFunction().
+        """
+        names = self.getFunctions()[fname]['counters'].keys()
+        counters = dict((k, array('f')) for k in names)
+        addresses = []
+        texts = []
+        for c, address, text in self.getCodeForFunction(fname):
+            for k in names:
+                counters[k].append(c.get(k, 0.0))
+            addresses.append(address)
+            texts.append(text)
+        return counters, addresses, texts
@@ -1,9 +1,12 @@
-from profile import ProfileImpl
+from array import array
+from profile import ProfileImpl, codeFromColumns
 import StringIO
 import bz2
 import copy
 import io
+import mmap
 import os
+import re
 import struct
 
 """
@@ -66,10 +69,11 @@ The sections are:
   The LineAddresses, LineCounters, LineText and TextPool sections are BZ2
   compressed.
 
-  The TextPool section has the ability to be shared across multiple profiles
-  to take advantage of inter-run redundancy (the image very rarely changes
-  substantially). This pooling ability is not yet implemented but the
-  appropriate scaffolding is in place.
+  The TextPool section can be shared across multiple profiles to take
+  advantage of inter-run redundancy (the image very rarely changes
+  substantially). A shared pool is stored in a separate file, managed by a
+  TextPoolStore (see textpool.py), and the section only holds its path,
+  relative to the profile's directory.
 
   The ProfileV2 format gives a ~3x size improvement over the ProfileV1 (which
   is also compressed) - meaning a ProfileV2 is roughly 1/3 the size of
@@ -77,6 +81,10 @@ The sections are:
 
   Not only this, but for the simple task of enumerating the functions in a
   profile we do not need to do any decompression at all.
+
+  Profiles are read lazily: the file is memory mapped, only the index and the
+  uncompressed sections are parsed up front, and the compressed sections are
+  decompressed on demand, as far as the requested function needs.
 """
 
 ##############################################################################
@@ -148,6 +156,153 @@ def writeFloat(fobj, f):
     bits = struct.unpack('>l', packed)[0]
     writeNum(fobj, bits)
 
+
+# Matches the bytes of one ULEB encoded number.
+ULEB_RE = re.compile(r'[\x80-\xff]*[\x00-\x7f]')
+
+
+def decodeNum(s):
+    """
+    Decode the bytes 's' of one ULEB encoded number.
+    """
+    n = 0
+    for c in reversed(s):
+        n = (n << 7) | (ord(c) & 0x7F)
+    return n
+
+
+def decodeNums(data, count):
+    """
+    Decode up to 'count' ULEB encoded numbers from the start of the string
+    'data'. Returns the numbers and the number of bytes they took up.
+
+    This is much faster than calling readNum() 'count' times: the numbers are
+    split up by a regular expression and the (very repetitive) encodings are
+    only decoded once.
+    """
+    encoded = ULEB_RE.findall(data)[:count]
+    cache = {}
+    nums = [cache[e] if e in cache else cache.setdefault(e, decodeNum(e))
+            for e in encoded]
+    return nums, len(''.join(encoded))
+
+
+def bitsToFloats(nums):
+    """
+    Convert the numbers 'nums', as read by readNum() from numbers written by
+    writeFloat(), into an array of floats.
+    """
+    n = len(nums)
+    return array('f', struct.unpack('>%df' % n,
+                                    struct.pack('>%dL' % n, *nums)))
+
+##############################################################################
+# Lazy decompression
+
+
+class LazyData(object):
+    """
+    The contents of a BZ2 compressed section of a memory mapped profile. They
+    are decompressed incrementally, only as far as they have been read.
+    """
+    # The number of compressed bytes to decompress at a time.
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, buf, offset, size):
+        self.buf = buf
+        self.pos = offset
+        self.end = offset + size
+        self.decompressor = bz2.BZ2Decompressor()
+        self.data = bytearray()
+
+    def fill(self, size=None):
+        """
+        Decompress until at least 'size' bytes are available, or everything
+        if 'size' is None. Returns False once everything is decompressed.
+        """
+        while self.pos < self.end and (size is None or
+                                       len(self.data) < size):
+            chunk = self.buf[self.pos:min(self.pos + self.CHUNK_SIZE,
+                                          self.end)]
+            self.pos += len(chunk)
+            self.data += self.decompressor.decompress(chunk)
+        return self.pos < self.end
+
+    def open(self, offset=0):
+        return LazyReader(self, offset)
+
+
+class LazyReader(object):
+    """
+    A file-like object reading the contents of a LazyData.
+    """
+    def __init__(self, lazy_data, offset=0):
+        self.lazy_data = lazy_data
+        self.offset = offset
+
+    def read(self, n=-1):
+        if n < 0:
+            self.lazy_data.fill()
+            end = len(self.lazy_data.data)
+        else:
+            end = self.offset + n
+            self.lazy_data.fill(end)
+        s = str(self.lazy_data.data[self.offset:end])
+        self.offset += len(s)
+        return s
+
+    def readline(self):
+        data = self.lazy_data.data
+        start = self.offset
+        end = data.find('\n', start)
+        while end == -1:
+            searched = len(data)
+            if not self.lazy_data.fill(searched + 1) and \
+                    len(data) == searched:
+                end = searched - 1
+                break
+            end = data.find('\n', max(start, searched))
+        self.offset = end + 1
+        return str(data[start:end + 1])
+
+    def readNums(self, count):
+        """
+        Read 'count' ULEB encoded numbers.
+        """
+        nums = []
+        while len(nums) < count:
+            # A 64-bit number takes up at most ten bytes.
+            end = self.offset + 10 * (count - len(nums))
+            self.lazy_data.fill(end)
+            new_nums, size = decodeNums(
+                str(self.lazy_data.data[self.offset:end]), count - len(nums))
+            if not new_nums:
+                raise ValueError("unexpected end of profile data")
+            nums += new_nums
+            self.offset += size
+        return nums
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.offset
+        elif whence == os.SEEK_END:
+            self.lazy_data.fill()
+            offset += len(self.lazy_data.data)
+        self.offset = offset
+
+    def tell(self):
+        return self.offset
+
+
+def openPool(path):
+    """
+    Open the shared text pool file 'path', returning a reader of its
+    contents.
+    """
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return LazyData(buf, 0, len(buf)).open()
+
 ##############################################################################
 # Abstract section types
 
@@ -180,9 +335,8 @@ class Section(object):
 
 class CompressedSection(Section):
     def read(self, fobj):
-        fobj.seek(self.offset + self.start)
-        _io = StringIO.StringIO(bz2.decompress(fobj.read(self.size)))
-        return self.deserialize(_io)
+        # The section is only decompressed when its data is read.
+        self.data = LazyData(fobj, self.offset + self.start, self.size)
 
     def write(self, fobj):
         _io = io.BytesIO()
@@ -198,6 +352,12 @@ class MaybePooledSection(Section):
     """
     def __init__(self):
         self.pool_fname = ''
+        # When writing, the TextPoolStore to put the section in and the key
+        # to store it under.
+        self.pool_store = None
+        self.pool_key = None
+        # When reading, the directory the pool file is relative to.
+        self.base_dir = ''
 
     def readHeader(self, fobj):
         Section.readHeader(self, fobj)
@@ -209,22 +369,35 @@ class MaybePooledSection(Section):
 
     def read(self, fobj):
         if self.pool_fname:
-            raise NotImplementedError()
+            # The pool file is only opened once the section is used.
+            self.deserialize(None)
 
         else:
-            _io = StringIO.StringIO(bz2.decompress(fobj.read(self.size)))
-            self.size = len(_io.getvalue())
-            return self.deserialize(_io)
+            self.deserialize(
+                LazyData(fobj, self.offset + self.start, self.size).open())
+
+    def readPool(self):
+        return openPool(os.path.join(self.base_dir, self.pool_fname))
 
     def write(self, fobj):
         _io = StringIO.StringIO()
-        if self.pool_fname:
-            raise NotImplementedError()
+        Section.write(self, _io)
+        if self.pool_store is not None:
+            self.pool_fname = self.pool_store.add(_io.getvalue(),
+                                                  self.pool_key,
+                                                  self.isReusable())
 
         else:
-            Section.write(self, _io)
+            self.pool_fname = ''
             fobj.write(bz2.compress(_io.getvalue()))
 
+    def isReusable(self):
+        """
+        Return True if later profiles should start from this section's
+        pool.
+        """
+        return True
+
 ##############################################################################
 # Concrete section types
 
@@ -318,9 +491,6 @@ class LineCounters(CompressedSection):
                 for k in sorted(all_counters):
                     writeFloat(fobj, counters.get(k, 0))
 
-    def deserialize(self, fobj):
-        self.data = fobj.read()
-
     def upgrade(self, impl):
         self.impl = impl
         self.function_offsets = {}
@@ -331,16 +501,16 @@ class LineCounters(CompressedSection):
     def setOffsetFor(self, fname, value):
         self.function_offsets[fname] = value
 
-    def extractForFunction(self, fname, counters):
+    def extractForFunction(self, fname, counters, length):
+        """
+        Return a dict of counter name to an array of that counter's values,
+        for the 'length' instructions of 'fname'.
+        """
         offset = self.function_offsets[fname]
-        _io = StringIO.StringIO(self.data)
-        _io.seek(offset)
-        counters.sort()
-        while True:
-            c = {}
-            for k in counters:
-                c[k] = readFloat(_io)
-            yield c
+        counters = sorted(counters)
+        n = len(counters)
+        values = bitsToFloats(self.data.open(offset).readNums(length * n))
+        return dict((k, values[i::n]) for i, k in enumerate(counters))
 
 
 class LineAddresses(CompressedSection):
@@ -368,9 +538,6 @@ class LineAddresses(CompressedSection):
                 writeNum(fobj, max(0, address - prev_address))
                 prev_address = address
 
-    def deserialize(self, fobj):
-        self.data = fobj.read()
-
     def upgrade(self, impl):
         self.impl = impl
         self.function_offsets = {}
@@ -381,15 +548,17 @@ class LineAddresses(CompressedSection):
     def setOffsetFor(self, fname, value):
         self.function_offsets[fname] = value
 
-    def extractForFunction(self, fname):
+    def extractForFunction(self, fname, length):
+        """
+        Return a list of the addresses of the 'length' instructions of
+        'fname'. Addresses may not fit in a C long (kernel addresses), so
+        this is not an array.
+        """
         offset = self.function_offsets[fname]
-        _io = StringIO.StringIO(self.data)
-        _io.seek(offset)
-        last_address = 0
-        while True:
-            address = readNum(_io) + last_address
-            last_address = address
-            yield address
+        addresses = self.data.open(offset).readNums(length)
+        for i in xrange(1, length):
+            addresses[i] += addresses[i - 1]
+        return addresses
 
 
 class LineText(CompressedSection):
@@ -418,10 +587,6 @@ class LineText(CompressedSection):
                 writeNum(fobj, self.text_pool.getOrCreate(text))
             writeNum(fobj, 0)  # Write sequence terminator
 
-    def deserialize(self, fobj):
-        # FIXME: Make this lazy.
-        self.data = fobj.read()
-
     def upgrade(self, impl):
         self.impl = impl
         self.function_offsets = {}
@@ -432,14 +597,15 @@ class LineText(CompressedSection):
     def setOffsetFor(self, fname, value):
         self.function_offsets[fname] = value
 
-    def extractForFunction(self, fname):
+    def extractForFunction(self, fname, length):
+        """
+        Return a list of the text of the 'length' instructions of 'fname'.
+        """
         offset = self.function_offsets[fname]
-
-        _io = StringIO.StringIO(self.data)
-        _io.seek(offset)
-        while True:
-            n = readNum(_io)
-            yield self.text_pool.getAt(n)
+        offsets = self.data.open(offset).readNums(length)
+        texts = dict((n, self.text_pool.getAt(n))
+                     for n in sorted(set(offsets)))
+        return [texts[n] for n in offsets]
 
     def copy(self, tp):
         new = copy.copy(self)
@@ -455,24 +621,41 @@ class TextPool(MaybePooledSection):
         # never a valid string pool index. LineText relies upon this to use
         # zero as a sentinel.
         self.data = StringIO.StringIO('\n')
-        self.pool_read = False
+        self.data.seek(0, os.SEEK_END)
+        # The total size of the strings handed out by getOrCreate.
+        self.used_size = 0
+        self.used = set()
 
     def serialize(self, fobj):
         self.data.seek(0)
         fobj.write(self.data.read())
 
     def deserialize(self, fobj):
-        # FIXME: Make this lazy!
-        self.data = StringIO.StringIO(fobj.read(self.size))
+        self.data = fobj
 
     def upgrade(self, impl):
         pass
 
-    def getOrCreate(self, text):
-        if self.pool_fname and not self.pool_read:
-            assert False
-            self.readFromPool()
+    def load(self, data):
+        """
+        Start from the contents 'data' of an existing pool, so that its
+        strings keep their offsets.
+        """
+        self.data = StringIO.StringIO(data)
+        self.data.seek(0, os.SEEK_END)
+        offset = 1
+        for text in data[1:].split('\n')[:-1]:
+            self.offsets.setdefault(text, offset)
+            offset += len(text) + 1
+
+    def isReusable(self):
+        # Once most of an inherited pool is unused, start a new one.
+        return 2 * self.used_size >= self.data.tell()
 
+    def getOrCreate(self, text):
+        if text not in self.used:
+            self.used.add(text)
+            self.used_size += len(text) + 1
         if text in self.offsets:
             return self.offsets[text]
         self.offsets[text] = self.data.tell()
@@ -480,11 +663,26 @@ class TextPool(MaybePooledSection):
         return self.offsets[text]
 
     def getAt(self, offset):
+        if self.data is None:
+            self.data = self.readPool()
         self.data.seek(offset, os.SEEK_SET)
         return readString(self.data)
 
-    def copy(self):
-        return copy.deepcopy(self)
+    def copy(self, pool_store=None, pool_key=None):
+        """
+        Return an empty pool to serialize the LineText section into, which
+        adds every string it refers to again. If 'pool_store' is given, the
+        pool is shared through it, starting from the latest pool of
+        'pool_key'.
+        """
+        new = TextPool()
+        new.pool_store = pool_store
+        new.pool_key = pool_key
+        if pool_store is not None and pool_key is not None:
+            data, _ = pool_store.getLatest(pool_key)
+            if data is not None:
+                new.load(data)
+        return new
 
 
 class Functions(Section):
@@ -534,14 +732,17 @@ class Functions(Section):
         self.impl = impl
         self.functions = self.impl.getFunctions()
 
-    def getCodeForFunction(self, fname):
+    def getCodeColumnsForFunction(self, fname):
         f = self.functions[fname]
-        counter_gen = self.line_counters \
-            .extractForFunction(fname, f['counters'].keys())
-        address_gen = self.line_addresses.extractForFunction(fname)
-        text_gen = self.line_text.extractForFunction(fname)
-        for n in xrange(f['length']):
-            yield (counter_gen.next(), address_gen.next(), text_gen.next())
+        counters = self.line_counters \
+            .extractForFunction(fname, f['counters'].keys(), f['length'])
+        addresses = self.line_addresses.extractForFunction(fname,
+                                                           f['length'])
+        texts = self.line_text.extractForFunction(fname, f['length'])
+        return counters, addresses, texts
+
+    def getCodeForFunction(self, fname):
+        return codeFromColumns(*self.getCodeColumnsForFunction(fname))
 
     def copy(self, counter_name_pool, line_counters,
              line_addresses, line_text):
@@ -554,14 +755,30 @@ class Functions(Section):
 
 
 class ProfileV2(ProfileImpl):
+    # The profile this one was upgraded from, if it was not read from a file.
+    source = None
+
     @staticmethod
     def checkFile(fn):
         # The first number is the version (2); ULEB encoded this is simply
         # 0x02.
-        return ord(open(fn).read(1)) == 2
+        return open(fn, 'rb').read(1) == '\x02'
 
     @staticmethod
     def deserialize(fobj):
+        # A shared text pool is found relative to the profile.
+        base_dir = os.path.dirname(getattr(fobj, 'name', ''))
+
+        # Map the file instead of reading it, only the parts of the file that
+        # are needed get paged in.
+        try:
+            fobj = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation):
+            data = fobj.read()
+            fobj = mmap.mmap(-1, len(data))
+            fobj.write(data)
+            fobj.seek(0)
+
         p = ProfileV2()
 
         p.h = Header()
@@ -570,6 +787,7 @@ class ProfileV2(ProfileImpl):
         p.lc = LineCounters(p)
         p.la = LineAddresses(p)
         p.tp = TextPool()
+        p.tp.base_dir = base_dir
         p.lt = LineText(p.tp, p)
         p.f = Functions(p.cnp, p.lc, p.la, p.lt, p)
 
@@ -587,7 +805,7 @@ class ProfileV2(ProfileImpl):
 
         return p
 
-    def serialize(self, fname=None):
+    def serialize(self, fname=None, pool_store=None, pool_key=None):
         # If we're not writing to a file, emulate a file object instead.
         if fname is None:
             fobj = StringIO.StringIO()
@@ -603,7 +821,7 @@ class ProfileV2(ProfileImpl):
         tlc = self.tlc.copy(cnp)
         lc = self.lc.copy()
         la = self.la.copy()
-        tp = self.tp.copy()
+        tp = self.tp.copy(pool_store, pool_key)
         lt = self.lt.copy(tp)
         f = self.f.copy(cnp, lc, la, lt)
         sections = [h, cnp, tlc, lc, la, lt, tp, f]
@@ -646,6 +864,7 @@ class ProfileV2(ProfileImpl):
 
         for section in p.sections:
             section.upgrade(v1impl)
+        p.source = v1impl
 
         return p
 
@@ -658,5 +877,20 @@ class ProfileV2(ProfileImpl):
     def getTopLevelCounters(self):
         return self.tlc.counters
 
+    def getDisassemblyFormat(self):
+        return self.h.disassembly_format
+
+    def getTextPoolReference(self):
+        return self.tp.pool_fname or None
+
     def getCodeForFunction(self, fname):
+        # The sections of an upgraded profile hold no data to read the code
+        # from until it is serialized.
+        if self.source is not None:
+            return self.source.getCodeForFunction(fname)
         return self.f.getCodeForFunction(fname)
+
+    def getCodeColumnsForFunction(self, fname):
+        if self.source is not None:
+            return self.source.getCodeColumnsForFunction(fname)
+        return self.f.getCodeColumnsForFunction(fname)
@@ -0,0 +1,376 @@
+from array import array
+from profile import ProfileImpl, codeFromColumns
+from profilev2impl import readNum, writeNum, readString, writeString
+from profilev2impl import decodeNums
+from profilev2impl import TextPool
+import StringIO
+import io
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+"""
+ProfileV3 is a profile data representation designed for fast access to a
+single function. The code of every function is compressed on its own, with a
+fast codec, and an index at the start of the file points at every function's
+block. Showing one function only decompresses that function.
+
+The format:
+  * Is a binary format consisting of an index and the function blocks.
+  * Uses strings (newline terminated), positive integers (ULEB encoded) and
+    big-endian IEEE floating point numbers.
+
+The index consists of:
+  Version
+      The number 3.
+
+  Codec
+      The name of the codec the blocks are compressed with: 'zlib', 'zstd'
+      or 'lz4'. zlib is used unless another codec is chosen when writing the
+      profile; zstd and lz4 are faster, but need their Python packages to
+      read the profile as well.
+
+  Disassembly format
+
+  Text pool
+      The path, relative to the profile, of the shared text pool holding the
+      text of the instructions (see textpool.py), or an empty string if the
+      text is stored in the blocks.
+
+  Counter names
+      A list of strings for the counter names ("cycles" etc). In the rest of
+      the file, counters are referred to by an index into this list.
+
+  Top level counters
+      Key/value pairs for the top level (per-file) counters; the values are
+      doubles.
+
+  Functions
+      For each function, its name, the number of instructions, its counters
+      (doubles) and the offset and size of its block. Offsets are counted
+      from the end of the index.
+
+Every block holds, for all the instructions of its function:
+  * The instruction counters, one float per counter of the function, in the
+    order of the counter names.
+  * The addresses, as ULEB encoded offsets from the previous address.
+  * The text of the instructions, as strings, or as ULEB encoded offsets
+    into the text pool if there is one.
+"""
+
+##############################################################################
+# Codecs
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _zlib_compress(data):
+    # Favour speed, the blocks are small and the data repetitive.
+    return zlib.compress(data, 6)
+
+
+# Maps codec names to (compress, decompress) functions, for the codecs that
+# are installed. In order of preference.
+CODECS = []
+if zstandard is not None:
+    CODECS.append(('zstd', (_zstd_compress, _zstd_decompress)))
+if lz4 is not None:
+    CODECS.append(('lz4', (lz4.frame.compress, lz4.frame.decompress)))
+CODECS.append(('zlib', (_zlib_compress, zlib.decompress)))
+
+# The codec profiles are written with unless another one is chosen. It is
+# always installed, so that any server can read the profiles.
+DEFAULT_CODEC = 'zlib'
+
+# The names of all codecs, whether installed or not.
+CODEC_NAMES = ('zlib', 'zstd', 'lz4')
+
+
+def getCodec(name):
+    """
+    Return the (compress, decompress) functions of the codec 'name'.
+    """
+    for codec_name, functions in CODECS:
+        if codec_name == name:
+            return functions
+    raise RuntimeError("Profile is compressed with '%s', which is not "
+                       "installed" % name)
+
+##############################################################################
+# Utility functions
+
+
+def writeDouble(fobj, f):
+    fobj.write(struct.pack('>d', f))
+
+
+def readDouble(fobj):
+    return struct.unpack('>d', fobj.read(8))[0]
+
+
+def encodeNum(n):
+    """
+    Return 'n' ULEB encoded, like writeNum.
+    """
+    if n < 0x80:
+        return chr(n)
+    b = []
+    while n >= 0x80:
+        b.append(chr((n & 0x7F) | 0x80))
+        n >>= 7
+    b.append(chr(n))
+    return ''.join(b)
+
+
+def encodeBlock(counter_names, code, text_pool=None):
+    """
+    Encode the (counters, address, text) tuples of a function's code into an
+    uncompressed block, adding the text to 'text_pool' if given.
+    """
+    code = list(code)
+    values = [counters.get(k, 0) for counters, _, _ in code
+              for k in counter_names]
+    parts = [struct.pack('>%df' % len(values), *values)]
+    prev_address = 0
+    for _, address, _ in code:
+        # Addresses going backwards are clamped, see LineAddresses in
+        # profilev2impl.
+        parts.append(encodeNum(max(0, address - prev_address)))
+        prev_address = address
+    for _, _, text in code:
+        if text_pool is not None:
+            parts.append(encodeNum(text_pool.getOrCreate(text)))
+        else:
+            parts.append(str(text) + '\n')
+    return ''.join(parts)
+
+
+def decodeBlock(counter_names, length, data, text_pool=None):
+    """
+    Decode the code of the 'length' instructions in the uncompressed block
+    'data', whose text is in 'text_pool' if given. Returns the columns
+    described by ProfileImpl.getCodeColumnsForFunction().
+    """
+    n_counters = len(counter_names)
+    values = array('f')
+    values.fromstring(data[:4 * length * n_counters])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    counters = dict((k, values[i::n_counters])
+                    for i, k in enumerate(counter_names))
+
+    pos = 4 * length * n_counters
+    # The addresses are delta encoded; they are kept in a list as they may
+    # not fit in a C long.
+    addresses, size = decodeNums(data[pos:pos + 10 * length], length)
+    pos += size
+    for i in xrange(1, length):
+        addresses[i] += addresses[i - 1]
+
+    if text_pool is not None:
+        offsets, _ = decodeNums(data[pos:], length)
+        texts = [text_pool.getAt(n) for n in offsets]
+    else:
+        texts = data[pos:].split('\n')[:length]
+    return counters, addresses, texts
+
+
+class ProfileV3(ProfileImpl):
+    def __init__(self):
+        self.codec = DEFAULT_CODEC
+        self.disassembly_format = 'raw'
+        self.counters = {}
+        self.functions = {}
+        # Maps function names to the (offset, size) of their blocks in
+        # self.data, for a profile read from a file.
+        self.blocks = {}
+        self.data = None
+        # The shared text pool of a profile read from a file, if any.
+        self.text_pool = None
+        # The profile this one was upgraded from, which holds the code.
+        self.source = None
+
+    @staticmethod
+    def checkFile(fn):
+        # The first number is the version (3); ULEB encoded this is simply
+        # 0x03.
+        return open(fn, 'rb').read(1) == '\x03'
+
+    @staticmethod
+    def deserialize(fobj):
+        # A shared text pool is found relative to the profile.
+        base_dir = os.path.dirname(getattr(fobj, 'name', ''))
+
+        # Map the file instead of reading it, only the index and the blocks
+        # that are read get paged in.
+        try:
+            fobj = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation):
+            data = fobj.read()
+            fobj = mmap.mmap(-1, len(data))
+            fobj.write(data)
+            fobj.seek(0)
+
+        p = ProfileV3()
+        version = readNum(fobj)
+        assert version == 3
+        p.codec = readString(fobj)
+        p.disassembly_format = readString(fobj)
+        pool_fname = readString(fobj)
+        if pool_fname:
+            # The pool file is only opened once the text is read.
+            p.text_pool = TextPool()
+            p.text_pool.pool_fname = pool_fname
+            p.text_pool.base_dir = base_dir
+            p.text_pool.data = None
+
+        names = [readString(fobj) for i in xrange(readNum(fobj))]
+        for i in xrange(readNum(fobj)):
+            k = names[readNum(fobj)]
+            p.counters[k] = readDouble(fobj)
+
+        for i in xrange(readNum(fobj)):
+            name = readString(fobj)
+            length = readNum(fobj)
+            counters = {}
+            for j in xrange(readNum(fobj)):
+                k = names[readNum(fobj)]
+                counters[k] = readDouble(fobj)
+            p.functions[name] = {'counters': counters, 'length': length}
+            p.blocks[name] = (readNum(fobj), readNum(fobj))
+
+        start = fobj.tell()
+        p.blocks = dict((name, (start + offset, size))
+                        for name, (offset, size) in p.blocks.items())
+        p.data = fobj
+        return p
+
+    def serialize(self, fname=None, pool_store=None, pool_key=None,
+                  codec=None):
+        if codec is None:
+            codec = self.codec
+        compress, _ = getCodec(codec)
+        text_pool = None
+        if pool_store is not None:
+            text_pool = TextPool().copy(pool_store, pool_key)
+
+        names = set(self.counters)
+        for f in self.functions.values():
+            names.update(f['counters'])
+        names = sorted(names)
+        name_to_idx = dict((k, i) for i, k in enumerate(names))
+
+        # Compress the blocks first, the index holds their offsets.
+        blocks = StringIO.StringIO()
+        offsets = {}
+        for fname_ in sorted(self.functions):
+            counter_names = sorted(self.functions[fname_]['counters'])
+            block = compress(encodeBlock(counter_names,
+                                         self.getCodeForFunction(fname_),
+                                         text_pool))
+            offsets[fname_] = (blocks.tell(), len(block))
+            blocks.write(block)
+
+        pool_fname = ''
+        if text_pool is not None:
+            _io = StringIO.StringIO()
+            text_pool.serialize(_io)
+            pool_fname = pool_store.add(_io.getvalue(), pool_key,
+                                        text_pool.isReusable())
+
+        fobj = StringIO.StringIO()
+        writeNum(fobj, 3)  # Version
+        writeString(fobj, codec)
+        writeString(fobj, self.disassembly_format)
+        writeString(fobj, pool_fname)
+
+        writeNum(fobj, len(names))
+        for k in names:
+            writeString(fobj, k)
+        writeNum(fobj, len(self.counters))
+        for k, v in sorted(self.counters.items()):
+            writeNum(fobj, name_to_idx[k])
+            writeDouble(fobj, v)
+
+        writeNum(fobj, len(self.functions))
+        for name in sorted(self.functions):
+            f = self.functions[name]
+            writeString(fobj, name)
+            writeNum(fobj, f['length'])
+            writeNum(fobj, len(f['counters']))
+            for k, v in sorted(f['counters'].items()):
+                writeNum(fobj, name_to_idx[k])
+                writeDouble(fobj, v)
+            writeNum(fobj, offsets[name][0])
+            writeNum(fobj, offsets[name][1])
+        fobj.write(blocks.getvalue())
+
+        if fname is None:
+            return fobj.getvalue()
+        with open(fname, 'wb') as f:
+            f.write(fobj.getvalue())
+
+    @staticmethod
+    def upgrade(v2impl):
+        assert v2impl.getVersion() == 2
+
+        p = ProfileV3()
+        p.disassembly_format = v2impl.getDisassemblyFormat()
+        p.counters = dict((k, float(v))
+                          for k, v in v2impl.getTopLevelCounters().items())
+        p.functions = dict((name, {'counters': dict(f['counters']),
+                                   'length': f['length']})
+                           for name, f in v2impl.getFunctions().items())
+        p.source = v2impl
+        return p
+
+    def getVersion(self):
+        return 3
+
+    def getTopLevelCounters(self):
+        return self.counters
+
+    def getDisassemblyFormat(self):
+        return self.disassembly_format
+
+    def getFunctions(self):
+        return self.functions
+
+    def getTextPoolReference(self):
+        if self.text_pool is None:
+            return None
+        return self.text_pool.pool_fname
+
+    def getCodeForFunction(self, fname):
+        if self.source is not None:
+            return self.source.getCodeForFunction(fname)
+        return codeFromColumns(*self.getCodeColumnsForFunction(fname))
+
+    def getCodeColumnsForFunction(self, fname):
+        if self.source is not None:
+            return self.source.getCodeColumnsForFunction(fname)
+
+        f = self.functions[fname]
+        offset, size = self.blocks[fname]
+        _, decompress = getCodec(self.codec)
+        data = decompress(self.data[offset:offset + size])
+        return decodeBlock(sorted(f['counters']), f['length'], data,
+                           self.text_pool)
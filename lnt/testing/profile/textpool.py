@@ -0,0 +1,143 @@
+"""
+A store of text pools shared between the profiles of a profile directory.
+
+Consecutive runs of a benchmark mostly profile the same code, so their
+disassembly text is nearly identical. Instead of each profile carrying its own
+copy of that text, profiles saved with a TextPoolStore refer to a pool file in
+the store and only hold offsets into it.
+
+Pools are content addressed: a pool is named after the hash of its contents,
+so identical pools are only stored once. The store also remembers the latest
+pool used for every key (the profile filename prefix, which names the test), so
+that the next profile of the same test can reuse that pool, appending the few
+strings that changed.
+
+LNT never deletes profile files itself, so pools are not reference counted:
+they are only deleted by `lnt profile gc`, which looks up the pools the
+profiles of the directory refer to and collects the others.
+"""
+
+import bz2
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# The directory, relative to the profile directory, holding the pools.
+POOL_DIR = '_textpools'
+
+POOL_SUFFIX = '.lnttp'
+
+
+class TextPoolStore(object):
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+        self.path = os.path.join(profile_dir, POOL_DIR)
+        self.index_path = os.path.join(self.path, 'index.json')
+
+    def _makedirs(self):
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the store lock and yield the index, which is written back when
+        the block exits normally.
+        """
+        self._makedirs()
+        with open(os.path.join(self.path, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = json.load(open(self.index_path))
+            except (IOError, ValueError):
+                index = {'added': {}, 'latest': {}}
+            yield index
+            self._writeAtomic(self.index_path, json.dumps(index))
+
+    def _writeAtomic(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    def _remove(self, index, ref):
+        index['added'].pop(ref, None)
+        for key, latest in index['latest'].items():
+            if latest == ref:
+                del index['latest'][key]
+        try:
+            os.remove(self.getPath(ref))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def getPath(self, ref):
+        """
+        Return the path of the pool that profiles refer to as 'ref'.
+        """
+        return os.path.join(self.profile_dir, ref)
+
+    def getLatest(self, key):
+        """
+        Return the contents of the latest pool stored for 'key' and its
+        reference, or (None, None).
+        """
+        with self._locked() as index:
+            ref = index['latest'].get(key)
+        if ref is None:
+            return None, None
+        try:
+            return bz2.decompress(open(self.getPath(ref), 'rb').read()), ref
+        except IOError:
+            return None, None
+
+    def add(self, data, key=None, reusable=True):
+        """
+        Store a pool with the contents 'data' for one more profile and return
+        the reference the profile should record.
+
+        If 'key' is given, the pool becomes the latest pool of 'key' when it is
+        'reusable', otherwise the next profile of 'key' starts a new pool.
+        """
+        ref = os.path.join(POOL_DIR, hashlib.sha1(data).hexdigest() +
+                           POOL_SUFFIX)
+        with self._locked() as index:
+            if not os.path.exists(self.getPath(ref)):
+                self._writeAtomic(self.getPath(ref), bz2.compress(data))
+            index['added'][ref] = time.time()
+            if key is not None:
+                if reusable:
+                    index['latest'][key] = ref
+                else:
+                    index['latest'].pop(key, None)
+        return ref
+
+    def collect(self, refs, since=None):
+        """
+        Delete the pools that none of 'refs', the pool references of all the
+        profiles of the directory, refers to, and return their references.
+
+        Pools added at or after the time 'since' are kept: the profiles
+        referring to them may not have been written yet when 'refs' was
+        gathered.
+        """
+        refs = set(refs)
+        removed = []
+        with self._locked() as index:
+            for name in sorted(os.listdir(self.path)):
+                ref = os.path.join(POOL_DIR, name)
+                if not name.endswith(POOL_SUFFIX) or ref in refs:
+                    continue
+                if since is not None and index['added'].get(ref, 0) >= since:
+                    continue
+                self._remove(index, ref)
+                removed.append(ref)
+        return removed
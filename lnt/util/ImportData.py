@@ -12,16 +12,18 @@ import tempfile
 import time
 
 from lnt.server.db import fieldchange
+from lnt.server.db import jobqueue
 
 
 def import_and_report(config, db_name, db, session, file, format, ts_name,
                       show_sample_count=False, disable_email=False,
                       disable_report=False, select_machine=None,
-                      merge_run=None):
+                      merge_run=None, defer_post_submit=False):
     """
     import_and_report(config, db_name, db, session, file, format, ts_name,
                       [show_sample_count], [disable_email],
-                      [disable_report], [select_machine], [merge_run])
+                      [disable_report], [select_machine], [merge_run],
+                      [defer_post_submit])
                      -> ... object ...
 
     Import a test data file into an LNT server and generate a test report. On
@@ -29,6 +31,10 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
 
     The result object is a dictionary containing information on the imported
     run and its comparison to the previous run.
+
+    With defer_post_submit, the report and the field change analysis are not
+    performed here; a post submission job is queued for them instead, and its
+    ID is returned as 'job_id' in the result object.
     """
     result = {
         'success': False,
@@ -59,7 +65,7 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
 
     startTime = time.time()
     try:
-        data = lnt.formats.read_any(file, format)
+        data = lnt.formats.read_any(file, format, stream=True)
     except Exception:
         import traceback
         result['error'] = "could not parse input format"
@@ -110,6 +116,10 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     except KeyboardInterrupt:
         raise
     except Exception as e:
+        # Drop whatever was added before the failure, such as the machine and
+        # the run of a report whose tests turn out to be malformed, so that
+        # it does not get committed along with a later import.
+        session.rollback()
         import traceback
         result['error'] = "import failure: %s" % e.message
         result['message'] = traceback.format_exc()
@@ -131,7 +141,7 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     else:
         report_url = "localhost"
 
-    if not disable_report:
+    if not disable_report and not defer_post_submit:
         #  This has the side effect of building the run report for
         #  this result.
         NTEmailReport.emailReport(result, session, run, report_url,
@@ -147,7 +157,12 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     result['run_id'] = run.id
     session.commit()
 
-    fieldchange.post_submit_tasks(session, ts, run.id)
+    if defer_post_submit:
+        job = jobqueue.enqueue(session, ts, run.id, disable_email,
+                               disable_report)
+        result['job_id'] = job.id
+    else:
+        fieldchange.post_submit_tasks(session, ts, run.id)
 
     # Add a handy relative link to the submitted run.
     result['result_url'] = "db_{}/v4/{}/{}".format(db_name, ts_name, run.id)
@@ -182,6 +197,24 @@ def import_and_report(config, db_name, db, session, file, format, ts_name,
     return result
 
 
+def perform_post_submit_job(config, db_name, db, session, job):
+    """Perform the work import_and_report() deferred to the post submission
+    job `job`: the field change analysis and the email report of its run,
+    unless the submission disabled it."""
+    ts = db.testsuite[job.testsuite_name]
+    fieldchange.post_submit_tasks(session, ts, job.run_id)
+
+    if job.disable_report or job.disable_email:
+        return
+    email_config = config.databases[db_name].email_config
+    if email_config.enabled:
+        run = ts.getRun(session, job.run_id)
+        to_address = email_config.get_to_address(run.machine.name)
+        report_url = "%s/db_%s/" % (config.zorgURL, db_name)
+        NTEmailReport.emailReport({}, session, run, report_url, email_config,
+                                  to_address, True)
+
+
 def no_submit():
     """Do not submit but create dummy submission report."""
     return {
@@ -320,7 +353,8 @@ def print_report_result(result, out, err, verbose=True):
 
 
 def import_from_string(config, db_name, db, session, ts_name, data,
-                       select_machine=None, merge_run=None):
+                       select_machine=None, merge_run=None,
+                       defer_post_submit=False):
     # Stash a copy of the raw submission.
     #
     # To keep the temporary directory organized, we keep files in
@@ -349,5 +383,6 @@ def import_from_string(config, db_name, db, session, ts_name, data,
 
     result = lnt.util.ImportData.import_and_report(
         config, db_name, db, session, path, '<auto>', ts_name,
-        select_machine=select_machine, merge_run=merge_run)
+        select_machine=select_machine, merge_run=merge_run,
+        defer_post_submit=defer_post_submit)
     return result
@@ -1,4 +1,5 @@
 from __future__ import division
+import bisect
 import math
 from lnt.external.stats.stats import mannwhitneyu as mannwhitneyu_large
 
@@ -73,6 +74,64 @@ def standard_deviation(values):
     return rms
 
 
+def _centered_windows(num_values, window_size):
+    """Yield for every index i the (added, removed) indices that turn the
+    window of i-1 into values[i - window_size:i + window_size], clipped to
+    the bounds of the values."""
+    hi = lo = 0
+    for i in range(num_values):
+        new_hi = min(num_values, i + window_size)
+        new_lo = max(0, i - window_size)
+        yield range(hi, new_hi), range(lo, new_lo)
+        hi, lo = new_hi, new_lo
+
+
+def moving_average(values, window_size):
+    """Compute the mean of values[i - window_size:i + window_size] for every
+    index i, keeping a running sum instead of summing every window."""
+    result = []
+    total = 0.
+    count = 0
+    for added, removed in _centered_windows(len(values), window_size):
+        for j in added:
+            total += values[j]
+        for j in removed:
+            total -= values[j]
+        count += len(added) - len(removed)
+        result.append(total / count if count else None)
+    return result
+
+
+def moving_median(values, window_size):
+    """Compute the median of values[i - window_size:i + window_size] for every
+    index i. The window is kept sorted while it slides, so every step is a
+    binary search instead of sorting the whole window."""
+    result = []
+    window = []
+    for added, removed in _centered_windows(len(values), window_size):
+        for j in added:
+            bisect.insort(window, values[j])
+        for j in removed:
+            del window[bisect.bisect_left(window, values[j])]
+        N = len(window)
+        result.append((window[(N-1)//2] + window[N//2])*.5 if N else None)
+    return result
+
+
+def exponential_moving_average(values, alpha):
+    """Compute the exponentially weighted moving average of the values; the
+    weight of a new value is `alpha`, between 0 and 1."""
+    result = []
+    average = None
+    for value in values:
+        if average is None:
+            average = float(value)
+        else:
+            average += alpha * (value - average)
+        result.append(average)
+    return result
+
+
 def mannwhitneyu(a, b, sigLevel=.05):
     """
     Determine if sample a and b are the same at given significance level.
@@ -0,0 +1,33 @@
+# RUN: rm -rf %t.install
+# RUN: lnt create %t.install
+# RUN: lnt import %t.install %{shared_inputs}/sample-a-small.plist
+# RUN: lnt import %t.install %{shared_inputs}/sample-b-small.plist
+
+# Export everything.
+# RUN: lnt export %t.install -o %t.all
+# RUN: FileCheck --check-prefix CHECK-ALL %s < %t.all
+# CHECK-ALL: {"columns": ["run_id", "machine", "order", "test",
+# CHECK-ALL-SAME: "execution_time"
+# CHECK-ALL-SAME: "format": "lnt-columnar-v1"}
+# CHECK-ALL-NEXT: {"data": {{\[\[}}1, 1, 2],
+# CHECK-ALL-SAME: ["1", "1", "2"]
+# CHECK-ALL-SAME: "rows": 3}
+
+# Filter by order range and field, in chunks of one sample.
+# RUN: lnt export %t.install --min-order 2 --field compile_time \
+# RUN:     --chunk-size 1 > %t.range
+# RUN: FileCheck --check-prefix CHECK-RANGE %s < %t.range
+# CHECK-RANGE: {"columns": ["run_id", "machine", "order", "test", "compile_time"]
+# CHECK-RANGE-NEXT: {"data": {{\[\[}}2], ["LNT SAMPLE MACHINE"], ["2"], ["sampletest"], [0.022]], "rows": 1}
+# CHECK-RANGE-NOT: rows
+
+# RUN: python %s %t.all
+
+import sys
+
+from lnt.server.db.export import read_columnar
+
+chunks = list(read_columnar(open(sys.argv[1])))
+assert len(chunks) == 1
+assert chunks[0]['execution_time'] == [0.3, 0.29, 0.32]
+assert chunks[0]['order'] == ['1', '1', '2']
@@ -14,3 +14,11 @@
 # RUN: rm -rf %t/non_existing_output.lnt
 # RUN: lnt profile upgrade %S/Inputs/test.lntprof %t/non_existing_output.lnt
 # RUN: cat %t/non_existing_output.lnt
+# RUN: lnt profile getVersion %t/non_existing_output.lnt | FileCheck --check-prefix=CHECK-UPGRADED %s
+# CHECK-UPGRADED: 3
+# RUN: lnt profile getCodeForFunction %t/non_existing_output.lnt fn1 | FileCheck --check-prefix=CHECK-GETFN1-UPGRADED %s
+# CHECK-GETFN1-UPGRADED: [{"cycles": 0.0, "branch-misses": 0.0}, 1048576, "add r0, r0, r0"], [{"cycles": 100.0, "branch-misses": 0.0}, 1048580, "sub r1, r0, r0"]]
+
+# RUN: lnt profile upgrade --codec zlib %S/Inputs/test.lntprof %t/zlib_output.lnt
+# RUN: lnt profile getCodeForFunction %t/zlib_output.lnt fn1 | FileCheck --check-prefix=CHECK-GETFN1-UPGRADED %s
+# RUN: not lnt profile upgrade --codec snappy %S/Inputs/test.lntprof %t/snappy_output.lnt
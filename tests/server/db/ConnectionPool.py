@@ -0,0 +1,55 @@
+# Check the connection pool settings and metrics of the databases.
+# RUN: python %s
+
+import sqlite3
+import unittest
+
+import sqlalchemy.exc
+
+import lnt.server.config
+from lnt.server.db.v4db import MeteredQueuePool, V4DB
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_metered_pool(self):
+        pool = MeteredQueuePool(
+            lambda: sqlite3.connect(':memory:', check_same_thread=False),
+            pool_size=1, max_overflow=0, timeout=0.01)
+        conn = pool.connect()
+        self.assertEqual(pool.checkedout(), 1)
+        self.assertEqual(pool.waits, 0)
+
+        # The pool is exhausted, the second checkout waits and times out.
+        self.assertRaises(sqlalchemy.exc.TimeoutError, pool.connect)
+        self.assertEqual(pool.waits, 1)
+        self.assertGreater(pool.wait_time, 0)
+
+        conn.close()
+        conn = pool.connect()
+        self.assertEqual(pool.waits, 1)
+        conn.close()
+
+        pool = pool.recreate()
+        self.assertEqual(pool.waits, 1)
+
+    def test_pool_status(self):
+        config = lnt.server.config.Config.dummy_instance()
+        db = V4DB('sqlite:///:memory:', config)
+        session = db.make_session()
+        session.execute('SELECT 1')
+        session.close()
+        status = db.pool_status()
+        self.assertGreater(status['checkouts'], 0)
+        self.assertGreater(status['connects'], 0)
+        self.assertNotIn('waits', status)
+
+    def test_pool_options(self):
+        config = lnt.server.config.Config.dummy_instance()
+        self.assertEqual(config.db_pool, {})
+        self.assertRaises(ValueError, lnt.server.config.Config,
+                          'LNT', 'http://localhost', '.', '', '', None, {},
+                          None, '', db_pool={'size': 1})
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[__file__])
@@ -0,0 +1,52 @@
+# Check that a report which fails to import leaves nothing behind, even when
+# its tests are only found to be malformed after the run has been added.
+# RUN: python %s
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'Inputs'))
+import filled_instance
+
+
+class ImportFailureTest(filled_instance.FilledInstanceTest):
+    def _import(self, machine, tests):
+        report = json.dumps({
+            'format_version': '2',
+            'machine': {'name': machine},
+            'run': {'start_time': '2017-01-01 00:00:00',
+                    'end_time': '2017-01-01 00:01:00',
+                    'llvm_project_revision': '1234'},
+            'tests': '@@TESTS@@',
+        }).replace('"@@TESTS@@"', tests)
+        return self.import_report(report)
+
+    def machine_names(self):
+        return set(name for name, in self.session.query(self.ts.Machine.name))
+
+    def test_malformed_tests(self):
+        num_runs = self.ts.getNumRuns(self.session)
+
+        # The list of tests is only decoded while the run is imported.
+        result = self._import('bad-machine',
+                              '[{"name": "foo", "compile_time": 1.0}, {x}]')
+        self.assertFalse(result.get('success', False))
+        self.assertIn('import failure', result['error'])
+
+        result = self._import('good-machine',
+                              '[{"name": "foo", "compile_time": 1.0}]')
+        self.assertTrue(result.get('success', False), result)
+        self.assertEqual(result['added_machines'], 1)
+        self.assertEqual(result['added_runs'], 1)
+
+        self.session.close()
+        self.session = self.db.make_session()
+        self.assertIn('good-machine', self.machine_names())
+        self.assertNotIn('bad-machine', self.machine_names())
+        self.assertEqual(self.ts.getNumRuns(self.session), num_runs + 1)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -11,7 +11,25 @@
 # RUN: python %s %t.install
 
 import os, sys, glob
-from lnt.testing.profile.profilev1impl import ProfileV1
+from lnt.testing.profile.profile import Profile
+from lnt.testing.profile.profilev3impl import ProfileV3
 
 profile = glob.glob('%s/data/profiles/*.lntprof' % sys.argv[1])[0]
-assert ProfileV1.checkFile(profile)
+assert ProfileV3.checkFile(profile)
+
+# The profile is upgraded and its text stored in a shared pool.
+p = Profile.fromFile(profile)
+ref = p.getTextPoolReference()
+assert ref.startswith('_textpools/')
+assert os.path.exists('%s/data/profiles/%s' % (sys.argv[1], ref))
+for fn in p.getFunctions():
+    assert len(list(p.getCodeForFunction(fn))) == p.getFunctions()[fn]['length']
+
+# Pools are only deleted once no profile refers to them.
+# RUN: lnt profile gc %t.install/data/profiles > %t.gc1
+# RUN: FileCheck --check-prefix=CHECK-GC1 --allow-empty %s < %t.gc1
+# CHECK-GC1-NOT: deleted
+# RUN: rm %t.install/data/profiles/*.lntprof
+# RUN: touch %t.install/data/profiles/t-saving.lntprof
+# RUN: lnt profile gc %t.install/data/profiles | FileCheck --check-prefix=CHECK-GC2 %s
+# CHECK-GC2: deleted _textpools/{{[0-9a-f]+}}.lnttp
@@ -115,6 +115,13 @@ assert order_a.llvm_project_revision == '1'
 assert order_b.previous_order_id is order_a.id
 assert order_b.next_order_id is None
 assert order_b.llvm_project_revision == '2'
+assert order_a.sort_key == order_a.compute_sort_key()
+assert order_a.sort_key < order_b.sort_key
+try:
+    ts.Order(llvm_project_revision='1' * 100).compute_sort_key()
+    assert False, "revision too long for its sort key"
+except ValueError:
+    pass
 
 # Validate the runs.
 runs = list(session.query(ts.Run).order_by(ts.Run.order_id))
@@ -124,6 +131,12 @@ assert run_a.machine is machine
 assert run_b.machine is machine
 assert run_a.order is order_a
 assert run_b.order is order_b
+assert run_a.order_sort_key == order_a.sort_key
+assert run_b.order_sort_key == order_b.sort_key
+assert ts.get_previous_runs_on_machine(session, run_b, 1) == [run_a]
+assert ts.get_next_runs_on_machine(session, run_a, 2) == [run_b]
+assert ts.get_next_runs_on_machine(session, run_a, 1) == []
+assert ts.get_next_runs_on_machine(session, run_b, 1) == []
 assert run_a.imported_from.endswith("sample-a-small.plist")
 assert run_b.imported_from.endswith("sample-b-small.plist")
 assert run_a.start_time == datetime.datetime(2009, 11, 17, 2, 12, 25)
@@ -158,3 +171,18 @@ assert sample_b.compile_time == 0.022
 assert sample_b.compile_status == lnt.testing.PASS
 assert sample_b.execution_time == 0.32
 assert sample_b.execution_status == lnt.testing.PASS
+
+# Validate the per order geometric means.
+geomeans = dict(((g.order_id, g.field.name), g.value)
+                for g in session.query(ts.OrderGeomean))
+assert abs(geomeans[(order_a.id, 'execution_time')] - 0.29) < 1e-9
+assert abs(geomeans[(order_b.id, 'execution_time')] - 0.32) < 1e-9
+assert abs(geomeans[(order_a.id, 'compile_time')] - 0.0189) < 1e-9
+
+# Deleting a run drops its geometric means.
+session.delete(run_b)
+session.commit()
+assert session.query(ts.OrderGeomean) \
+    .filter(ts.OrderGeomean.order_id == order_b.id).count() == 0
+assert session.query(ts.OrderGeomean) \
+    .filter(ts.OrderGeomean.order_id == order_a.id).count() > 0
@@ -0,0 +1,62 @@
+"""
+A copy of the filled LNT v0.4.0 instance to import runs into, for the tests
+of the database and the reports. The runs are imported from report.json.in,
+like search.py does, with their machine and order filled in; the tests
+change the rest of the report as they need.
+
+The tests add this directory to sys.path to import the module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lnt.server.instance
+import lnt.util.ImportData
+
+inputs = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_report(machine, order):
+    """Return report.json.in for a run of `machine` at `order`."""
+    with open(os.path.join(inputs, 'report.json.in')) as f:
+        return f.read() \
+            .replace('@@MACHINE@@', machine) \
+            .replace('@@ORDER@@', order)
+
+
+class FilledInstanceTest(unittest.TestCase):
+    """Test case working on a copy of the filled instance, with a session of
+    its default database and the nts test suite."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'lnt')
+        shutil.copytree(os.path.join(inputs, 'lnt_v0.4.0_filled_instance'),
+                        path)
+        self.instance = lnt.server.instance.Instance.frompath(path)
+        self.db = self.instance.get_database('default')
+        self.session = self.db.make_session()
+        self.ts = self.db.testsuite.get('nts')
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmpdir)
+
+    def import_report(self, data, db=None, session=None, **kwargs):
+        """Import the report `data` into the nts test suite of the default
+        database, or of `db` through `session`, and return the result of
+        import_and_report. The keyword arguments override its options, which
+        disable the email and report of the run by default."""
+        path = os.path.join(self.tmpdir, 'report.json')
+        with open(path, 'w') as f:
+            f.write(data)
+        options = dict(config=None, format='<auto>', ts_name='nts',
+                       show_sample_count=False, disable_email=True,
+                       disable_report=True, select_machine='match',
+                       merge_run='reject')
+        options.update(kwargs)
+        return lnt.util.ImportData.import_and_report(
+            options.pop('config'), 'default', db or self.db,
+            session or self.session, path, **options)
@@ -0,0 +1,107 @@
+# Check that post submission work can be deferred to the job queue.
+# RUN: python %s
+
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'Inputs'))
+import filled_instance
+import lnt.util.ImportData
+from lnt.server.db import jobqueue
+from lnt.util import NTEmailReport
+
+
+class PostSubmitJobsTest(filled_instance.FilledInstanceTest):
+    def _submit(self, order, disable_email=True):
+        result = self.import_report(
+            filled_instance.read_report('machine1', order),
+            config=self.instance.config, disable_email=disable_email,
+            disable_report=False, defer_post_submit=True)
+        self.assertTrue(result.get('success', False))
+        return result
+
+    def test_deferred_submission(self):
+        result = self._submit('1234')
+        job = jobqueue.get_job(self.session, result['job_id'])
+        self.assertEqual(job.state, jobqueue.JobState.QUEUED)
+        self.assertEqual(job.testsuite_name, 'nts')
+        self.assertEqual(job.run_id, result['run_id'])
+
+        pool = jobqueue.WorkerPool(
+            self.instance, 1, lnt.util.ImportData.perform_post_submit_job)
+        self.assertTrue(pool.run_pending_job())
+        self.assertFalse(pool.run_pending_job())
+
+        self.session.expire_all()
+        job = jobqueue.get_job(self.session, result['job_id'])
+        self.assertEqual(job.state, jobqueue.JobState.DONE, job.message)
+        self.assertIsNotNone(job.started_time)
+        self.assertIsNotNone(job.finished_time)
+
+    def test_failed_job(self):
+        result = self._submit('1235')
+
+        def perform(config, db_name, db, session, job):
+            raise ValueError("broken")
+        pool = jobqueue.WorkerPool(self.instance, 1, perform)
+        self.assertTrue(pool.run_pending_job())
+
+        self.session.expire_all()
+        job = jobqueue.get_job(self.session, result['job_id'])
+        self.assertEqual(job.state, jobqueue.JobState.FAILED)
+        self.assertIn("broken", job.message)
+
+    def test_stale_job(self):
+        result = self._submit('1236')
+
+        # A job whose worker died while performing it.
+        job = jobqueue.get_job(self.session, result['job_id'])
+        job.state = jobqueue.JobState.RUNNING
+        job.started_time = datetime.datetime.utcnow()
+        self.session.commit()
+
+        # It is left alone while it could still be running...
+        pool = jobqueue.WorkerPool(
+            self.instance, 1, lnt.util.ImportData.perform_post_submit_job)
+        self.assertFalse(pool.run_pending_job())
+
+        # ...and performed again once it is stale.
+        job.started_time -= jobqueue.STALE_JOB_TIMEOUT * 2
+        self.session.commit()
+        self.assertTrue(pool.run_pending_job())
+        self.assertFalse(pool.run_pending_job())
+
+        self.session.expire_all()
+        job = jobqueue.get_job(self.session, result['job_id'])
+        self.assertEqual(job.state, jobqueue.JobState.DONE, job.message)
+
+    def test_disabled_email(self):
+        email_config = self.instance.config.databases['default'].email_config
+        email_config.enabled = True
+        email_config.to_address = 'nobody@example.com'
+        emailed = []
+        email_report = NTEmailReport.emailReport
+        NTEmailReport.emailReport = \
+            lambda result, session, run, *args: emailed.append(run.id)
+        try:
+            disabled = self._submit('1237')
+            enabled = self._submit('1238', disable_email=False)
+            pool = jobqueue.WorkerPool(
+                self.instance, 1, lnt.util.ImportData.perform_post_submit_job)
+            self.assertTrue(pool.run_pending_job())
+            self.assertTrue(pool.run_pending_job())
+        finally:
+            NTEmailReport.emailReport = email_report
+
+        # Only the job of the submission which did not disable the email
+        # sends it.
+        self.assertEqual(emailed, [enabled['run_id']])
+        job = jobqueue.get_job(self.session, disabled['job_id'])
+        self.assertTrue(job.disable_email)
+        self.assertFalse(job.disable_report)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
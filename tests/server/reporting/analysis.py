@@ -319,6 +319,21 @@ class ComparisonResultTest(unittest.TestCase):
                 None, None)
             self.assertEquals(zeroSample.get_value_status(), UNCHANGED_PASS)
 
+    def test_distribution(self):
+        """Test the sample distribution estimates."""
+        cr = ComparisonResult(min, False, False, [1., 2., 3., 6.], [1.],
+                              None, None)
+        self.assertAlmostEqual(cr.stddev, 1.8708287)
+        self.assertEquals(cr.MAD, 1.0)
+        self.assertEquals(cr.stddev_mean, 3.0)
+        self.assertEquals(cr.__json__()['MAD'], 1.0)
+
+        single = ComparisonResult(min, False, False, [1.], [1.], None, None)
+        self.assertIsNone(single.stddev)
+        self.assertIsNone(single.MAD)
+        ints = ComparisonResult(min, False, False, [1, 2], [1], None, None)
+        self.assertIsNone(ints.stddev)
+
 
 class AbsMinTester(unittest.TestCase):
 
@@ -0,0 +1,125 @@
+# Check that daily reports are stored once the day is over, and computed again
+# when late runs arrive.
+#
+# RUN: python %s
+
+import datetime
+import unittest, sys, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../db/Inputs'))
+import filled_instance
+from lnt.server.reporting.dailyreport import DailyReport
+
+
+class DailyReportSnapshotTest(filled_instance.FilledInstanceTest):
+    def setUp(self):
+        super(DailyReportSnapshotTest, self).setUp()
+        self.submit('100', '2016-03-13 14:20:28', 1.4)
+        self.submit('200', '2016-03-14 14:20:28', 1.4)
+
+    def submit(self, order, start_time, exec_time, merge_run='reject'):
+        data = filled_instance.read_report('machine1', order) \
+            .replace('2016-03-14 14:20:28', start_time) \
+            .replace('1.4', str(exec_time))
+        result = self.import_report(data, merge_run=merge_run)
+        self.assertTrue(result.get('success', False))
+
+    def report(self, year=2016, month=3, day=14, **kwargs):
+        report = DailyReport(self.ts, year, month, day, **kwargs)
+        report.build(self.session)
+        return report
+
+    def snapshots(self):
+        return self.session.query(self.ts.DailyReportSnapshot.id).all()
+
+    def exec_results(self, report):
+        for field, field_results in report.result_table:
+            if field.name == 'execution_time':
+                return [(test.name, [machine.name for machine, _ in results])
+                        for test, results in field_results]
+
+    def test_snapshots(self):
+        report = self.report()
+        self.assertIsNone(report.error)
+        self.assertEqual([m.name for m in report.reporting_machines],
+                         ['machine1'])
+        self.assertEqual(self.exec_results(report), [])
+        self.assertEqual(report.nr_tests_table[0][1], [1, 1, 0])
+        machine = report.reporting_machines[0]
+        self.assertEqual(
+            report.get_key_run(machine, 0).order.llvm_project_revision, '200')
+        self.assertIsNone(report.get_key_run(machine, 2))
+        snapshots = self.snapshots()
+        self.assertEqual(len(snapshots), 1)
+
+        # The report is read from the snapshot.
+        report = self.report()
+        self.assertEqual(self.exec_results(report), [])
+        self.assertEqual(self.snapshots(), snapshots)
+
+        # Other ranges have their own snapshots.
+        self.report(num_prior_days_to_include=2)
+        self.assertEqual(len(self.snapshots()), 2)
+
+        # A late run of the day discards its snapshots.
+        self.submit('300', '2016-03-14 14:30:00', 3.0)
+        self.assertEqual(self.snapshots(), [])
+        report = self.report()
+        self.assertEqual(self.exec_results(report), [('foo', ['machine1'])])
+        self.assertEqual(
+            report.get_key_run(machine, 0).order.llvm_project_revision, '300')
+        self.assertEqual(len(self.snapshots()), 1)
+
+        # A run of a later day does not.
+        self.submit('400', '2016-03-15 14:30:00', 3.0)
+        self.assertEqual(len(self.snapshots()), 1)
+
+        # Neither does the report of a day which is not over yet, nor a report
+        # without runs.
+        today = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        self.submit('500', str(today.replace(microsecond=0)), 1.4)
+        report = self.report(today.year, today.month, today.day,
+                             day_start_offset_hours=23)
+        self.assertIsNone(report.error)
+        report = self.report(2015, 3, 14)
+        self.assertIsNotNone(report.error)
+        self.assertEqual(len(self.snapshots()), 1)
+
+        # Replacing or deleting a run discards the snapshots of its day.
+        self.submit('300', '2016-03-14 14:40:00', 1.4, merge_run='replace')
+        self.assertEqual(self.snapshots(), [])
+        self.assertEqual(self.exec_results(self.report()), [])
+        self.session.delete(self.session.query(self.ts.Run)
+                            .join(self.ts.Order)
+                            .filter(self.ts.Order.llvm_project_revision ==
+                                    '100').one())
+        self.session.commit()
+        self.assertEqual(self.snapshots(), [])
+
+    def test_import_during_report(self):
+        self.report()
+
+        # A report stores the snapshot of a late run imported while it was
+        # computed, before the import could discard it; the snapshot is out of
+        # date.
+        discard = self.ts.discard_daily_report_snapshots
+        self.ts.discard_daily_report_snapshots = lambda *args: None
+        try:
+            self.submit('300', '2016-03-14 14:30:00', 3.0)
+        finally:
+            self.ts.discard_daily_report_snapshots = discard
+        self.assertEqual(len(self.snapshots()), 1)
+        report = self.report()
+        self.assertEqual(self.exec_results(report), [('foo', ['machine1'])])
+        self.assertEqual(len(self.snapshots()), 1)
+
+    def test_filter(self):
+        self.submit('250', '2016-03-14 15:20:28', 3.0)
+        report = self.report(filter_machine_regex='machine2')
+        self.assertIsNotNone(report.error)
+        report = self.report(filter_machine_regex='machine1')
+        self.assertEqual(self.exec_results(report), [('foo', ['machine1'])])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
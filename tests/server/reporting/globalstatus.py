@@ -0,0 +1,114 @@
+# Check that the changes between runs and their baselines are stored when runs
+# are submitted, and read back sorted and paginated by the global status page.
+#
+# RUN: python %s
+
+import json
+import unittest, sys, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../db/Inputs'))
+import filled_instance
+from lnt.server.reporting import globalstatus
+from lnt.server.reporting.globalstatus import GlobalStatus
+
+
+class GlobalStatusTest(filled_instance.FilledInstanceTest):
+    def setUp(self):
+        super(GlobalStatusTest, self).setUp()
+        self.field, = [f for f in self.ts.Sample.get_metric_fields()
+                       if f.name == 'compile_time']
+        self.submit('machine1', '100', {'foo': 2.0, 'bar': 1.0})
+        self.submit('machine1', '200', {'foo': 3.0, 'bar': 1.5})
+        self.submit('machine2', '100', {'foo': 4.0, 'bar': 1.0})
+        self.submit('machine2', '200', {'foo': 2.0, 'bar': 2.0})
+
+    def tearDown(self):
+        globalstatus.PAGE_SIZE = 100
+        super(GlobalStatusTest, self).tearDown()
+
+    def submit(self, machine, order, compile_times, merge_run='reject'):
+        data = json.loads(filled_instance.read_report(machine, order))
+        data['Tests'] = [{'Data': [value], 'Info': {},
+                          'Name': 'nts.%s.compile' % name}
+                         for name, value in sorted(compile_times.items())]
+        result = self.import_report(json.dumps(data), merge_run=merge_run)
+        self.assertTrue(result.get('success', False))
+
+    def run_at(self, machine, order):
+        return self.session.query(self.ts.Run) \
+            .join(self.ts.Machine).join(self.ts.Order) \
+            .filter(self.ts.Machine.name == machine) \
+            .filter(self.ts.Order.llvm_project_revision == order).one()
+
+    def status(self, page=1):
+        machine_runs = dict((run.machine, run) for run in
+                            [self.run_at('machine1', '200'),
+                             self.run_at('machine2', '200')])
+        status = GlobalStatus(self.ts, machine_runs, 0, self.field, page)
+        status.build(self.session)
+        return status
+
+    def deltas(self):
+        return sorted(self.session.query(self.ts.BaselineDelta.run_id,
+                                         self.ts.BaselineDelta.baseline_run_id)
+                      .distinct())
+
+    def test_global_status(self):
+        # Only the latest runs of the machines have their deltas stored.
+        run1 = self.run_at('machine1', '200')
+        run2 = self.run_at('machine2', '200')
+        base1 = self.run_at('machine1', '100')
+        base2 = self.run_at('machine2', '100')
+        self.assertEqual(self.deltas(), sorted([(run1.id, base1.id),
+                                                (run2.id, base2.id)]))
+        self.assertEqual(self.ts.get_closest_previously_reported_runs(
+            self.session, [run1.machine_id, run2.machine_id],
+            globalstatus.get_baseline_order(self.ts, 150)),
+            {run1.machine_id: run1, run2.machine_id: run2})
+
+        status = self.status()
+        self.assertEqual([m.name for m in status.machines],
+                         ['machine1', 'machine2'])
+        self.assertEqual(status.num_pages, 1)
+        self.assertEqual([(row[0][1], row[1:]) for row in status.tests],
+                         [('bar', [1.0, 0.5, 1.0]),
+                          ('foo', [0.5, 0.5, -0.5])])
+
+        globalstatus.PAGE_SIZE = 1
+        status = self.status(page=2)
+        self.assertEqual(status.num_pages, 2)
+        self.assertEqual([row[0][1] for row in status.tests], ['foo'])
+        globalstatus.PAGE_SIZE = 100
+
+        # Replacing a run computes its deltas again.
+        self.submit('machine2', '200', {'foo': 8.0, 'bar': 1.0},
+                    merge_run='replace')
+        self.assertEqual([row[1:] for row in self.status().tests],
+                         [[1.0, 0.5, 1.0], [0.5, 0.5, 0.0]])
+
+        # Deleting a baseline run drops the deltas against it.
+        self.session.delete(base2)
+        self.session.commit()
+        self.assertEqual(self.deltas(), [(run1.id, base1.id)])
+        status = self.status()
+        self.assertEqual([row[1:] for row in status.tests],
+                         [[0.5, 0.5, 0.0], [0.5, 0.5, 0.0]])
+
+    def test_import_during_status(self):
+        self.status()
+
+        # The deltas of a run stored while it was replaced, before the import
+        # could discard them, are out of date.
+        discard = self.ts.discard_baseline_deltas
+        self.ts.discard_baseline_deltas = lambda *args: None
+        try:
+            self.submit('machine2', '200', {'foo': 8.0, 'bar': 1.0},
+                        merge_run='replace')
+        finally:
+            self.ts.discard_baseline_deltas = discard
+        self.assertEqual([row[1:] for row in self.status().tests],
+                         [[1.0, 0.5, 1.0], [0.5, 0.5, 0.0]])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -0,0 +1,76 @@
+# Check that the analysis of run reports is cached until the runs compared
+# change.
+#
+# RUN: python %s
+
+import unittest, sys, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../db/Inputs'))
+import filled_instance
+import lnt.util.stats
+from lnt.server.reporting.runs import generate_run_data, report_cache
+
+
+class RunReportCacheTest(filled_instance.FilledInstanceTest):
+    def setUp(self):
+        super(RunReportCacheTest, self).setUp()
+        report_cache.clear()
+        for order in ('100', '200', '300'):
+            self.submit(order)
+
+    def submit(self, order, merge_run='reject', db=None):
+        session = db.make_session() if db is not None else None
+        result = self.import_report(
+            filled_instance.read_report('machine1', order), db=db,
+            session=session, merge_run=merge_run)
+        self.assertTrue(result.get('success', False))
+
+    def get_run(self, order):
+        ts = self.ts
+        return self.session.query(ts.Run).join(ts.Machine).join(ts.Order) \
+            .filter(ts.Machine.name == 'machine1') \
+            .filter(ts.Order.llvm_project_revision == order).one()
+
+    def report(self, **kwargs):
+        return generate_run_data(self.session, self.get_run('300'),
+                                 'http://localhost/db_default',
+                                 num_comparison_runs=2, **kwargs)
+
+    def test_cache(self):
+        data = self.report()
+        self.assertEqual(data['compare_to'].id, self.get_run('200').id)
+
+        # The same report reuses the analysis.
+        self.assertIs(self.report()['sri'], data['sri'])
+
+        # Different options do not.
+        data_median = self.report(aggregation_fn=lnt.util.stats.median)
+        self.assertIsNot(data_median['sri'], data['sri'])
+        self.assertIs(self.report(aggregation_fn=lnt.util.stats.median)['sri'],
+                      data_median['sri'])
+        self.assertIsNot(self.report(confidence_lv=.01)['sri'], data['sri'])
+
+        # A run outside of the windows does not.
+        self.submit('400')
+        self.assertIs(self.report()['sri'], data['sri'])
+        self.assertIsNone(self.get_run('300').change_count)
+
+        # A run added to the comparison window makes a new analysis.
+        self.submit('150')
+        data2 = self.report()
+        self.assertIsNot(data2['sri'], data['sri'])
+        self.assertIs(self.report()['sri'], data2['sri'])
+
+        # So does a run replaced by another process, with the same ID and
+        # times.
+        other_db = self.instance.config.get_database('default')
+        self.submit('200', merge_run='replace', db=other_db)
+        self.session.expire_all()
+        data3 = self.report()
+        self.assertIsNot(data3['sri'], data2['sri'])
+        self.assertEqual(data3['compare_to'].id, self.get_run('200').id)
+        self.assertEqual(self.get_run('200').change_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
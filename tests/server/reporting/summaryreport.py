@@ -0,0 +1,126 @@
+# Check that the summary report reuses the data of the machines and orders it
+# reports on until their runs change.
+#
+# RUN: python %s
+
+import unittest, sys, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../db/Inputs'))
+import filled_instance
+from lnt.server.reporting.summaryreport import SummaryReport
+
+
+class SummaryReportDataTest(filled_instance.FilledInstanceTest):
+    def setUp(self):
+        super(SummaryReportDataTest, self).setUp()
+        self.submit('machine1', '100', 2.0)
+        self.submit('machine1', '200', 3.0)
+        self.submit('machine2', '100', 4.0)
+        self.submit('machine2', '200', 2.0)
+
+    def submit(self, machine, order, compile_time, merge_run='reject'):
+        data = filled_instance.read_report(machine, order) \
+            .replace('"tag": "nts"', '"tag": "nts", "OPTFLAGS": "-O3"') \
+            .replace('nts.foo.', 'nts.SingleSource/foo.') \
+            .replace(' 1.3\n', ' %s\n' % compile_time)
+        result = self.import_report(data, merge_run=merge_run)
+        self.assertTrue(result.get('success', False))
+
+    def report(self):
+        report = SummaryReport(self.db, [('first', ['100']),
+                                         ('second', ['200'])],
+                               ['machine1'], ['machine2'])
+        report.build(self.session)
+        return report
+
+    def snapshots(self):
+        return self.session.query(self.ts.SummaryReportData.id).all()
+
+    def test_summary_report(self):
+        report = self.report()
+        self.assertEqual(report.data_table[
+            ('SingleSource/foo', 'Compile Time', 'x86', 'Release',
+             'machine1')], [[2.0], [3.0]])
+        self.assertEqual(report.data_table[
+            ('SingleSource/foo', 'Execution Time', 'x86', 'Release',
+             'machine2')], [[1.4], [1.4]])
+        key = ('Lmark', 'Compile Time', 'Release', 'x86')
+        self.assertEqual(report.normalized_data_table[key].getvalue(),
+                         [1.0, 1.0])
+        self.assertEqual(report.grouped_table[('Compile Time', 'Release')],
+                         [('Lmark', 'x86', [1.0, 1.0])])
+        snapshots = self.snapshots()
+        self.assertEqual(len(snapshots), 4)
+
+        # The report is built from the stored data.
+        report = self.report()
+        self.assertEqual(report.normalized_data_table[key].getvalue(),
+                         [1.0, 1.0])
+        self.assertEqual(self.snapshots(), snapshots)
+
+        # A new run discards the data of its machine and order.
+        self.submit('machine1', '200', 1.0, merge_run='append')
+        self.assertEqual(len(self.snapshots()), 3)
+        report = self.report()
+        self.assertEqual(report.data_table[
+            ('SingleSource/foo', 'Compile Time', 'x86', 'Release',
+             'machine1')], [[2.0], [3.0, 1.0]])
+        self.assertEqual(report.normalized_data_table[key].getvalue(),
+                         [1.0, 0.75])
+        self.assertEqual(len(self.snapshots()), 4)
+
+        # So does a deleted run.
+        for run in self.session.query(self.ts.Run).join(self.ts.Machine) \
+                .filter(self.ts.Machine.name == 'machine2'):
+            self.session.delete(run)
+        self.session.commit()
+        self.assertEqual(len(self.snapshots()), 2)
+        report = self.report()
+        self.assertEqual(report.normalized_data_table[key].getvalue(),
+                         [1.0, 1.0])
+
+    def test_import_during_report(self):
+        key = ('Lmark', 'Compile Time', 'Release', 'x86')
+        self.report()
+
+        # A report stores the data of a run imported while it was computed,
+        # before the import could discard it; the data is out of date.
+        discard = self.ts.discard_summary_report_data
+        self.ts.discard_summary_report_data = lambda *args: None
+        try:
+            self.submit('machine1', '200', 1.0, merge_run='append')
+        finally:
+            self.ts.discard_summary_report_data = discard
+        self.assertEqual(len(self.snapshots()), 4)
+        report = self.report()
+        self.assertEqual(report.normalized_data_table[key].getvalue(),
+                         [1.0, 0.75])
+        self.assertEqual(len(self.snapshots()), 4)
+
+    def test_concurrent_reports(self):
+        # Another request storing the same data meanwhile neither fails the
+        # report nor leaves duplicate rows.
+        other_session = self.db.make_session()
+        compute = SummaryReport._compute_datapoints
+
+        def compute_and_store(report, session, ts, machine_orders):
+            SummaryReport._compute_datapoints = compute
+            SummaryReport(self.db, [('first', ['100'])],
+                          ['machine1'], []).build(other_session)
+            return compute(report, session, ts, machine_orders)
+        SummaryReport._compute_datapoints = compute_and_store
+        try:
+            report = SummaryReport(self.db, [('first', ['100'])],
+                                   ['machine1'], [])
+            report.build(self.session)
+        finally:
+            SummaryReport._compute_datapoints = compute
+            other_session.close()
+        self.assertEqual(report.data_table[
+            ('SingleSource/foo', 'Compile Time', 'x86', 'Release',
+             'machine1')], [[2.0]])
+        self.assertEqual(len(self.snapshots()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
@@ -405,6 +405,17 @@ def main():
                expected_code=HTTP_NOT_FOUND)
     #  Check baselines work.
     check_html(client, '/v4/nts/graph?plot.0=1.3.2&baseline.60=3')
+    # Check several plots are loaded together.
+    graph = check_json(client, '/v4/nts/graph?plot.0=1.3.2&plot.1=2.4.3'
+                               '&plot.2=1.4.2&baseline.60=3&json=true')
+    assert sorted(l['url'] for l in graph['legend'] if l['url']) == \
+        ['1/3/2', '1/4/2', '2/4/3']
+    # Check the number of points per line can be limited.
+    graph = check_json(client, '/v4/nts/graph?plot.0=2.6.2&max_points=2'
+                               '&json=true')
+    assert all(len(plot['data']) <= 2 for plot in graph['data'])
+    check_code(client, '/v4/nts/graph?plot.0=2.6.2&max_points=-1',
+               expected_code=HTTP_BAD_REQUEST)
 
     # Check some variations of the daily report work.
     check_html(client, '/v4/nts/daily_report/2012/4/12')
@@ -596,6 +607,17 @@ def main():
     check_html(client, '/v4/nts/regressions/')
     check_html(client, '/v4/nts/regressions/?machine_filter=machine2')
     check_html(client, '/v4/nts/regressions/?machine_filter=machine0')
+    # The regression list and triage pages are paginated by id.
+    resp = check_html(client, '/v4/nts/regressions/?state=-1&before=2')
+    assert 'regressions/1"' in resp.data
+    resp = check_html(client, '/v4/nts/regressions/?state=-1&before=1')
+    assert 'regressions/1"' not in resp.data
+    check_html(client, '/v4/nts/regressions/new')
+    check_html(client, '/v4/nts/regressions/new?page_size=1&before=2')
+    check_code(client, '/v4/nts/regressions/new?page_size=0',
+               expected_code=HTTP_BAD_REQUEST)
+    check_code(client, '/v4/nts/regressions/?page_size=-1',
+               expected_code=HTTP_BAD_REQUEST)
 
     check_html(client, '/v4/nts/regressions/1')
 
@@ -622,6 +644,12 @@ def main():
     lines_in_function = len(code_for_fn)
     assert 2 == lines_in_function
 
+    code_columns = check_json(client, 'v4/nts/profile/ajax/getCodeForFunction?runid=10&testid=10&f=fn1&columns=1')
+    assert code_columns['text'] == [line[2] for line in code_for_fn]
+    assert code_columns['addresses'] == [line[1] for line in code_for_fn]
+    assert code_columns['counters']['cycles'] == \
+        [line[0]['cycles'] for line in code_for_fn]
+
     # Make sure the new option does not break anything
     check_html(client, '/db_default/v4/nts/graph?switch_min_mean=yes&plot.0=1.3.2&submit=Update')
     check_json(client, '/db_default/v4/nts/graph?switch_min_mean=yes&plot.0=1.3.2&json=true&submit=Update')
@@ -639,7 +667,10 @@ def main():
     check_html(client, '/rules')
     check_html(client, '/log')
     resp = check_code(client, '/__health')
-    assert resp.data == "Ok"
+    health = resp.data.split("\n")
+    assert health[0] == "Ok"
+    assert health[1].startswith("default: checkouts=")
+    assert "connects=" in health[1]
     resp = check_code(client, '/ping')
     assert resp.data == "pong"
 
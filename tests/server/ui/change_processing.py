@@ -9,6 +9,7 @@
 
 import datetime
 import logging
+import random
 import sys
 import unittest
 
@@ -16,7 +17,9 @@ from lnt.server.config import Config
 from lnt.server.db import v4db
 from lnt.server.db.fieldchange import delete_fieldchange
 from lnt.server.db.fieldchange import is_overlaping, identify_related_changes
+from lnt.server.db.fieldchange import _IndexedChange, _IntervalTree
 from lnt.server.db.regression import rebuild_title, RegressionState
+from lnt.server.db.regression import update_regression_summaries
 from lnt.server.db.rules import rule_update_fixed_regressions
 
 logging.basicConfig(level=logging.DEBUG)
@@ -189,6 +192,23 @@ class ChangeProcessingTests(unittest.TestCase):
         expected_title = "Regression of 6 benchmarks: foo, bar"
         self.assertEquals(r2.title, expected_title)
 
+    def test_interval_tree(self):
+        random.seed(0)
+        changes = []
+        for i in range(200):
+            start = random.randint(0, 100)
+            end = start + random.randint(0, 10)
+            changes.append(_IndexedChange(i, None, None, None, None, start,
+                                          end))
+        tree = _IntervalTree(changes)
+        for start in range(-5, 110, 3):
+            end = start + random.randint(0, 10)
+            expected = [c for c in changes
+                        if c.start <= end and c.end >= start]
+            found = sorted(tree.overlapping(start, end),
+                           key=lambda c: c.seq)
+            self.assertEqual(found, expected)
+
     def test_regression_evolution(self):
         session = self.session
         ts_db = self.ts_db
@@ -202,6 +222,52 @@ class ChangeProcessingTests(unittest.TestCase):
         delete_fieldchange(session, ts_db, self.field_change2)
         delete_fieldchange(session, ts_db, self.field_change3)
 
+    def test_regression_summary(self):
+        session = self.session
+        ts_db = self.ts_db
+        self.field_change.old_value = 1.0
+        self.field_change.new_value = 2.0
+        self.field_change2.old_value = 3.0
+        self.field_change2.new_value = 4.0
+        self.field_change3.old_value = 5.0
+        self.field_change3.new_value = 6.0
+        session.commit()
+
+        def summarize():
+            update_regression_summaries(session, ts_db, [self.regression.id])
+            session.commit()
+            return session.query(ts_db.RegressionSummary).one()
+
+        summary = summarize()
+        self.assertEqual(summary.num_indicators, 2)
+        self.assertEqual(summary.machines, "test-machine")
+        self.assertEqual(summary.impact_previous, 4.0)
+        self.assertEqual(summary.impact_current, 6.0)
+        self.assertEqual(summary.age, self.run.end_time)
+
+        # Changes to the indicators and their field changes discard the
+        # summary.
+        self.field_change.new_value = 3.0
+        session.commit()
+        self.assertEqual(session.query(ts_db.RegressionSummary).count(), 0)
+        self.assertEqual(summarize().impact_current, 7.0)
+
+        session.add(ts_db.RegressionIndicator(self.regression,
+                                              self.field_change3))
+        session.commit()
+        self.assertEqual(session.query(ts_db.RegressionSummary).count(), 0)
+        self.assertEqual(summarize().num_indicators, 3)
+
+        self.machine.name = "renamed-machine"
+        session.commit()
+        self.assertEqual(summarize().machines, "renamed-machine")
+
+        session.delete(self.regression_indicator1)
+        session.delete(self.regression_indicator2)
+        session.delete(self.regression)
+        session.commit()
+        self.assertEqual(session.query(ts_db.RegressionSummary).count(), 0)
+
     def test_run_deletion(self):
         """Do the FC and RIs get cleaned up when runs are deleted?"""
         session = self.session
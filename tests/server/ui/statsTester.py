@@ -52,6 +52,28 @@ class TestLNTStatsTester(unittest.TestCase):
             (value, index) for (index, value) in enumerate(test_list3))
         self.assertEqual((1.0, INDEX), (agg_value, agg_index))
 
+    def test_moving_windows(self):
+        values = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0, 5.0, 3.0, 5.0]
+        for window_size in (0, 1, 2, 5, 20):
+            windows = [values[max(0, i - window_size):i + window_size]
+                       for i in range(len(values))]
+            averages = stats.moving_average(values, window_size)
+            for average, window in zip(averages, windows):
+                if window:
+                    self.assertAlmostEqual(average, stats.mean(window))
+                else:
+                    self.assertIsNone(average)
+            self.assertEqual(stats.moving_median(values, window_size),
+                             [stats.median(window) for window in windows])
+        self.assertEqual(stats.moving_average([], 3), [])
+        self.assertEqual(stats.moving_median([], 3), [])
+
+    def test_exponential_moving_average(self):
+        self.assertEqual(stats.exponential_moving_average([], .5), [])
+        self.assertEqual(
+            stats.exponential_moving_average([2.0, 4.0, 4.0, 0.0], .5),
+            [2.0, 3.0, 3.5, 1.75])
+
 if __name__ == '__main__':
     try:
         unittest.main()
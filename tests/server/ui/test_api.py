@@ -9,6 +9,7 @@
 
 from V4Pages import check_json
 import lnt.server.db.migrate
+from lnt.server.db.export import read_columnar
 import lnt.server.ui.app
 import logging
 import sys
@@ -195,6 +196,27 @@ class JSONAPITester(unittest.TestCase):
         self.assertEquals(sample_expected_response, j['samples'][0])
         check_json(client, 'api/db_default/v4/nts/samples/1000', expected_code=404)
 
+    def test_samples_export_api(self):
+        """Check the columnar samples export."""
+        client = self.client
+        resp = client.get('api/db_default/v4/nts/samples/export?machine=2'
+                          '&field=compile_time&min_order=152293'
+                          '&max_order=152294&chunk_size=2')
+        self.assertEqual(resp.status_code, 200)
+        chunks = list(read_columnar(resp.data.splitlines()))
+        self.assertTrue(chunks)
+        self.assertTrue(all(len(c['run_id']) <= 2 for c in chunks))
+        orders = set(o for c in chunks for o in c['order'])
+        self.assertEqual(orders, set([u'152293', u'152294']))
+        self.assertEqual(sorted(chunks[0].keys()),
+                         ['compile_time', 'machine', 'order', 'run_id',
+                          'test'])
+
+        check_json(client, 'api/db_default/v4/nts/samples/export?machine=x',
+                   expected_code=400)
+        check_json(client, 'api/db_default/v4/nts/samples/export?field=x',
+                   expected_code=400)
+
     def test_graph_api(self):
         """Check that /graph/x/y/z returns what we expect."""
         client = self.client
@@ -209,6 +231,26 @@ class JSONAPITester(unittest.TestCase):
         # self._check_response_is_well_formed(j)
         self.assertEqual(graph_data2, j2)
 
+        # And that max_points downsamples, keeping the end points.
+        j3 = check_json(client,
+                        'api/db_default/v4/nts/graph/2/4/3?max_points=2')
+        self.assertEqual(graph_data, j3)
+        j4 = check_json(client,
+                        'api/db_default/v4/nts/graph/2/4/3?max_points=1')
+        self.assertEqual(graph_data[:1], j4)
+
+        # Longer series go through the buckets of the downsampling, whose x
+        # coordinates are revision tuples.
+        j5 = check_json(client, 'api/db_default/v4/nts/graph/2/9/3')
+        self.assertEqual(len(j5), 4)
+        j6 = check_json(client,
+                        'api/db_default/v4/nts/graph/2/9/3?max_points=3')
+        self.assertEqual([j5[0], j5[2], j5[3]], j6)
+        check_json(client, 'api/db_default/v4/nts/graph/2/9/3?max_points=x',
+                   expected_code=400)
+        check_json(client, 'api/db_default/v4/nts/graph/2/9/3?max_points=-1',
+                   expected_code=400)
+
     def test_samples_api(self):
         """Samples API."""
         client = self.client
@@ -1,5 +1,6 @@
 # RUN: python %s
 import unittest, logging, sys, copy, tempfile, io
+from array import array
 from lnt.testing.profile.profilev2impl import ProfileV2
 from lnt.testing.profile.profilev1impl import ProfileV1
 
@@ -38,6 +39,56 @@ class ProfileV2Test(unittest.TestCase):
         l2 = self.test_data['functions']['fn1']['data']
         self.assertEqual(l, l2)
 
+    def test_lazy_deserialize(self):
+        data = copy.deepcopy(self.test_data)
+        data['functions']['fn2'] = {
+            'counters': {'cycles': 55.0},
+            'data': [({'cycles': float(i)}, 0x200000 + 4 * i, 'nop %d' % i)
+                     for i in range(1000)]
+        }
+        p = ProfileV2.upgrade(ProfileV1(copy.deepcopy(data)))
+        with tempfile.NamedTemporaryFile() as f:
+            p.serialize(f.name)
+            p2 = ProfileV2.deserialize(open(f.name, 'rb'))
+
+            # Reading the index does not decompress anything.
+            self.assertEqual(p2.getFunctions(), p.getFunctions())
+            self.assertEqual(p2.getTopLevelCounters(), data['counters'])
+            for section in (p2.lc, p2.la, p2.lt):
+                self.assertEqual(len(section.data.data), 0)
+
+            l = list(p2.getCodeForFunction('fn2'))
+            self.assertEqual(l, data['functions']['fn2']['data'])
+            l = list(p2.getCodeForFunction('fn1'))
+            self.assertEqual(l, data['functions']['fn1']['data'])
+
+            # A lazily read profile can be written again.
+            p3 = ProfileV2.deserialize(io.BytesIO(p2.serialize()))
+            l = list(p3.getCodeForFunction('fn2'))
+            self.assertEqual(l, data['functions']['fn2']['data'])
+
+    def test_getCodeColumnsForFunction(self):
+        p = ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
+        p2 = ProfileV2.deserialize(io.BytesIO(p.serialize()))
+        for impl in (p, p2):
+            counters, addresses, texts = impl.getCodeColumnsForFunction('fn1')
+            self.assertEqual(counters, {'cycles': array('f', [0.0, 100.0]),
+                                        'branch-misses': array('f', [0.0, 0.0])})
+            self.assertEqual(list(addresses), [0x100000, 0x100004])
+            self.assertEqual(texts, ['add r0, r0, r0', 'sub r1, r0, r0'])
+
+    def test_kernel_addresses(self):
+        # Kernel addresses do not fit in a C long.
+        data = copy.deepcopy(self.test_data)
+        data['functions']['fn1']['data'] = [
+            ({'cycles': 1.0}, 0xffffffff81000000, 'nop'),
+            ({'cycles': 2.0}, 0xffffffff81000004, 'nop')]
+        p = ProfileV2.upgrade(ProfileV1(copy.deepcopy(data)))
+        p2 = ProfileV2.deserialize(io.BytesIO(p.serialize()))
+        l = list(p2.getCodeForFunction('fn1'))
+        self.assertEqual([address for _, address, _ in l],
+                         [0xffffffff81000000, 0xffffffff81000004])
+
     def test_getFunctions(self):
         p = ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
         self.assertEqual(p.getFunctions(),
@@ -0,0 +1,94 @@
+# RUN: python %s
+import unittest, logging, sys, copy, tempfile, io
+from lnt.testing.profile.profilev3impl import ProfileV3
+from lnt.testing.profile.profilev2impl import ProfileV2
+from lnt.testing.profile.profilev1impl import ProfileV1
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+class ProfileV3Test(unittest.TestCase):
+    def setUp(self):
+        self.test_data = {
+            'counters': {'cycles': 12345.0, 'branch-misses': 200.0},
+            'disassembly-format': 'raw',
+            'functions': {
+                'fn1': {
+                    'counters': {'cycles': 45.0, 'branch-misses': 10.0},
+                    'data': [
+                        ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000, 'add r0, r0, r0'),
+                        ({'branch-misses': 0.0, 'cycles': 100.0}, 0x100004, 'sub r1, r0, r0')
+                    ]
+                },
+                'fn2': {
+                    'counters': {'cycles': 55.0},
+                    'data': [({'cycles': float(i)}, 0x200000 + 4 * i, 'nop %d' % i)
+                             for i in range(1000)]
+                }
+            }
+        }
+
+    def upgrade(self):
+        v2 = ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
+        return ProfileV3.upgrade(v2)
+
+    def test_serialize(self):
+        p = self.upgrade()
+        with tempfile.NamedTemporaryFile() as f:
+            p.serialize(f.name)
+            self.assertTrue(ProfileV3.checkFile(f.name))
+            self.assertFalse(ProfileV2.checkFile(f.name))
+
+    def test_deserialize(self):
+        p = self.upgrade()
+        with tempfile.NamedTemporaryFile() as f:
+            p.serialize(f.name)
+            p2 = ProfileV3.deserialize(open(f.name, 'rb'))
+
+            self.assertEqual(p2.getFunctions(), p.getFunctions())
+            self.assertEqual(p2.getTopLevelCounters(),
+                             self.test_data['counters'])
+            self.assertEqual(p2.getDisassemblyFormat(), 'raw')
+            for fname in ('fn1', 'fn2'):
+                l = list(p2.getCodeForFunction(fname))
+                self.assertEqual(l, self.test_data['functions'][fname]['data'])
+
+            # A profile read from a file can be written again.
+            p3 = ProfileV3.deserialize(io.BytesIO(p2.serialize()))
+            l = list(p3.getCodeForFunction('fn2'))
+            self.assertEqual(l, self.test_data['functions']['fn2']['data'])
+
+    def test_kernel_addresses(self):
+        # Kernel addresses do not fit in a C long.
+        self.test_data['functions']['fn1']['data'] = [
+            ({'cycles': 1.0}, 0xffffffff81000000, 'nop'),
+            ({'cycles': 2.0}, 0xffffffff81000004, 'nop')]
+        p = ProfileV3.deserialize(io.BytesIO(self.upgrade().serialize()))
+        l = list(p.getCodeForFunction('fn1'))
+        self.assertEqual([address for _, address, _ in l],
+                         [0xffffffff81000000, 0xffffffff81000004])
+
+    def test_upgrade_deserialized(self):
+        v2 = ProfileV2.upgrade(ProfileV1(copy.deepcopy(self.test_data)))
+        v2 = ProfileV2.deserialize(io.BytesIO(v2.serialize()))
+        p = ProfileV3.deserialize(io.BytesIO(ProfileV3.upgrade(v2).serialize()))
+        l = list(p.getCodeForFunction('fn1'))
+        self.assertEqual(l, self.test_data['functions']['fn1']['data'])
+
+    def test_default_codec(self):
+        # Profiles are written with zlib, which every server can read, unless
+        # another codec is chosen.
+        p = ProfileV3.deserialize(io.BytesIO(self.upgrade().serialize()))
+        self.assertEqual(p.codec, 'zlib')
+        p = ProfileV3.deserialize(io.BytesIO(p.serialize(codec='zlib')))
+        self.assertEqual(p.codec, 'zlib')
+        l = list(p.getCodeForFunction('fn1'))
+        self.assertEqual(l, self.test_data['functions']['fn1']['data'])
+
+    def test_unknown_codec(self):
+        p = self.upgrade()
+        p.codec = 'snappy'
+        self.assertRaises(RuntimeError, p.serialize)
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
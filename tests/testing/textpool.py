@@ -0,0 +1,125 @@
+# RUN: python %s
+import unittest, logging, sys, copy, tempfile, shutil, os, time
+from lnt.testing.profile.profile import Profile
+from lnt.testing.profile.profilev3impl import ProfileV3
+from lnt.testing.profile.profilev2impl import ProfileV2
+from lnt.testing.profile.profilev1impl import ProfileV1
+from lnt.testing.profile.textpool import TextPoolStore
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+class TextPoolStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.test_data = {
+            'counters': {'cycles': 12345.0, 'branch-misses': 200.0},
+            'disassembly-format': 'raw',
+            'functions': {
+                'fn1': {
+                    'counters': {'cycles': 45.0, 'branch-misses': 10.0},
+                    'data': [
+                        ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000, 'add r0, r0, r0'),
+                        ({'branch-misses': 0.0, 'cycles': 100.0}, 0x100004, 'sub r1, r0, r0')
+                    ]
+                },
+                'fn2': {
+                    'counters': {'cycles': 55.0},
+                    'data': [({'cycles': float(i)}, 0x200000 + 4 * i, 'nop %d' % i)
+                             for i in range(100)]
+                }
+            }
+        }
+        self.dir = tempfile.mkdtemp()
+        self.store = TextPoolStore(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def v2(self, data=None):
+        return ProfileV2.upgrade(ProfileV1(copy.deepcopy(data or self.test_data)))
+
+    def save(self, impl, prefix='t-foo-s-'):
+        return Profile(impl).save(profileDir=self.dir, prefix=prefix,
+                                  pool_store=self.store)
+
+    def load(self, fname):
+        return Profile.fromFile(os.path.join(self.dir, fname))
+
+    def check(self, p, data=None):
+        data = data or self.test_data
+        for fname in data['functions']:
+            self.assertEqual(list(p.getCodeForFunction(fname)),
+                             data['functions'][fname]['data'])
+
+    def test_shared(self):
+        fnames = [self.save(self.v2()),
+                  self.save(ProfileV3.upgrade(self.v2())),
+                  self.save(self.v2())]
+        profiles = [self.load(fname) for fname in fnames]
+        self.assertEqual([p.getVersion() for p in profiles], [2, 3, 2])
+        for p in profiles:
+            self.check(p)
+
+        # All three profiles share the same pool.
+        refs = set(p.getTextPoolReference() for p in profiles)
+        self.assertEqual(len(refs), 1)
+        ref = refs.pop()
+        self.assertTrue(os.path.exists(self.store.getPath(ref)))
+
+        # Rendering a pooled profile includes its text.
+        p = Profile.fromRendered(profiles[0].render())
+        self.assertEqual(p.getTextPoolReference(), None)
+        self.check(p)
+
+    def test_reuse(self):
+        p1 = self.load(self.save(ProfileV3.upgrade(self.v2())))
+
+        # A profile with a few different strings extends the pool of the
+        # previous one.
+        data = copy.deepcopy(self.test_data)
+        data['functions']['fn1']['data'][0] = \
+            ({'branch-misses': 0.0, 'cycles': 0.0}, 0x100000, 'mul r0, r0, r0')
+        p2 = self.load(self.save(ProfileV3.upgrade(self.v2(data))))
+        self.check(p1)
+        self.check(p2, data)
+        self.assertNotEqual(p1.getTextPoolReference(),
+                            p2.getTextPoolReference())
+        self.assertEqual(self.store.getLatest('t-foo-s-')[1],
+                         p2.getTextPoolReference())
+
+        # Profiles of other tests do not share the pool.
+        p3 = self.load(self.save(self.v2(), prefix='t-bar-s-'))
+        self.assertNotEqual(p3.getTextPoolReference(),
+                            p2.getTextPoolReference())
+
+        # A profile using little of the pool does not pass it on.
+        data = copy.deepcopy(self.test_data)
+        del data['functions']['fn2']
+        p4 = self.load(self.save(self.v2(data)))
+        self.check(p4, data)
+        self.assertEqual(p4.getTextPoolReference(),
+                         p2.getTextPoolReference())
+        self.assertEqual(self.store.getLatest('t-foo-s-'), (None, None))
+
+    def test_collect(self):
+        start = time.time()
+        fname = self.save(self.v2())
+        ref = self.load(fname).getTextPoolReference()
+        self.assertEqual(self.store.collect([ref]), [])
+        self.assertTrue(os.path.exists(self.store.getPath(ref)))
+
+        # Pools added since the profiles were looked up are kept.
+        os.remove(os.path.join(self.dir, fname))
+        self.assertEqual(self.store.collect([], start), [])
+        self.assertEqual(self.store.collect([]), [ref])
+        self.assertFalse(os.path.exists(self.store.getPath(ref)))
+        self.assertEqual(self.store.getLatest('t-foo-s-'), (None, None))
+
+    def test_empty_file(self):
+        # The file of a profile which is still being saved.
+        path = os.path.join(self.dir, 't-foo-s-empty.lntprof')
+        open(path, 'w').close()
+        self.assertRaises(RuntimeError, Profile.fromFile, path)
+
+if __name__ == '__main__':
+    unittest.main(argv=[sys.argv[0], ])
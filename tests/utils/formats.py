@@ -0,0 +1,79 @@
+# Check that formats are guessed from the leading bytes of files, and that
+# streamed JSON reports read the same as loaded ones.
+#
+# RUN: python %s %S/../Formats/Inputs %t
+
+import json
+import os
+import sys
+import unittest
+
+import lnt.formats
+import lnt.formats.JSONFormat as JSONFormat
+
+inputs = ''
+tmp_path = ''
+
+
+class FormatsTest(unittest.TestCase):
+    def write(self, text):
+        with open(tmp_path, 'wb') as f:
+            f.write(text)
+        return tmp_path
+
+    def stream(self, text):
+        data = lnt.formats.read_any(self.write(text), 'json', stream=True)
+        for key in ('tests', 'Tests'):
+            if key in data:
+                data[key] = list(data[key])
+        return data
+
+    def test_guess_format(self):
+        for name, format in [('test.json', 'json'), ('test.plist', 'plist'),
+                             ('test.nightlytest', None)]:
+            path = os.path.join(inputs, name)
+            f = lnt.formats.guess_format(path)
+            self.assertEqual(f and f['name'], format)
+            with open(path) as fileobj:
+                f = lnt.formats.guess_format(fileobj)
+                self.assertEqual(f and f['name'], format)
+                self.assertEqual(fileobj.tell(), 0)
+
+    def test_stream(self):
+        report = {
+            'format_version': '2',
+            'machine': {'name': 'm "[{', 'os': u'\xe9t\xe9'},
+            'tests': [{'name': 'test%d' % i,
+                       'execution_time': [i * 0.5, i + 1e-3],
+                       'profile': 'x]}\\"' * i}
+                      for i in range(50)],
+            'run': {'start_time': '2017-01-01 00:00:00', 'n': 12345678},
+        }
+        text = json.dumps(report)
+        JSONFormat._BLOCK_SIZE = 7
+        try:
+            self.assertEqual(self.stream(text), report)
+            self.assertEqual(self.stream(json.dumps(report, indent=2)),
+                             report)
+        finally:
+            JSONFormat._BLOCK_SIZE = 1 << 16
+
+        # The tests are read again every time they are iterated over.
+        data = lnt.formats.read_any(self.write(text), '<auto>', stream=True)
+        self.assertEqual(list(data['tests']), report['tests'])
+        self.assertEqual(list(data['tests']), report['tests'])
+
+        self.assertEqual(self.stream('{}'), {})
+        self.assertEqual(self.stream('{"Tests": [], "run": 1}'),
+                         {'Tests': [], 'run': 1})
+
+    def test_stream_errors(self):
+        for text in ['{"tests": [1, 2}', '{"tests": [] "run": {}}',
+                     '{"tests": ["]', '{"a": 1} 2', '{1: 2}', '[]']:
+            self.assertRaises(ValueError, self.stream, text)
+
+
+if __name__ == '__main__':
+    tmp_path = sys.argv.pop(2)
+    inputs = sys.argv.pop(1)
+    unittest.main(argv=[sys.argv[0], ])